@@ -1,17 +1,41 @@
 import pandas as pd
+import numpy as np
 import os
+from collections import Counter
 from telebot import types
+from storage.ledger import EXPENSE_COLUMNS, to_timestamp
+from storage.workbook import WORKBOOK_LOCK, write_sheets
+
+# Amount is in the From account's currency, Received what the To account got in its own
+TRANSFER_COLUMNS = ["Date", "From", "To", "Amount", "Received"]
+
+
+def transfers_frame(rows):
+    """Transfers logged as {column: value} rows, with their dates parsed"""
+    df = pd.DataFrame(rows).reindex(columns=TRANSFER_COLUMNS)
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
 
 
 class AccountsCog:
-    def __init__(self, bot, allowed_user_id):
+    def __init__(self, bot, allowed_user_id, ledger):
         self.bot = bot
         self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
         self.data_file = "data.xlsx"
         self.sheet_name = "Accounts"
+        self.opening_balances = {}
+        # Currency of accounts that aren't in the base currency
+        self.currencies = {}
         self.accounts = self.load_accounts()
+        self.transfers = self.load_transfers()
+        # Running totals per account, kept up to date by the ledger listener methods below
+        self.flows = {}
         self.edit_account_session = {}
         self.onboarding_data = {}
+        self.transfer_session = {}
+        ledger.add_listener(self)
+        ledger.track_sheet("Transfers", transfers_frame)
 
         # Register command handlers
         @bot.message_handler(commands=['accounts'])
@@ -30,6 +54,26 @@ class AccountsCog:
         def edit_account_handler(message):
             self.edit_account_command(message)
 
+        @bot.message_handler(commands=['balances'])
+        def balances_handler(message):
+            self.balances_command(message)
+
+        @bot.message_handler(commands=['transfer'])
+        def transfer_handler(message):
+            self.transfer_command(message)
+
+        @bot.message_handler(commands=['setopening'])
+        def set_opening_handler(message):
+            self.set_opening_command(message)
+
+        @bot.message_handler(commands=['setcurrency'])
+        def set_currency_handler(message):
+            self.set_currency_command(message)
+
+        @bot.message_handler(commands=['rates'])
+        def rates_handler(message):
+            self.rates_command(message)
+
     def is_authorized(self, message):
         return message.from_user.id == self.ALLOWED_USER_ID
 
@@ -40,7 +84,8 @@ class AccountsCog:
         if os.path.exists(self.data_file):
             try:
                 df = pd.read_excel(self.data_file, sheet_name=self.sheet_name)
-                return df["Account"].tolist()
+                accounts, self.opening_balances, self.currencies = self.parse_accounts(df)
+                return accounts
             except Exception as e:
                 print(f"Error loading accounts from Excel: {e}")
                 # Create accounts sheet if it doesn't exist but file does
@@ -50,24 +95,96 @@ class AccountsCog:
             # File doesn't exist, will be created by categories cog or add cog
             return default_accounts
 
+    @staticmethod
+    def parse_accounts(df):
+        """The accounts, opening balances and currencies of an Accounts sheet"""
+        opening_balances = {}
+        currencies = {}
+        if "Opening Balance" in df.columns:
+            opening_balances = dict(zip(df["Account"], df["Opening Balance"].fillna(0.0)))
+        if "Currency" in df.columns:
+            currencies = {account: currency for account, currency
+                          in zip(df["Account"], df["Currency"].fillna("")) if currency}
+        return df["Account"].tolist(), opening_balances, currencies
+
+    def load_transfers(self):
+        """Load transfers between accounts from the Transfers sheet"""
+        if os.path.exists(self.data_file):
+            try:
+                return self.with_logged_transfers(pd.read_excel(self.data_file, sheet_name="Transfers"))
+            except Exception:
+                pass
+        return self.with_logged_transfers(pd.DataFrame(columns=TRANSFER_COLUMNS))
+
+    def with_logged_transfers(self, df):
+        """The saved transfers in df followed by those still only in the ledger's log"""
+        df = df.reindex(columns=TRANSFER_COLUMNS)
+        logged = self.ledger.logged_rows.get("Transfers")
+        if not logged:
+            return df
+        return pd.concat([df, transfers_frame(logged)], ignore_index=True) if not df.empty else transfers_frame(logged)
+
+    def reload(self):
+        """Read the accounts and transfers again after another process changed them"""
+        old_currencies = self.currencies
+        self.opening_balances = {}
+        self.currencies = {}
+        self.accounts = self.load_accounts()
+        self.transfers = self.load_transfers()
+        for account in set(old_currencies) | set(self.currencies):
+            if old_currencies.get(account) != self.currencies.get(account):
+                self.ledger.set_account_currency(account, self.currencies.get(account, ""))
+        self.flows = self.compute_flows()
+
+    def reload_sheets(self, frames):
+        """Apply Accounts and Transfers sheets edited outside the bot, returning a note per sheet that changed"""
+        notes = []
+        if self.sheet_name in frames:
+            accounts, opening_balances, currencies = self.parse_accounts(frames[self.sheet_name])
+            added = [account for account in accounts if account not in self.accounts]
+            removed = [account for account in self.accounts if account not in accounts]
+            changed = [account for account in accounts if account in self.accounts and (
+                opening_balances.get(account, 0.0) != self.opening_balances.get(account, 0.0)
+                or currencies.get(account) != self.currencies.get(account))]
+            old_currencies = self.currencies
+            self.accounts, self.opening_balances, self.currencies = accounts, opening_balances, currencies
+            # Only the rows of accounts whose currency changed are converted again
+            for account in set(old_currencies) | set(currencies):
+                if old_currencies.get(account) != currencies.get(account):
+                    self.ledger.set_account_currency(account, currencies.get(account, ""))
+            if added or removed or changed:
+                notes.append(f"accounts: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+
+        if "Transfers" in frames:
+            transfers = self.with_logged_transfers(frames["Transfers"])
+            old_rows = Counter(map(tuple, self.transfers.astype(str).to_numpy()))
+            new_rows = Counter(map(tuple, transfers.astype(str).to_numpy()))
+            # Balances move by the difference of each account's net transfers, not a recount
+            for sign, frame in ((-1, self.transfers), (1, transfers)):
+                for account, total in self.net_transfers(frame).items():
+                    self.flows.setdefault(account, self.empty_flows())["transfers"] += sign * total
+            self.transfers = transfers
+            if old_rows != new_rows:
+                notes.append(f"transfers: {sum((new_rows - old_rows).values())} added, "
+                             f"{sum((old_rows - new_rows).values())} removed")
+        return notes
+
+    def accounts_frame(self, accounts):
+        return pd.DataFrame({
+            "Account": accounts,
+            "Opening Balance": [self.opening_balances.get(account, 0.0) for account in accounts],
+            "Currency": [self.currencies.get(account, "") for account in accounts],
+        })
+
     def save_accounts(self, accounts):
         """Save accounts to Excel file"""
-        df = pd.DataFrame({"Account": accounts})
+        df = self.accounts_frame(accounts)
 
-        if os.path.exists(self.data_file):
-            try:
-                # Try to read all existing sheets to preserve them
-                with pd.ExcelWriter(self.data_file, mode='a', if_sheet_exists='replace') as writer:
-                    df.to_excel(writer, sheet_name=self.sheet_name, index=False)
-            except Exception as e:
-                print(f"Error appending to Excel file: {e}")
-                # If something goes wrong, just create a new file
-                with pd.ExcelWriter(self.data_file) as writer:
-                    df.to_excel(writer, sheet_name=self.sheet_name, index=False)
-        else:
-            # Create new file with only Accounts sheet
-            with pd.ExcelWriter(self.data_file) as writer:
-                df.to_excel(writer, sheet_name=self.sheet_name, index=False)
+        try:
+            # Rewrites the workbook atomically, preserving the other sheets (or creates it)
+            write_sheets(self.data_file, {self.sheet_name: df})
+        except Exception as e:
+            print(f"Error saving accounts to Excel: {e}")
 
     def get_accounts(self):
         """Return the current list of accounts"""
@@ -142,13 +259,14 @@ class AccountsCog:
             })
 
             # Create empty expenses sheet
-            expenses_df = pd.DataFrame(columns=["Name", "Account", "Category", "Amount"])
+            expenses_df = pd.DataFrame(columns=EXPENSE_COLUMNS)
 
             # Write all sheets to the Excel file
-            with pd.ExcelWriter(self.data_file) as writer:
-                pd.DataFrame({"Account": accounts}).to_excel(writer, sheet_name="Accounts", index=False)
-                categories_df.to_excel(writer, sheet_name="Categories", index=False)
-                expenses_df.to_excel(writer, sheet_name="Expenses", index=False)
+            write_sheets(self.data_file, {
+                "Accounts": self.accounts_frame(accounts),
+                "Categories": categories_df,
+                "Expenses": expenses_df,
+            })
 
             completion_message = (
                 "✅ Setup complete! Your accounts have been saved.\n\n"
@@ -290,6 +408,18 @@ class AccountsCog:
         def process_edit_account_callback(call):
             self.process_edit_account_callback_impl(call)
 
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('xfer_'))
+        def process_transfer_callback(call):
+            self.process_transfer_callback_impl(call)
+
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('currency_acc_'))
+        def process_currency_callback(call):
+            self.process_currency_callback_impl(call)
+
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('opening_acc_'))
+        def process_opening_callback(call):
+            self.process_opening_callback_impl(call)
+
     def onboarding_callback_handler(self, call):
         """Handle callbacks during onboarding"""
         user_id = call.from_user.id
@@ -338,10 +468,11 @@ class AccountsCog:
                 return
 
             self.accounts.remove(account_to_remove)
+            self.rename_account_state(account_to_remove, "[Deleted Account]")
             self.save_accounts(self.accounts)
 
-            # Update expenses sheet
-            updated_count = self.update_removed_account_in_excel(account_to_remove)
+            # Update existing expenses
+            updated_count = self.ledger.replace_value("Account", account_to_remove, "[Deleted Account]")
 
             message = f"Account '{account_to_remove}' has been removed."
             if updated_count > 0:
@@ -359,41 +490,6 @@ class AccountsCog:
                 text=f"Account '{account_to_remove}' not found or already removed."
             )
 
-    def update_removed_account_in_excel(self, removed_account):
-        """Update all instances of removed_account in the expenses sheet"""
-        updated_count = 0
-
-        try:
-            # Check if the Excel file exists
-            if not os.path.exists(self.data_file):
-                return updated_count
-
-            # Read the Excel file, expenses sheet
-            try:
-                df = pd.read_excel(self.data_file, sheet_name="Expenses")
-
-                # Check if the Account column exists
-                if 'Account' not in df.columns:
-                    return updated_count
-
-                # Find all rows with the removed account and update them
-                mask = df['Account'] == removed_account
-                updated_count = mask.sum()
-
-                if updated_count > 0:
-                    df.loc[mask, 'Account'] = "[Deleted Account]"
-
-                    # Save the updated dataframe back to the Excel file
-                    with pd.ExcelWriter(self.data_file, mode='a', if_sheet_exists='replace') as writer:
-                        df.to_excel(writer, sheet_name="Expenses", index=False)
-            except Exception as e:
-                print(f"Error updating expenses after account removal: {e}")
-
-            return updated_count
-        except Exception as e:
-            print(f"Error processing Excel file: {e}")
-            return updated_count
-
     def process_edit_account_callback_impl(self, call):
         """Process the account edit selection"""
         user_id = call.from_user.id
@@ -450,10 +546,11 @@ class AccountsCog:
         # Update the account in the list
         index = self.accounts.index(old_account)
         self.accounts[index] = new_account
+        self.rename_account_state(old_account, new_account)
         self.save_accounts(self.accounts)
 
-        # Update Excel sheet
-        updated_count = self.update_account_in_excel(old_account, new_account)
+        # Update existing expenses
+        updated_count = self.ledger.replace_value("Account", old_account, new_account)
 
         # Clean up session
         del self.edit_account_session[user_id]
@@ -467,37 +564,431 @@ class AccountsCog:
                               f"Account renamed from '{old_account}' to '{new_account}' successfully!\n"
                               f"No existing entries needed updating.")
 
-    def update_account_in_excel(self, old_account, new_account):
-        """Update all instances of old_account to new_account in the Excel file"""
-        updated_count = 0
+    def rename_account_state(self, old_account, new_account):
+        """Carry opening balance, running totals and transfers over to a renamed (or deleted) account
+
+        The caller saves the Accounts sheet afterwards.
+        """
+        if old_account in self.opening_balances:
+            opening = self.opening_balances.pop(old_account)
+            self.opening_balances[new_account] = self.opening_balances.get(new_account, 0.0) + opening
+        if old_account in self.currencies:
+            currency = self.currencies.pop(old_account)
+            # Rows merged into an account the ledger already knows take on that account's currency
+            if new_account not in self.ledger.dictionaries["Account"]:
+                self.currencies[new_account] = currency
+
+        with self.ledger.lock:
+            if old_account in self.flows:
+                old_flows = self.flows.pop(old_account)
+                new_flows = self.flows.setdefault(new_account, self.empty_flows())
+                for key, value in old_flows.items():
+                    new_flows[key] += value
+
+        if not self.transfers.empty:
+            mask = (self.transfers["From"] == old_account) | (self.transfers["To"] == old_account)
+            if mask.any():
+                with self.ledger.lock, WORKBOOK_LOCK:
+                    # Transfers still only in the log are saved first, so the sheet written below holds them
+                    self.ledger.checkpoint()
+                    self.transfers = self.transfers.replace({"From": {old_account: new_account},
+                                                             "To": {old_account: new_account}})
+                    write_sheets(self.data_file, {"Transfers": self.transfers})
+
+    # Balances: running totals per account, updated by the ledger on every insert
+
+    @staticmethod
+    def empty_flows():
+        return {"income": 0.0, "expenses": 0.0, "transfers": 0.0}
+
+    def on_load(self, ledger):
+        # Transfers replayed from the log are only known to the ledger until now
+        self.transfers = self.load_transfers()
+        self.flows = self.compute_flows()
+
+    def on_row(self, sheet_name, row):
+        """Add a transfer made here or by another process and move both accounts' running totals"""
+        if sheet_name != "Transfers":
+            return
+        transfer = transfers_frame([row])
+        self.transfers = pd.concat([self.transfers, transfer], ignore_index=True) if not self.transfers.empty \
+            else transfer
+        for account, total in self.net_transfers(transfer).items():
+            self.flows.setdefault(account, self.empty_flows())["transfers"] += total
+
+    def on_append(self, position, name, account, category, amount, timestamp):
+        """Update the running totals of the expense's account in O(1); negative amounts are income"""
+        self.apply_flow(account, self.ledger.account_amounts([position])[0], 1)
+
+    def on_update(self, position, old_row, new_row):
+        # The old amount in the account's currency is gone once the row changed, so recount
+        self.flows = self.compute_flows()
+
+    def on_delete(self, position, name, account, category, amount, timestamp):
+        self.apply_flow(account, self.ledger.account_amounts([position])[0], -1)
+
+    def on_rates(self, positions, old_base_amounts):
+        """Recount only the accounts whose totals depend on a changed rate
+
+        Totals are in each account's own currency, so an entry in its account's
+        currency never changes; entries in another currency do, and so does every
+        such entry of an account whose own currency's rate changed.
+        """
+        ledger = self.ledger
+        with ledger.lock:
+            own = ledger.codes["Currency"].view[positions]
+            account_currencies = ledger.account_currency_codes(positions)
+            changed = set(np.unique(ledger.currency_codes(positions)).tolist())
+            foreign = (own != 0) & (own != account_currencies)
+            accounts = set(ledger.codes["Account"].view[positions][foreign].tolist())
+            accounts |= {account for account, currency in ledger.account_currencies.items() if currency in changed}
+        if accounts:
+            self.recount_accounts(sorted(accounts))
+
+    def recount_accounts(self, account_codes):
+        """Recompute the income and expenses of some accounts (by ledger code), keeping their transfers"""
+        with self.ledger.lock:
+            selected = np.isin(self.ledger.codes["Account"].view, account_codes)
+            amounts = np.zeros(len(self.ledger))
+            amounts[selected] = self.ledger.account_amounts(np.flatnonzero(selected))
+            expenses = self.ledger.totals_by("Account", selected & (amounts > 0), amounts)
+            income = self.ledger.totals_by("Account", selected & (amounts < 0), amounts)
+            for code in account_codes:
+                account = self.ledger.dictionaries["Account"].values[code]
+                flows = self.flows.setdefault(account, self.empty_flows())
+                flows["expenses"] = expenses.get(account, 0.0)
+                flows["income"] = -income[account] if account in income else 0.0
+
+    def apply_flow(self, account, amount, sign):
+        if pd.isna(amount):
+            return
+        flows = self.flows.setdefault(account, self.empty_flows())
+        if amount >= 0:
+            flows["expenses"] += sign * amount
+        else:
+            flows["income"] -= sign * amount
+
+    def compute_flows(self):
+        """Recompute every account's totals from the whole ledger and transfer history"""
+        with self.ledger.lock:
+            # Each account's totals are in its own currency
+            amounts = self.ledger.account_amounts(slice(None))
+            expenses = self.ledger.totals_by("Account", amounts > 0, amounts)
+            income = self.ledger.totals_by("Account", amounts < 0, amounts)
+
+        flows = {}
+        for account, total in expenses.items():
+            flows.setdefault(account, self.empty_flows())["expenses"] = total
+        for account, total in income.items():
+            flows.setdefault(account, self.empty_flows())["income"] = -total
+        for account, total in self.net_transfers(self.transfers).items():
+            flows.setdefault(account, self.empty_flows())["transfers"] += total
+        return flows
+
+    @staticmethod
+    def net_transfers(transfers):
+        """Money transferred into each account minus money transferred out of it"""
+        amounts = pd.to_numeric(transfers["Amount"], errors="coerce").fillna(0.0)
+        # Transfers saved before the Received column existed were between accounts in the same currency
+        credited = pd.to_numeric(transfers["Received"], errors="coerce").fillna(amounts) \
+            if "Received" in transfers.columns else amounts
+        received = credited.groupby(transfers["To"]).sum()
+        sent = amounts.groupby(transfers["From"]).sum()
+        return received.sub(sent, fill_value=0.0).to_dict()
+
+    def reconcile_balances(self):
+        """Recompute the running totals from scratch, replacing and reporting any that drifted"""
+        with self.ledger.lock:
+            expected = self.compute_flows()
+            drifted = []
+            for account in set(expected) | set(self.flows):
+                current = self.flows.get(account, self.empty_flows())
+                correct = expected.get(account, self.empty_flows())
+                if any(abs(current[key] - correct[key]) > 0.005 for key in correct):
+                    drifted.append(account)
+            self.flows = expected
+
+        if drifted:
+            print(f"Balance reconciliation corrected drift in: {', '.join(sorted(drifted))}")
+            self.bot.send_message(self.ALLOWED_USER_ID,
+                                  f"⚠️ Balance check corrected running totals for: {', '.join(sorted(drifted))}")
+        return drifted
+
+    def get_balance(self, account):
+        flows = self.flows.get(account, self.empty_flows())
+        return (self.opening_balances.get(account, 0.0) + flows["income"] - flows["expenses"]
+                + flows["transfers"])
+
+    def balances_command(self, message):
+        """Command to show every account's balance from the running totals"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if self.is_first_time():
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
+
+        lines = []
+        with self.ledger.lock:
+            for account in self.accounts:
+                flows = self.flows.get(account, self.empty_flows())
+                currency = f" {self.currencies[account]}" if account in self.currencies else ""
+                lines.append(
+                    f"• {account}: {self.get_balance(account):.2f}{currency}\n"
+                    f"    opening {self.opening_balances.get(account, 0.0):.2f}, income {flows['income']:.2f}, "
+                    f"expenses {flows['expenses']:.2f}, transfers {flows['transfers']:+.2f}"
+                )
+        self.bot.reply_to(message, "Account balances:\n\n" + "\n".join(lines))
+
+    def account_buttons(self, prefix, exclude=None):
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(*[
+            types.InlineKeyboardButton(text=account, callback_data=f"{prefix}{account}")
+            for account in self.accounts if account != exclude
+        ])
+        return markup
+
+    def transfer_command(self, message):
+        """Command to move money between two accounts"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if self.is_first_time():
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
+
+        if len(self.accounts) < 2:
+            self.bot.reply_to(message, "You need at least two accounts to make a transfer.")
+            return
+
+        self.transfer_session[message.from_user.id] = {}
+        self.bot.send_message(message.chat.id, "Transfer from which account?",
+                              reply_markup=self.account_buttons("xfer_from_"))
+
+    def process_transfer_callback_impl(self, call):
+        """Handle the source and destination account selection of a transfer"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID or user_id not in self.transfer_session:
+            return
+
+        self.bot.answer_callback_query(call.id)
+        session = self.transfer_session[user_id]
+
+        if call.data.startswith("xfer_from_"):
+            session["from"] = call.data.replace("xfer_from_", "", 1)
+            self.bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=f"Transfer from: {session['from']}"
+            )
+            self.bot.send_message(call.message.chat.id, "Transfer to which account?",
+                                  reply_markup=self.account_buttons("xfer_to_", exclude=session["from"]))
+
+        elif call.data.startswith("xfer_to_"):
+            session["to"] = call.data.replace("xfer_to_", "", 1)
+            self.bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=f"Transfer to: {session['to']}"
+            )
+            msg = self.bot.send_message(call.message.chat.id, "Please enter the amount to transfer:")
+            self.bot.register_next_step_handler(msg, self.process_transfer_amount)
+
+    def process_transfer_amount(self, message):
+        """Process the transfer amount and record the transfer"""
+        if not self.is_authorized(message):
+            return
+
+        user_id = message.from_user.id
+        session = self.transfer_session.get(user_id)
+        if not session or "from" not in session or "to" not in session:
+            self.bot.reply_to(message, "Session expired. Please try again.")
+            return
 
         try:
-            # Check if the Excel file exists
-            if not os.path.exists(self.data_file):
-                return updated_count
+            amount = float(message.text)
+            if not np.isfinite(amount) or amount <= 0:
+                raise ValueError
+        except ValueError:
+            msg = self.bot.reply_to(message, "Please enter a positive number for the amount:")
+            self.bot.register_next_step_handler(msg, self.process_transfer_amount)
+            return
 
-            # Read the Excel file, expenses sheet
-            try:
-                df = pd.read_excel(self.data_file, sheet_name="Expenses")
+        try:
+            received = self.record_transfer(session["from"], session["to"], amount)
+        except ValueError as e:
+            del self.transfer_session[user_id]
+            self.bot.reply_to(message, f"Transfer not recorded: {e}")
+            return
+        del self.transfer_session[user_id]
+
+        converted = f" ({received:.2f} in '{session['to']}')" if received != amount else ""
+        self.bot.reply_to(message,
+                          f"Transferred {amount:.2f} from '{session['from']}' to '{session['to']}'{converted}.\n\n"
+                          f"{session['from']}: {self.get_balance(session['from']):.2f}\n"
+                          f"{session['to']}: {self.get_balance(session['to']):.2f}")
+
+    def record_transfer(self, from_account, to_account, amount):
+        """Save a transfer through the ledger's log, returning the amount to_account received
+
+        The amount is in from_account's currency; an account in another currency gets it
+        converted at the day's rates, and ValueError is raised when one of them is missing.
+        """
+        date = pd.Timestamp.now().floor("s")
+        received = amount * self.transfer_rate(from_account, to_account, date)
+        if np.isnan(received):
+            raise ValueError(f"no exchange rate between the currencies of '{from_account}' and '{to_account}'")
+        # Both accounts' running totals move in on_row, also for transfers other processes log
+        self.ledger.append_row("Transfers", {"Date": str(date), "From": from_account, "To": to_account,
+                                             "Amount": amount, "Received": received})
+        return received
+
+    def transfer_rate(self, from_account, to_account, date):
+        """Units of to_account's currency one unit of from_account's is worth at date, NaN without rates"""
+        from_currency = self.currencies.get(from_account, "")
+        to_currency = self.currencies.get(to_account, "")
+        if from_currency == to_currency:
+            return 1.0
+        if self.ledger.rates is None:
+            return float("nan")
+        timestamps = np.array([to_timestamp(date)])
+        return float(self.ledger.rates.lookup(from_currency, timestamps)[0]
+                     / self.ledger.rates.lookup(to_currency, timestamps)[0])
+
+    def set_opening_command(self, message):
+        """Command to set the opening balance of an account"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
 
-                # Check if the Account column exists
-                if 'Account' not in df.columns:
-                    return updated_count
+        if self.is_first_time():
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
 
-                # Find all rows with the old account and update them
-                mask = df['Account'] == old_account
-                updated_count = mask.sum()
+        self.bot.send_message(message.chat.id, "Set the opening balance of which account?",
+                              reply_markup=self.account_buttons("opening_acc_"))
 
-                if updated_count > 0:
-                    df.loc[mask, 'Account'] = new_account
+    def process_opening_callback_impl(self, call):
+        """Process the account selection for an opening balance"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID:
+            return
 
-                    # Save the updated dataframe back to the Excel file
-                    with pd.ExcelWriter(self.data_file, mode='a', if_sheet_exists='replace') as writer:
-                        df.to_excel(writer, sheet_name="Expenses", index=False)
-            except Exception as e:
-                print(f"Error updating expenses after account edit: {e}")
+        account = call.data.replace("opening_acc_", "", 1)
+        self.transfer_session[user_id] = {"opening": account}
+        self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=f"Opening balance for '{account}' (currently {self.opening_balances.get(account, 0.0):.2f}).\n"
+                 f"Please enter the new amount:"
+        )
+        self.bot.register_next_step_handler(call.message, self.process_opening_amount)
 
-            return updated_count
-        except Exception as e:
-            print(f"Error processing Excel file: {e}")
-            return updated_count
+    def process_opening_amount(self, message):
+        """Process the new opening balance"""
+        if not self.is_authorized(message):
+            return
+
+        user_id = message.from_user.id
+        session = self.transfer_session.get(user_id)
+        if not session or "opening" not in session:
+            self.bot.reply_to(message, "Session expired. Please try again.")
+            return
+
+        try:
+            amount = float(message.text)
+        except ValueError:
+            msg = self.bot.reply_to(message, "Please enter a valid number for the amount:")
+            self.bot.register_next_step_handler(msg, self.process_opening_amount)
+            return
+
+        account = session["opening"]
+        self.opening_balances[account] = amount
+        self.save_accounts(self.accounts)
+        del self.transfer_session[user_id]
+        self.bot.reply_to(message, f"Opening balance of '{account}' set to {amount:.2f}.\n"
+                                   f"Current balance: {self.get_balance(account):.2f}")
+
+    def set_currency_command(self, message):
+        """Command to set the currency an account's amounts are in"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if self.is_first_time():
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
+
+        self.bot.send_message(message.chat.id, "Set the currency of which account?",
+                              reply_markup=self.account_buttons("currency_acc_"))
+
+    def process_currency_callback_impl(self, call):
+        """Process the account selection for a currency"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID:
+            return
+
+        account = call.data.replace("currency_acc_", "", 1)
+        self.transfer_session[user_id] = {"currency": account}
+        current = self.currencies.get(account, "the base currency")
+        self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=f"Currency of '{account}' (currently {current}).\n"
+                 f"Please enter a three-letter currency code, e.g. USD, or '-' for the base currency:"
+        )
+        self.bot.register_next_step_handler(call.message, self.process_currency_code)
+
+    def process_currency_code(self, message):
+        """Process the new currency of an account"""
+        if not self.is_authorized(message):
+            return
+
+        user_id = message.from_user.id
+        session = self.transfer_session.get(user_id)
+        if not session or "currency" not in session:
+            self.bot.reply_to(message, "Session expired. Please try again.")
+            return
+
+        currency = message.text.strip().upper()
+        if currency == "-":
+            currency = ""
+        elif not (len(currency) == 3 and currency.isalpha()):
+            msg = self.bot.reply_to(message, "Please enter a three-letter currency code, e.g. USD, or '-':")
+            self.bot.register_next_step_handler(msg, self.process_currency_code)
+            return
+
+        account = session["currency"]
+        del self.transfer_session[user_id]
+        if currency:
+            self.currencies[account] = currency
+        else:
+            self.currencies.pop(account, None)
+        self.save_accounts(self.accounts)
+        # Converts the account's entries again; budgets follow through on_rates
+        self.ledger.set_account_currency(account, currency)
+        # Entries in other currencies are now converted to the new one, even if none were in the old
+        self.recount_accounts([self.ledger.dictionaries["Account"].encode(account)])
+
+        reply = f"Currency of '{account}' set to {currency or 'the base currency'}."
+        if self.ledger.rates is not None and currency not in self.ledger.rates:
+            reply += f"\nThere is no exchange rate for {currency} yet, so its amounts are left out of totals."
+        self.bot.reply_to(message, reply)
+
+    def rates_command(self, message):
+        """Command to show the latest exchange rate of every currency"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        rates = self.ledger.rates
+        if rates is None or not rates.series:
+            self.bot.reply_to(message, "No exchange rates are loaded. Add them to the rates file "
+                                       "(Date, Currency, Rate columns) to use other currencies.")
+            return
+
+        lines = [f"• 1 {currency} = {rate:g} {rates.base_currency} ({date.strftime('%Y-%m-%d')})"
+                 for currency, (date, rate) in rates.latest().items()]
+        self.bot.reply_to(message, "Latest exchange rates:\n\n" + "\n".join(lines))
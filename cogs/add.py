@@ -1,14 +1,45 @@
+import math
 import pandas as pd
 from telebot import types
+from cogs.anomaly import AnomalyDetector
+from cogs.dedupe import DuplicateIndex
+from cogs.suggest import SuggestionEngine
+from storage.ledger import to_timestamp
+
+
+def parse_amount(text):
+    """Split an amount like "12.50", "12.50 USD" or "USD 12.50" into (amount, currency code)
+
+    Negative amounts are income; "nan" and "inf", which float() accepts, raise ValueError.
+    """
+    parts = text.split()
+    currency = ""
+    if len(parts) == 2:
+        if parts[0].isalpha():
+            parts.reverse()
+        if not (len(parts[1]) == 3 and parts[1].isalpha()):
+            raise ValueError(text)
+        text, currency = parts[0], parts[1].upper()
+    amount = float(text)
+    if not math.isfinite(amount):
+        raise ValueError(text)
+    return amount, currency
 
 
 class AddCommandCog:
-    def __init__(self, bot, allowed_user_id, categories_cog, accounts_cog):
+    def __init__(self, bot, allowed_user_id, categories_cog, accounts_cog, ledger):
         self.bot = bot
         self.ALLOWED_USER_ID = allowed_user_id
         self.categories_cog = categories_cog
         self.accounts_cog = accounts_cog
+        self.ledger = ledger
         self.user_data = {}
+        # Learns the usual account and category of each name from the ledger
+        self.suggestions = SuggestionEngine(ledger)
+        # Finds an existing entry with the same name, account, amount and day
+        self.duplicates = DuplicateIndex(ledger)
+        # Knows the usual range of amounts per category and name, and recent spending
+        self.anomalies = AnomalyDetector(ledger)
 
         # Register command handler
         @bot.message_handler(commands=['add'])
@@ -56,6 +87,15 @@ class AddCommandCog:
         markup = types.InlineKeyboardMarkup(row_width=2)
         account_buttons = []
 
+        # Offer the usual account and category of this name as a single tap
+        suggestion = self.suggestions.suggest(message.text)
+        if suggestion and suggestion[0] in accounts and suggestion[1] in self.categories_cog.get_categories():
+            self.user_data[user_id]["suggestion"] = suggestion
+            markup.row(types.InlineKeyboardButton(
+                text=f"{suggestion[0]} · {suggestion[1]}?",
+                callback_data="suggest_accept"
+            ))
+
         for account in accounts:
             account_buttons.append(types.InlineKeyboardButton(
                 text=account,
@@ -81,6 +121,44 @@ class AddCommandCog:
         def process_category_callback(call):
             self.handle_category_selection(call)
 
+        @self.bot.callback_query_handler(func=lambda call: call.data in ('confirm_save', 'confirm_discard'))
+        def process_confirm_callback(call):
+            self.handle_save_confirmation(call)
+
+        @self.bot.callback_query_handler(func=lambda call: call.data == 'suggest_accept')
+        def process_suggestion_callback(call):
+            self.handle_suggestion_selection(call)
+
+    def handle_suggestion_selection(self, call):
+        """Take the suggested account and category and go straight to the amount"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID:
+            return
+
+        # Acknowledge the callback query
+        self.bot.answer_callback_query(call.id)
+
+        if user_id not in self.user_data or "suggestion" not in self.user_data[user_id]:
+            self.bot.send_message(call.message.chat.id, "Session expired. Please use /add again.")
+            return
+
+        account, category = self.user_data[user_id].pop("suggestion")
+        self.user_data[user_id]["account"] = account
+        self.user_data[user_id]["category"] = category
+        self.user_data[user_id]["step"] = "amount"
+
+        self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=f"Selected account: {account}\nSelected category: {category}"
+        )
+
+        msg = self.bot.send_message(
+            call.message.chat.id,
+            "Please enter the amount, followed by a currency code if it isn't the account's (e.g. 12.50 USD):"
+        )
+        self.bot.register_next_step_handler(msg, self.process_amount_step)
+
     def handle_account_selection(self, call):
         """Handle account selection and ask for category selection"""
         user_id = call.from_user.id
@@ -149,7 +227,7 @@ class AddCommandCog:
         # Ask for the amount
         msg = self.bot.send_message(
             call.message.chat.id,
-            "Please enter the amount:"
+            "Please enter the amount, followed by a currency code if it isn't the account's (e.g. 12.50 USD):"
         )
 
         # Register the next step for amount input
@@ -161,63 +239,95 @@ class AddCommandCog:
 
         user_id = message.from_user.id
 
-        # Validate amount is a number
+        # Validate amount is a number, optionally followed by a currency code
         try:
-            amount = float(message.text)
+            amount, currency = parse_amount(message.text)
+            if currency == self.accounts_cog.currencies.get(self.user_data[user_id]["account"], ""):
+                currency = ""
             self.user_data[user_id]["amount"] = amount
+            self.user_data[user_id]["currency"] = currency
         except ValueError:
             msg = self.bot.reply_to(message, "Please enter a valid number for the amount:")
             self.bot.register_next_step_handler(msg, self.process_amount_step)
             return
 
+        # Warn before saving what looks like an entry that was already logged today
+        entry = self.user_data[user_id]
+        now = to_timestamp(pd.Timestamp.now())
+        warnings = []
+        duplicate = self.duplicates.find(entry["name"], entry["account"], amount, now)
+        if duplicate is not None:
+            _, _, _, _, date = self.ledger.rows([duplicate])[0]
+            warnings.append(f"This looks like a duplicate of an entry from {date.strftime('%H:%M')} today")
+        # ... or an unusual amount, which is often a typo
+        entry_currency = currency or self.accounts_cog.currencies.get(entry["account"], "")
+        base_amount = self.anomalies.base_amount(amount, entry_currency, now)
+        warnings += self.anomalies.check(entry["name"], entry["category"], base_amount, now)
+
+        if warnings:
+            markup = types.InlineKeyboardMarkup(row_width=2)
+            markup.add(
+                types.InlineKeyboardButton(text="Save anyway", callback_data="confirm_save"),
+                types.InlineKeyboardButton(text="Discard", callback_data="confirm_discard"),
+            )
+            self.bot.reply_to(
+                message,
+                "\n".join(f"⚠️ {warning}" for warning in warnings) + "\n\n"
+                f"{entry['name']} · {entry['account']} · {entry['category']} · {amount:g}\n\n"
+                f"Save it anyway?",
+                reply_markup=markup
+            )
+            return
+
+        self.bot.reply_to(message, self.save_entry(user_id))
+
+    def handle_save_confirmation(self, call):
+        """Save or discard an entry that was held back by a warning: a likely duplicate or an unusual amount"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID:
+            return
+
+        self.bot.answer_callback_query(call.id)
+        if user_id not in self.user_data or "amount" not in self.user_data[user_id]:
+            self.bot.send_message(call.message.chat.id, "Session expired. Please use /add again.")
+            return
+
+        if call.data == "confirm_discard":
+            del self.user_data[user_id]
+            text = "Entry discarded."
+        else:
+            text = self.save_entry(user_id)
+        self.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text=text)
+
+    def save_entry(self, user_id):
+        """Save the entry being added and return the summary shown to the user"""
         # Store summary details before saving and clearing user_data
         name = self.user_data[user_id].get("name", "Unknown")
         account = self.user_data[user_id].get("account", "Unknown")
         category = self.user_data[user_id].get("category", "Unknown")
         amount_val = self.user_data[user_id].get("amount", 0)
+        currency = self.user_data[user_id].get("currency") or self.accounts_cog.currencies.get(account, "")
 
         # Save data to Excel
-        self.save_to_excel(user_id)
+        row_id = self.save_to_excel(user_id)
 
         # Show summary to user
-        summary = (
-            f"Entry saved successfully!\n\n"
+        return (
+            f"Entry saved successfully! (#{row_id}, use /undo or /edit to fix it)\n\n"
             f"Name: {name}\n"
             f"Account: {account}\n"
             f"Category: {category}\n"
-            f"Amount: {amount_val}"
+            f"Amount: {amount_val} {currency}".rstrip()
         )
-        self.bot.reply_to(message, summary)
 
     def save_to_excel(self, user_id):
-        file_path = 'data.xlsx'
-        sheet_name = "Expenses"
-
-        # Create a new row with the user's data
-        new_data = {
-            'Name': [self.user_data[user_id]["name"]],
-            'Account': [self.user_data[user_id]["account"]],
-            'Category': [self.user_data[user_id]["category"]],
-            'Amount': [self.user_data[user_id]["amount"]]
-        }
-        new_df = pd.DataFrame(new_data)
-
-        # Check if file exists
-        try:
-            with pd.ExcelFile(file_path) as xls:
-                # If file exists, append to it
-                existing_df = pd.read_excel(xls, sheet_name=sheet_name)
-                updated_df = pd.concat([existing_df, new_df], ignore_index=True)
-            with pd.ExcelWriter(file_path, mode='a', if_sheet_exists='replace') as writer:
-                updated_df.to_excel(writer, sheet_name=sheet_name, index=False)
-        except Exception:
-            # If file doesn't exist, create a new one with both sheets
-            with pd.ExcelWriter(file_path) as writer:
-                # Create Categories sheet with defaults
-                pd.DataFrame({"Category": self.categories_cog.get_categories()}).to_excel(
-                    writer, sheet_name="Categories", index=False)
-                # Create Expenses sheet with the new data
-                new_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        entry = self.user_data[user_id]
+        date = pd.Timestamp.now().floor("s")
+
+        # The ledger logs the entry durably; the workbook catches up at its next checkpoint
+        row_id = self.ledger.append(entry["name"], entry["account"], entry["category"], entry["amount"], date,
+                                    currency=entry.get("currency", ""))
 
         # Clear user data
         self.user_data.pop(user_id)
+        return row_id
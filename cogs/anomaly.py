@@ -0,0 +1,205 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+from cogs.suggest import normalize_name
+from storage.ledger import MISSING_TIMESTAMP
+
+NS_PER_DAY = 86_400_000_000_000
+
+# An amount is unusual when its robust z-score, 0.6745 * (amount - median) / MAD, is above this
+THRESHOLD = 3.5
+# Expenses a category or name needs before its usual range is trusted
+MIN_HISTORY = 8
+# The MAD used never goes below this fraction of the median, so a category of identical amounts
+# doesn't flag every other amount
+MIN_SPREAD = 0.1
+# How far each new amount moves the streamed median and MAD, as a fraction of the MAD
+STEP = 0.05
+
+# A burst is BURST_COUNT expenses within BURST_WINDOW, or more than BURST_FACTOR times a usual day's
+# spending within it
+BURST_WINDOW = 3600 * 1_000_000_000
+BURST_COUNT = 5
+BURST_FACTOR = 3.0
+
+
+class RobustStats:
+    """Median and median absolute deviation of a group's expenses
+
+    They are exact up to MIN_HISTORY amounts, which are kept. After that each new
+    amount only nudges both estimates a small step towards it, so an insert is
+    O(1) and the estimates drift until AnomalyDetector.rebuild recomputes them.
+    """
+
+    __slots__ = ("median", "mad", "count", "values")
+
+    def __init__(self, median=0.0, mad=0.0, count=0, values=None):
+        self.median = median
+        self.mad = mad
+        self.count = count
+        self.values = (values or []) if count < MIN_HISTORY else None
+
+    def add(self, amount):
+        self.count += 1
+        if self.values is not None:
+            self.values.append(amount)
+            values = np.array(self.values)
+            self.median = float(np.median(values))
+            self.mad = float(np.median(np.abs(values - self.median)))
+            if len(self.values) >= MIN_HISTORY:
+                self.values = None
+            return
+
+        step = STEP * self.spread()
+        self.median += step * np.sign(amount - self.median)
+        self.mad = max(self.mad + step * np.sign(abs(amount - self.median) - self.mad), 0.0)
+
+    def spread(self):
+        return max(self.mad, MIN_SPREAD * abs(self.median), 0.01)
+
+    def score(self, amount):
+        """Robust z-score of amount, or None while there is too little history"""
+        if self.count < MIN_HISTORY:
+            return None
+        return 0.6745 * (amount - self.median) / self.spread()
+
+
+def group_stats(keys, amounts):
+    """RobustStats per distinct key, computed with vectorized group-bys"""
+    if len(keys) == 0:
+        return {}
+    df = pd.DataFrame({"key": keys, "amount": amounts})
+    grouped = df.groupby("key", sort=False)["amount"]
+    medians = grouped.median()
+    counts = grouped.size()
+    deviations = (df["amount"] - medians.reindex(df["key"]).to_numpy()).abs()
+    mads = deviations.groupby(df["key"], sort=False).median()
+    # Groups too small for the streamed estimates keep their amounts
+    small = df[df["key"].isin(counts.index[counts < MIN_HISTORY])]
+    values = small.groupby("key", sort=False)["amount"].agg(list).to_dict()
+    return {
+        key: RobustStats(medians[key], mads[key], int(counts[key]), values.get(key))
+        for key in medians.index.tolist()
+    }
+
+
+class AnomalyDetector:
+    """Flags an expense far above its category's or name's usual range, or part of a burst of spending
+
+    Amounts are compared in the base currency, and only expenses (positive
+    amounts) are tracked. The statistics are updated in O(1) on every insert;
+    edits, deletions and rate changes are only picked up by rebuild(), the full
+    recomputation the scheduler runs in the background.
+    """
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.categories = {}
+        self.names = {}
+        # (timestamp, base amount) of the expenses within BURST_WINDOW of the latest one
+        self.recent = deque()
+        self.recent_total = 0.0
+        # Median spending of the days with expenses
+        self.daily_median = 0.0
+        ledger.add_listener(self)
+
+    def on_load(self, ledger):
+        self.rebuild()
+
+    def on_append(self, position, name, account, category, amount, timestamp):
+        self.add(name, category, float(self.ledger.base_amounts.view[position]), timestamp)
+
+    def on_replace(self, column, old_value, new_value):
+        if column in ("Name", "Category"):
+            self.rebuild()
+
+    def add(self, name, category, amount, timestamp):
+        if not amount > 0:
+            return
+        self.categories.setdefault(category, RobustStats()).add(amount)
+        self.names.setdefault(normalize_name(name), RobustStats()).add(amount)
+        # Backdated entries, like recurring ones caught up on, aren't part of a burst
+        if timestamp != MISSING_TIMESTAMP and (not self.recent or timestamp >= self.recent[-1][0]):
+            self.recent.append((timestamp, amount))
+            self.recent_total += amount
+            self.expire(timestamp)
+
+    def expire(self, now):
+        while self.recent and self.recent[0][0] < now - BURST_WINDOW:
+            self.recent_total -= self.recent.popleft()[1]
+
+    def rebuild(self):
+        """Recompute every statistic from the whole ledger
+
+        The columns are copied under the ledger lock and the statistics computed
+        without it; expenses added meanwhile are then applied incrementally.
+        """
+        with self.ledger.lock:
+            end = len(self.ledger)
+            live = self.ledger.live.view.copy()
+            amounts = self.ledger.base_amounts.view.copy()
+            timestamps = self.ledger.timestamps.view.copy()
+            category_codes = self.ledger.codes["Category"].view.copy()
+            name_codes = self.ledger.codes["Name"].view.copy()
+            category_values = list(self.ledger.dictionaries["Category"].values)
+            name_values = list(self.ledger.dictionaries["Name"].values)
+
+        expenses = live & (amounts > 0)
+        amounts = amounts[expenses]
+        timestamps = timestamps[expenses]
+        categories = group_stats(category_codes[expenses], amounts)
+        categories = {category_values[code]: stats for code, stats in categories.items()}
+        normalized = np.array([normalize_name(name) for name in name_values], dtype=object)
+        names = group_stats(normalized[name_codes[expenses]] if len(normalized) else [], amounts)
+
+        dated = timestamps != MISSING_TIMESTAMP
+        daily = pd.Series(amounts[dated]).groupby(timestamps[dated] // NS_PER_DAY).sum()
+        daily_median = float(daily.median()) if len(daily) else 0.0
+
+        with self.ledger.lock:
+            self.categories, self.names, self.daily_median = categories, names, daily_median
+            self.recent.clear()
+            self.recent_total = 0.0
+            latest = timestamps[dated].max() if dated.any() else MISSING_TIMESTAMP
+            if latest != MISSING_TIMESTAMP:
+                window = dated & (timestamps >= latest - BURST_WINDOW)
+                order = np.argsort(timestamps[window], kind="stable")
+                self.recent.extend(zip(timestamps[window][order].tolist(), amounts[window][order].tolist()))
+                self.recent_total = float(amounts[window].sum())
+            live = self.ledger.live.view
+            for position in range(end, len(self.ledger)):
+                if live[position]:
+                    name, _, category, _, timestamp = self.ledger.row(position)
+                    self.add(name, category, float(self.ledger.base_amounts.view[position]), timestamp)
+
+    def base_amount(self, amount, currency, timestamp):
+        """An amount in currency (empty for the base currency) converted to the base currency"""
+        rates = self.ledger.rates
+        if rates is None or not currency:
+            return amount
+        return float(amount * rates.lookup(currency, np.array([timestamp], dtype=np.int64))[0])
+
+    def check(self, name, category, amount, timestamp):
+        """Warnings about a new expense of amount (in the base currency) before it is saved"""
+        warnings = []
+        if not amount > 0:
+            return warnings
+
+        for stats, label in ((self.categories.get(category), f"on {category}"),
+                             (self.names.get(normalize_name(name)), f"for {name}")):
+            score = stats.score(amount) if stats is not None else None
+            if score is not None and score > THRESHOLD:
+                warnings.append(f"{amount:.2f} is far above what you usually spend {label} "
+                                f"(typically {stats.median:.2f})")
+
+        with self.ledger.lock:
+            self.expire(timestamp)
+            count = len(self.recent) + 1
+            total = self.recent_total + amount
+        minutes = BURST_WINDOW // 60_000_000_000
+        if count >= BURST_COUNT:
+            warnings.append(f"{count} expenses in the last {minutes} minutes")
+        elif count > 1 and self.daily_median > 0 and total > BURST_FACTOR * self.daily_median:
+            warnings.append(f"{total:.2f} spent in the last {minutes} minutes, over {BURST_FACTOR:g}× "
+                            f"a usual day ({self.daily_median:.2f})")
+        return warnings
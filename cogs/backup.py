@@ -0,0 +1,84 @@
+from storage.backup import SnapshotStore, data_files, read_files
+
+# Snapshots listed by /backups
+MAX_BACKUPS_SHOWN = 10
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class BackupCog:
+    def __init__(self, bot, allowed_user_id, ledger, backup_dir, archive_dir=None, extra_files=(), keep=30):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+        self.archive_dir = archive_dir
+        self.extra_files = list(extra_files)
+        # The scheduled backup, /backup and other processes take turns on the store's file lock
+        self.store = SnapshotStore(backup_dir, keep=keep)
+
+        # Register command handlers
+        @bot.message_handler(commands=['backup'])
+        def backup_command_handler(message):
+            self.backup_command(message)
+
+        @bot.message_handler(commands=['backups'])
+        def backups_command_handler(message):
+            self.backups_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def run_backup(self):
+        """Snapshot the data files, storing only chunks no earlier snapshot has"""
+        paths = data_files(self.ledger.data_file, self.archive_dir, self.extra_files)
+        return self.store.create(read_files(paths, self.ledger))
+
+    def backup_command(self, message):
+        """Take a backup now"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        try:
+            snapshot_id, stats = self.run_backup()
+        except Exception as e:
+            print(f"Error creating backup: {e}")
+            self.bot.reply_to(message, "Sorry, the backup failed.")
+            return
+
+        if snapshot_id is None:
+            self.bot.reply_to(message, "Nothing changed since the last backup.")
+            return
+        self.bot.reply_to(
+            message,
+            f"Backup {snapshot_id} saved: {stats['files']} files, {format_size(stats['bytes'])}.\n"
+            f"{stats['new_chunks']} of {stats['chunks']} chunks were new ({format_size(stats['new_bytes'])} written)."
+        )
+
+    def backups_command(self, message):
+        """List the latest backups"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        snapshot_ids = self.store.snapshots()
+        if not snapshot_ids:
+            self.bot.reply_to(message, "There are no backups yet. Use /backup to take one.")
+            return
+
+        lines = []
+        for snapshot_id in reversed(snapshot_ids[-MAX_BACKUPS_SHOWN:]):
+            files = self.store.read_snapshot(snapshot_id)["files"]
+            lines.append(f"• {snapshot_id}: {len(files)} files, "
+                         f"{format_size(sum(entry['size'] for entry in files.values()))}")
+        self.bot.reply_to(
+            message,
+            f"{len(snapshot_ids)} backups, latest first:\n\n" + "\n".join(lines) +
+            "\n\nTo restore one, stop the bot and run:\npython -m storage.backup restore <backup> <directory>"
+        )
@@ -1,15 +1,36 @@
 import pandas as pd
+import numpy as np
 import os
+import queue
+import threading
+from storage.ledger import EXPENSE_COLUMNS, MISSING_TIMESTAMP
+from storage.workbook import write_sheets
+
+BUDGET_COLUMNS = ["Category", "Month", "Limit"]
+
+# Fractions of a budget that trigger an alert when crossed
+BUDGET_THRESHOLDS = (0.5, 0.8, 1.0)
 
 
 class CategoriesCog:
-    def __init__(self, bot, allowed_user_id, accounts_cog):
+    def __init__(self, bot, allowed_user_id, accounts_cog, ledger):
         self.bot = bot
         self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+        self.accounts_cog = accounts_cog
         self.data_file = "data.xlsx"  # Excel file for categories
         self.sheet_name = "Categories"  # Sheet name for categories
         self.first_load = accounts_cog.is_first_time()
         self.categories = self.load_categories()
+        # Monthly limits per (category, "YYYY-MM"), stored next to the categories in the Budgets sheet
+        self.budgets = self.load_budgets()
+        # Running spend per (category, "YYYY-MM"), kept up to date by the ledger listener methods
+        self.monthly_spend = {}
+        ledger.add_listener(self)
+        # Budget alerts are found under the ledger lock and sent from their own thread, so a slow
+        # network call never holds up other writers
+        self.alerts = queue.Queue()
+        threading.Thread(target=self.send_alerts, name="budget-alerts", daemon=True).start()
 
         # Register command handlers
         @bot.message_handler(commands=['categories'])
@@ -28,6 +49,14 @@ class CategoriesCog:
         def edit_category_handler(message):
             self.edit_category_command(message)
 
+        @bot.message_handler(commands=['setbudget'])
+        def set_budget_handler(message):
+            self.set_budget_command(message)
+
+        @bot.message_handler(commands=['budgets'])
+        def budgets_handler(message):
+            self.budgets_command(message)
+
     def is_authorized(self, message):
         return message.from_user.id == self.ALLOWED_USER_ID
 
@@ -54,16 +83,58 @@ class CategoriesCog:
         df = pd.DataFrame({"Category": categories})
 
         if os.path.exists(self.data_file):
-            # Read existing data
-            with pd.ExcelWriter(self.data_file, mode="a", if_sheet_exists="replace") as writer:
-                df.to_excel(writer, sheet_name=self.sheet_name, index=False)
+            # Replace the sheet, preserving the others
+            write_sheets(self.data_file, {self.sheet_name: df})
         else:
-            # Create new file
-            with pd.ExcelWriter(self.data_file) as writer:
-                df.to_excel(writer, sheet_name=self.sheet_name, index=False)
-                # Create empty expenses sheet
-                pd.DataFrame(columns=["Name", "Account", "Category", "Amount"]).to_excel(
-                    writer, sheet_name="Expenses", index=False)
+            # Create new file with an empty expenses sheet
+            write_sheets(self.data_file, {
+                self.sheet_name: df,
+                "Expenses": pd.DataFrame(columns=EXPENSE_COLUMNS),
+            })
+
+    def load_budgets(self):
+        """Load category budgets from the Budgets sheet"""
+        if os.path.exists(self.data_file):
+            try:
+                return self.parse_budgets(pd.read_excel(self.data_file, sheet_name="Budgets", dtype={"Month": str}))
+            except Exception:
+                pass
+        return {}
+
+    @staticmethod
+    def parse_budgets(df):
+        return {(row.Category, row.Month): float(row.Limit) for row in df.itertuples(index=False)}
+
+    def reload(self):
+        """Read the categories and budgets again after another process changed them"""
+        self.first_load = not os.path.exists(self.data_file)
+        self.categories = self.load_categories()
+        self.budgets = self.load_budgets()
+
+    def reload_sheets(self, frames):
+        """Apply Categories and Budgets sheets edited outside the bot, returning a note per sheet that changed"""
+        notes = []
+        if self.sheet_name in frames:
+            categories = frames[self.sheet_name]["Category"].tolist()
+            added = [category for category in categories if category not in self.categories]
+            removed = [category for category in self.categories if category not in categories]
+            self.categories = categories
+            if added or removed:
+                notes.append(f"categories: {len(added)} added, {len(removed)} removed")
+
+        if "Budgets" in frames:
+            budgets = self.parse_budgets(frames["Budgets"])
+            changed = [key for key in set(budgets) | set(self.budgets) if budgets.get(key) != self.budgets.get(key)]
+            # Running spend is per category and month already, so only the limits change
+            self.budgets = budgets
+            if changed:
+                notes.append(f"budgets: {len(changed)} changed")
+        return notes
+
+    def save_budgets(self):
+        """Save category budgets to the Budgets sheet"""
+        rows = [[category, month, limit] for (category, month), limit in sorted(self.budgets.items())]
+        write_sheets(self.data_file, {"Budgets": pd.DataFrame(rows, columns=BUDGET_COLUMNS)})
 
     def get_categories(self):
         """Return the current list of categories"""
@@ -196,6 +267,10 @@ class CategoriesCog:
         def process_edit_category_callback(call):
             self.process_edit_category_callback_impl(call)
 
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('budget_cat_'))
+        def process_budget_category_callback(call):
+            self.process_budget_category_callback_impl(call)
+
     def process_remove_category_callback_impl(self, call):
         """Process the category removal selection"""
         user_id = call.from_user.id
@@ -219,6 +294,9 @@ class CategoriesCog:
         if category_to_remove in self.categories:
             self.categories.remove(category_to_remove)
             self.save_categories(self.categories)
+            if any(category == category_to_remove for category, _ in self.budgets):
+                self.budgets = {key: limit for key, limit in self.budgets.items() if key[0] != category_to_remove}
+                self.save_budgets()
             return f"Category '{category_to_remove}' removed successfully!"
         else:
             return f"Category '{category_to_remove}' not found."
@@ -280,9 +358,10 @@ class CategoriesCog:
         index = self.categories.index(old_category)
         self.categories[index] = new_category
         self.save_categories(self.categories)
+        self.rename_budget_state(old_category, new_category)
 
-        # Update Excel sheet with expenses
-        updated_count = self.update_category_in_excel(old_category, new_category)
+        # Update existing expenses
+        updated_count = self.ledger.replace_value("Category", old_category, new_category)
 
         # Clean up session
         del self.edit_category_session[user_id]
@@ -296,35 +375,199 @@ class CategoriesCog:
                               f"Category renamed from '{old_category}' to '{new_category}' successfully!\n"
                               f"No existing entries needed updating.")
 
-    def update_category_in_excel(self, old_category, new_category):
-        """Update all instances of old_category to new_category in the Excel file"""
-        excel_file = 'expenses.xlsx'
-        updated_count = 0
+    def rename_budget_state(self, old_category, new_category):
+        """Carry budgets and running monthly spend over to a renamed category"""
+        renamed = {}
+        for (category, month), limit in self.budgets.items():
+            renamed[(new_category if category == old_category else category, month)] = limit
+        if renamed != self.budgets:
+            self.budgets = renamed
+            self.save_budgets()
+
+        with self.ledger.lock:
+            for (category, month) in [key for key in self.monthly_spend if key[0] == old_category]:
+                total = self.monthly_spend.pop((category, month))
+                key = (new_category, month)
+                self.monthly_spend[key] = self.monthly_spend.get(key, 0.0) + total
+
+    # Budgets: running spend per category and month, updated by the ledger on every insert
+
+    def monthly_totals(self, ledger, positions=None, amounts=None):
+        """Sum base currency expenses (positive amounts) per (category, month) in one grouped pass"""
+        with ledger.lock:
+            positions = np.flatnonzero(ledger.live.view) if positions is None else positions
+            amounts = ledger.base_amounts.view[positions] if amounts is None else amounts
+            timestamps = ledger.timestamps.view[positions]
+            # Income (negative amounts) doesn't count against a budget
+            valid = (amounts > 0) & (timestamps != MISSING_TIMESTAMP)
+            df = pd.DataFrame({
+                "Category": ledger.codes["Category"].view[positions][valid],
+                "Month": timestamps[valid].view("datetime64[ns]").astype("datetime64[M]"),
+                "Amount": amounts[valid],
+            })
+            categories = ledger.dictionaries["Category"].values
+        totals = df.groupby(["Category", "Month"])["Amount"].sum()
+        return {(categories[code], month.strftime("%Y-%m")): float(total) for (code, month), total in totals.items()}
+
+    def on_load(self, ledger):
+        """Build the monthly spend table from the whole ledger"""
+        self.monthly_spend = self.monthly_totals(ledger)
+
+    def on_append(self, position, name, account, category, amount, timestamp):
+        """Add the expense to its category's monthly total in O(1) and alert on crossed thresholds"""
+        amount = self.ledger.base_amounts.view[position]
+        if not amount > 0 or timestamp == MISSING_TIMESTAMP:
+            return
+        month = pd.Timestamp(timestamp).strftime("%Y-%m")
+        key = (category, month)
+        before = self.monthly_spend.get(key, 0.0)
+        after = before + amount
+        self.monthly_spend[key] = after
+        self.queue_alert(self.check_budget(category, month, before, after))
+
+    def check_budget(self, category, month, before, after):
+        """Alert text for the highest budget threshold crossed going from before to after, or None"""
+        key = (category, month)
+        limit = self.budgets.get(key)
+        if not limit:
+            return None
+        crossed = [threshold for threshold in BUDGET_THRESHOLDS if before < threshold * limit <= after]
+        if not crossed:
+            return None
+        threshold = crossed[-1]
+        icon = "🚨" if threshold >= 1.0 else "⚠️"
+        return (f"{icon} {category} has reached {threshold:.0%} of its {month} budget: "
+                f"{after:.2f} of {limit:.2f} spent.")
+
+    def queue_alert(self, text):
+        if text:
+            self.alerts.put(text)
+
+    def send_alerts(self):
+        while True:
+            text = self.alerts.get()
+            try:
+                self.bot.send_message(self.ALLOWED_USER_ID, text)
+            except Exception as e:
+                print(f"Error sending budget alert: {e}")
+
+    def on_update(self, position, old_row, new_row):
+        """Recount after an edit, since the old base amount is gone, and alert if the edit raised its month's spend
+
+        Before and after are the totals of the entry's category and month either side of
+        the edit, so an edit that leaves them alone, like a new name, doesn't alert again.
+        """
+        old_spend = self.monthly_spend
+        self.monthly_spend = self.monthly_totals(self.ledger)
+        category, timestamp = new_row[2], new_row[4]
+        if timestamp == MISSING_TIMESTAMP:
+            return
+        month = pd.Timestamp(timestamp).strftime("%Y-%m")
+        key = (category, month)
+        before, after = old_spend.get(key, 0.0), self.monthly_spend.get(key, 0.0)
+        self.queue_alert(self.check_budget(category, month, before, after))
+
+    def on_delete(self, position, name, account, category, amount, timestamp):
+        amount = self.ledger.base_amounts.view[position]
+        if not amount > 0 or timestamp == MISSING_TIMESTAMP:
+            return
+        key = (category, pd.Timestamp(timestamp).strftime("%Y-%m"))
+        self.monthly_spend[key] = self.monthly_spend.get(key, 0.0) - amount
+
+    def on_rates(self, positions, old_base_amounts):
+        """Apply the change of converted amounts as one grouped delta per category and month"""
+        live = self.ledger.live.view[positions]
+        positions = positions[live]
+        new_totals = self.monthly_totals(self.ledger, positions)
+        old_totals = self.monthly_totals(self.ledger, positions, old_base_amounts[live])
+        for key in set(new_totals) | set(old_totals):
+            self.monthly_spend[key] = (self.monthly_spend.get(key, 0.0)
+                                       + new_totals.get(key, 0.0) - old_totals.get(key, 0.0))
+
+    def set_budget_command(self, message):
+        """Command to set a monthly budget for a category"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
 
-        try:
-            # Check if the Excel file exists
-            if not os.path.exists(excel_file):
-                # If the file doesn't exist, there's nothing to update
-                return updated_count
+        if self.accounts_cog.is_first_time():
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
 
-            # Read the Excel file
-            df = pd.read_excel(excel_file)
+        from telebot import types
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(*[
+            types.InlineKeyboardButton(text=category, callback_data=f"budget_cat_{category}")
+            for category in self.categories
+        ])
+        self.bot.send_message(message.chat.id, "Set a budget for which category?", reply_markup=markup)
+
+    def process_budget_category_callback_impl(self, call):
+        """Process the category selection for a budget"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID:
+            return
+
+        category = call.data.replace('budget_cat_', '', 1)
+        self.edit_category_session[user_id] = category
+        self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=f"Budget for '{category}'.\n"
+                 f"Please enter the limit, optionally followed by the month (YYYY-MM), e.g. '300' or '300 2026-11'.\n"
+                 f"A limit of 0 removes the budget."
+        )
+        self.bot.register_next_step_handler(call.message, self.process_budget_amount)
+
+    def process_budget_amount(self, message):
+        """Process the budget limit and month"""
+        if not self.is_authorized(message):
+            return
+
+        user_id = message.from_user.id
+        if user_id not in self.edit_category_session:
+            self.bot.reply_to(message, "Session expired. Please try again.")
+            return
 
-            # Check if the Category column exists
-            if 'Category' not in df.columns:
-                return updated_count
+        parts = message.text.split()
+        try:
+            limit = float(parts[0])
+            month = pd.Period(parts[1], freq="M").strftime("%Y-%m") if len(parts) > 1 else pd.Timestamp.now().strftime("%Y-%m")
+            if limit < 0 or len(parts) > 2:
+                raise ValueError
+        except (ValueError, IndexError):
+            msg = self.bot.reply_to(message, "Please enter a non-negative limit and an optional YYYY-MM month:")
+            self.bot.register_next_step_handler(msg, self.process_budget_amount)
+            return
 
-            # Find all rows with the old category and update them
-            mask = df['Category'] == old_category
-            updated_count = mask.sum()
+        category = self.edit_category_session.pop(user_id)
+        if limit == 0:
+            self.budgets.pop((category, month), None)
+            self.save_budgets()
+            self.bot.reply_to(message, f"Budget for '{category}' in {month} removed.")
+            return
 
-            if updated_count > 0:
-                df.loc[mask, 'Category'] = new_category
+        self.budgets[(category, month)] = limit
+        self.save_budgets()
+        spent = self.monthly_spend.get((category, month), 0.0)
+        self.bot.reply_to(message, f"Budget for '{category}' in {month} set to {limit:.2f}.\n"
+                                   f"Spent so far: {spent:.2f} ({spent / limit:.0%})")
 
-                # Save the updated dataframe
-                df.to_excel(excel_file, index=False)
+    def budgets_command(self, message):
+        """Command to show this month's budgets and how much of each is spent"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
 
-            return updated_count
-        except Exception as e:
-            print(f"Error updating Excel file: {e}")
-            return updated_count
+        month = pd.Timestamp.now().strftime("%Y-%m")
+        lines = []
+        for (category, budget_month), limit in sorted(self.budgets.items()):
+            if budget_month != month:
+                continue
+            spent = self.monthly_spend.get((category, month), 0.0)
+            lines.append(f"• {category}: {spent:.2f} / {limit:.2f} ({spent / limit:.0%})")
+
+        if not lines:
+            self.bot.reply_to(message, f"No budgets set for {month}. Use /setbudget to add one.")
+            return
+        self.bot.reply_to(message, f"Budgets for {month}:\n\n" + "\n".join(lines))
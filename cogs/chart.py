@@ -0,0 +1,199 @@
+import io
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from cogs.query import compile_query, run_query
+from storage.ledger import MISSING_TIMESTAMP
+
+CHART_TYPES = ("pie", "trend")
+
+# Slices beyond this many categories are grouped into "Other"
+MAX_PIE_SLICES = 8
+
+# Rendered PNGs kept, least recently used dropped first
+CHART_CACHE_SIZE = 32
+
+CHART_WORKERS = 2
+
+
+def render_chart(chart_type, title, labels, series):
+    """Draw a chart and return it as PNG bytes; runs in a worker process
+
+    series maps a legend label to one value per label (one series for a pie).
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots(figsize=(8, 6), dpi=100)
+    if chart_type == "pie":
+        values = next(iter(series.values()))
+        axes.pie(values, labels=labels, autopct="%1.0f%%", startangle=90, counterclock=False)
+        axes.axis("equal")
+    else:
+        for label, values in series.items():
+            axes.plot(labels, values, marker="o", label=label)
+        axes.set_ylabel("Amount")
+        axes.grid(True, alpha=0.3)
+        axes.legend()
+        figure.autofmt_xdate()
+    axes.set_title(title)
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(figure)
+    return buffer.getvalue()
+
+
+class ChartCog:
+    def __init__(self, bot, allowed_user_id, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+        self.executor = None
+        # (chart type, compiled filters, ledger version) -> (rates stamp of the charted rows, PNG bytes)
+        self.cache = OrderedDict()
+        # Charts being rendered -> chats waiting for them, so a repeated request doesn't render twice
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        # Register command handler
+        @bot.message_handler(commands=['chart'])
+        def chart_command_handler(message):
+            self.chart_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def get_executor(self):
+        if self.executor is None:
+            # Worker processes are spawned, not forked from a process running the polling threads
+            self.executor = ProcessPoolExecutor(max_workers=CHART_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def chart_command(self, message):
+        """Send a chart of the ledger, e.g. /chart pie since=2026-01 or /chart trend account=Cash"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        parts = message.text.split(maxsplit=2)
+        if len(parts) < 2 or parts[1] not in CHART_TYPES:
+            self.bot.reply_to(
+                message,
+                "Usage: /chart pie|trend [filters]\n\n"
+                "pie - spending by category\n"
+                "trend - spending and income per month\n\n"
+                "Filters are the same as for /query, e.g. /chart pie since=2026-01"
+            )
+            return
+
+        chart_type = parts[1]
+        try:
+            terms = compile_query(parts[2].strip() if len(parts) > 2 else "")
+        except ValueError as e:
+            self.bot.reply_to(message, str(e))
+            return
+
+        with self.ledger.lock:
+            key = (chart_type, terms, self.ledger.version)
+            with self.lock:
+                png = None
+                if key in self.cache:
+                    stamp, png = self.cache[key]
+                    # A rate reload only makes the charts of rows in its currencies stale
+                    if self.ledger.rates_current(stamp):
+                        self.cache.move_to_end(key)
+                    else:
+                        del self.cache[key]
+                        png = None
+                if png is None and key in self.pending:
+                    self.pending[key].append(message.chat.id)
+                    return
+            if png is None:
+                mask = run_query(self.ledger, terms)
+                data = self.chart_data(chart_type, mask)
+                stamp = self.ledger.rates_stamp(mask)
+
+        if png is not None:
+            self.bot.send_photo(message.chat.id, png)
+            return
+
+        if data is None:
+            self.bot.reply_to(message, "No entries match this chart.")
+            return
+
+        # Rendering happens off the polling thread; the photo is sent once the worker is done
+        with self.lock:
+            self.pending[key] = [message.chat.id]
+        future = self.get_executor().submit(render_chart, chart_type, *data)
+        future.add_done_callback(lambda future: self.chart_rendered(key, stamp, future))
+
+    def chart_data(self, chart_type, mask):
+        """Aggregate the entries in mask into (title, labels, series), or None if nothing matches"""
+        amounts = self.ledger.base_amounts.view
+
+        if chart_type == "pie":
+            totals = self.ledger.totals_by("Category", mask & (amounts > 0))
+            if not totals:
+                return None
+            ordered = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+            if len(ordered) > MAX_PIE_SLICES:
+                other = sum(total for _, total in ordered[MAX_PIE_SLICES - 1:])
+                ordered = ordered[:MAX_PIE_SLICES - 1] + [("Other", other)]
+            labels = [category for category, _ in ordered]
+            return "Spending by category", labels, {"Spending": [total for _, total in ordered]}
+
+        timestamps = self.ledger.timestamps.view
+        mask = mask & (timestamps != MISSING_TIMESTAMP) & ~np.isnan(amounts)
+        if not mask.any():
+            return None
+        df = pd.DataFrame({
+            "Month": timestamps[mask].view("datetime64[ns]").astype("datetime64[M]"),
+            "Amount": amounts[mask],
+        })
+        spending = df["Amount"].clip(lower=0).groupby(df["Month"]).sum()
+        income = (-df["Amount"]).clip(lower=0).groupby(df["Month"]).sum()
+        # Months without entries still get a point, so the line doesn't skip them
+        months = pd.period_range(spending.index.min(), spending.index.max(), freq="M").to_timestamp()
+        spending = spending.reindex(months, fill_value=0.0)
+        income = income.reindex(months, fill_value=0.0)
+        labels = [month.strftime("%Y-%m") for month in months]
+        series = {"Spending": spending.tolist()}
+        if income.any():
+            series["Income"] = income.tolist()
+        return "Spending per month", labels, series
+
+    def evict_caches(self):
+        """Drop the rendered charts, returning how many there were"""
+        with self.lock:
+            dropped = len(self.cache)
+            self.cache.clear()
+            return dropped
+
+    def chart_rendered(self, key, stamp, future):
+        """Cache a finished chart and send it to every chat that asked for it"""
+        with self.lock:
+            chat_ids = self.pending.pop(key, [])
+        try:
+            png = future.result()
+        except ImportError:
+            for chat_id in chat_ids:
+                self.bot.send_message(chat_id, "Charts need matplotlib, please install it (see requirements.txt).")
+            return
+        except Exception as e:
+            print(f"Error rendering chart: {e}")
+            for chat_id in chat_ids:
+                self.bot.send_message(chat_id, "Sorry, the chart could not be rendered.")
+            return
+
+        with self.lock:
+            self.cache[key] = (stamp, png)
+            while len(self.cache) > CHART_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        for chat_id in chat_ids:
+            self.bot.send_photo(chat_id, png)
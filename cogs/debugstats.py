@@ -0,0 +1,168 @@
+import gc
+import os
+import resource
+import sys
+import tracemalloc
+from collections import deque
+import numpy as np
+import pandas as pd
+
+# Allocation sites listed when tracemalloc is tracing (start the bot with TRACEMALLOC=<frames>)
+TOP_ALLOCATIONS = 10
+
+# Attributes listed per cog, largest first
+MAX_STATE_SHOWN = 25
+
+CONTAINER_TYPES = (dict, list, set, deque, tuple, pd.DataFrame, np.ndarray)
+
+
+def rss_bytes():
+    """Resident set size of this process, or its peak where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def approximate_size(value):
+    """Bytes held by a container and the objects directly inside it, not counting deeper ones"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    items = value.items() if isinstance(value, dict) else ((item, None) for item in value)
+    for key, item in items:
+        size += sys.getsizeof(key) + (sys.getsizeof(item) if item is not None else 0)
+    return size
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def state_sizes(owner, prefix=""):
+    """(attribute path, length, approximate bytes) of every container held by a cog and its helpers"""
+    sizes = []
+    for name, value in vars(owner).items():
+        if isinstance(value, CONTAINER_TYPES):
+            sizes.append((prefix + name, len(value), approximate_size(value)))
+        elif type(value).__module__.startswith("cogs.") and not prefix and not hasattr(value, "bot"):
+            # Helpers like the suggestion engine or the daily spend arrays, one level down
+            sizes.extend(state_sizes(value, f"{name}."))
+    return sizes
+
+
+class DebugStatsCog:
+    def __init__(self, bot, allowed_user_id, ledger, cogs, soft_limit=None):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+        self.cogs = cogs
+        # Resident memory in bytes above which caches are dropped, None for no limit
+        self.soft_limit = soft_limit
+        self.evictions = 0
+
+        # Register command handler
+        @bot.message_handler(commands=['debugstats'])
+        def debugstats_command_handler(message):
+            self.debugstats_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def buffer_stats(self):
+        """(column, rows used, rows allocated, bytes allocated) of every ledger buffer"""
+        with self.ledger.lock:
+            buffers = dict(self.ledger.codes)
+            buffers.update({"Amount": self.ledger.amounts, "Base amount": self.ledger.base_amounts,
+                            "Timestamp": self.ledger.timestamps, "ID": self.ledger.ids, "Live": self.ledger.live})
+            return [(column, buffer.size, len(buffer.data), buffer.data.nbytes) for column, buffer in buffers.items()]
+
+    def report(self):
+        lines = [f"Memory: {format_bytes(rss_bytes())} resident"
+                 + (f" (soft limit {format_bytes(self.soft_limit)}, caches dropped {self.evictions} times)"
+                    if self.soft_limit else "")]
+
+        lines.append("\nLedger buffers (rows used / allocated):")
+        total = 0
+        for column, used, allocated, size in self.buffer_stats():
+            total += size
+            lines.append(f"• {column}: {used} / {allocated}, {format_bytes(size)}")
+        with self.ledger.lock:
+            values = {column: len(dictionary) for column, dictionary in self.ledger.dictionaries.items()}
+        lines.append(f"• total {format_bytes(total)}; distinct values "
+                     + ", ".join(f"{column} {count}" for column, count in values.items()))
+
+        lines.append("\nCog state (items, approximate size):")
+        for cog in self.cogs:
+            sizes = sorted(state_sizes(cog), key=lambda entry: entry[2], reverse=True)[:MAX_STATE_SHOWN]
+            if sizes:
+                lines.append(f"{type(cog).__name__}: " + ", ".join(
+                    f"{name} {length} ({format_bytes(size)})" for name, length, size in sizes))
+
+        dispatcher = getattr(self.bot, "dispatcher", None)
+        if dispatcher is not None:
+            stats = dispatcher.stats()
+            lines.append(f"\nUpdate queue: {stats['pending']} queued of {stats['max_pending']}, "
+                         f"{stats['active_chats']} chats")
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+            lines.append(f"\nTop {TOP_ALLOCATIONS} allocation sites:")
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                frame = stat.traceback[0]
+                lines.append(f"• {os.path.relpath(frame.filename)}:{frame.lineno}: "
+                             f"{format_bytes(stat.size)} in {stat.count} blocks")
+        else:
+            lines.append("\nStart the bot with TRACEMALLOC=1 to see the top allocation sites.")
+        return "\n".join(lines)
+
+    def evict_caches(self):
+        """Drop every cog's caches, returning how many entries were dropped"""
+        dropped = 0
+        for cog in self.cogs:
+            if hasattr(cog, "evict_caches"):
+                dropped += cog.evict_caches()
+        gc.collect()
+        self.evictions += 1
+        return dropped
+
+    def enforce_limits(self):
+        """Drop the caches if resident memory is above the soft limit"""
+        if not self.soft_limit:
+            return 0
+        before = rss_bytes()
+        if before <= self.soft_limit:
+            return 0
+        dropped = self.evict_caches()
+        print(f"Memory {format_bytes(before)} above the soft limit of {format_bytes(self.soft_limit)}: "
+              f"dropped {dropped} cached entries, now {format_bytes(rss_bytes())}")
+        return dropped
+
+    def dump(self):
+        """Print the report, for the periodic job, and enforce the soft limit"""
+        print(self.report())
+        self.enforce_limits()
+
+    def debugstats_command(self, message):
+        """Show where the bot's memory goes"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        self.enforce_limits()
+        report = self.report()
+        # Telegram messages are limited to 4096 characters
+        for start in range(0, len(report), 4000):
+            self.bot.reply_to(message, report[start:start + 4000])
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+from cogs.suggest import normalize_name
+from storage.ledger import MISSING_TIMESTAMP
+
+NS_PER_DAY = 86_400_000_000_000
+
+# Key component for a missing amount or date, which never matches a real value
+MISSING_KEY = np.iinfo(np.int64).min
+
+MAX_CLUSTERS_SHOWN = 10
+
+
+def amount_key(amount):
+    return MISSING_KEY if pd.isna(amount) else int(round(amount * 100))
+
+
+def day_key(timestamp):
+    return MISSING_KEY if timestamp == MISSING_TIMESTAMP else timestamp // NS_PER_DAY
+
+
+def duplicate_keys(ledger):
+    """Key columns (normalized name id, account code, amount in cents, day) of every live row, by position"""
+    with ledger.lock:
+        names = ledger.dictionaries["Name"].values
+        # Names that differ only in case or surrounding spaces share an id
+        normalized_ids, _ = pd.factorize(pd.Series([normalize_name(name) for name in names], dtype=object))
+        amounts = ledger.amounts.view
+        timestamps = ledger.timestamps.view
+        keys = pd.DataFrame({
+            "name": normalized_ids[ledger.codes["Name"].view] if len(names) else np.zeros(0, dtype=np.int64),
+            "account": ledger.codes["Account"].view.astype(np.int64),
+            "amount": np.where(np.isnan(amounts), MISSING_KEY, np.round(np.nan_to_num(amounts) * 100)).astype(np.int64),
+            "day": np.where(timestamps == MISSING_TIMESTAMP, MISSING_KEY, timestamps // NS_PER_DAY),
+        })
+        return keys[ledger.live.view]
+
+
+def duplicate_clusters(ledger):
+    """Group the row positions sharing a key, with one hashing pass over the key columns"""
+    keys = duplicate_keys(ledger)
+    # Missing amounts or dates can't tell two rows apart, so they are never reported
+    keys = keys[(keys["amount"] != MISSING_KEY) & (keys["day"] != MISSING_KEY)]
+    duplicated = keys[keys.duplicated(keep=False)]
+    if duplicated.empty:
+        return []
+    groups = duplicated.groupby(list(duplicated.columns), sort=False).indices
+    return [duplicated.index[positions].to_numpy() for positions in groups.values()]
+
+
+class DuplicateIndex:
+    """Hash index from (normalized name, account, amount, day) to the latest row with that key
+
+    Built once on load from the ledger columns and updated on every insert, so
+    checking a new entry for a likely duplicate is a single dict lookup.
+    """
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.index = {}
+        self.name_ids = {}
+        self.accounts = ledger.dictionaries["Account"]
+        ledger.add_listener(self)
+
+    def on_load(self, ledger):
+        self.rebuild()
+
+    def on_append(self, position, name, account, category, amount, timestamp):
+        self.index[self.key(name, account, amount, timestamp)] = position
+
+    def on_replace(self, column, old_value, new_value):
+        if column in ("Name", "Account"):
+            self.rebuild()
+
+    def on_update(self, position, old_row, new_row):
+        self.on_delete(position, *old_row)
+        self.on_append(position, *new_row)
+
+    def on_delete(self, position, name, account, category, amount, timestamp):
+        key = self.key(name, account, amount, timestamp)
+        if self.index.get(key) != position:
+            return
+        # Another live row may still have the same key, e.g. after /undo of one of two identical entries
+        remaining = self.latest_with_key(name, account, amount, timestamp, exclude=position)
+        if remaining is None:
+            del self.index[key]
+        else:
+            self.index[key] = remaining
+
+    def latest_with_key(self, name, account, amount, timestamp, exclude):
+        """Latest live position other than exclude with the same key, found with one pass over the columns"""
+        if pd.isna(amount) or timestamp == MISSING_TIMESTAMP:
+            return None
+        ledger = self.ledger
+        timestamps = ledger.timestamps.view
+        candidates = np.flatnonzero(
+            ledger.live.view
+            & (ledger.codes["Account"].view == self.accounts.lookup(account))
+            & (np.round(np.nan_to_num(ledger.amounts.view) * 100) == amount_key(amount))
+            & (timestamps != MISSING_TIMESTAMP)
+            & (timestamps // NS_PER_DAY == day_key(timestamp))
+        )
+        normalized = normalize_name(name)
+        names = ledger.dictionaries["Name"].values
+        for candidate in candidates[::-1].tolist():
+            if candidate != exclude and normalize_name(names[ledger.codes["Name"].view[candidate]]) == normalized:
+                return candidate
+        return None
+
+    def rebuild(self):
+        with self.ledger.lock:
+            keys = duplicate_keys(self.ledger)
+            names = self.ledger.dictionaries["Name"].values
+            self.accounts = self.ledger.dictionaries["Account"]
+        # Same first-seen numbering as the factorize in duplicate_keys, kept so inserts can extend it
+        self.name_ids = {}
+        for name in names:
+            self.name_ids.setdefault(normalize_name(name), len(self.name_ids))
+        # Later rows overwrite earlier ones, leaving the latest position per key
+        self.index = dict(zip(
+            zip(keys["name"].tolist(), keys["account"].tolist(), keys["amount"].tolist(), keys["day"].tolist()),
+            keys.index.tolist(),
+        ))
+
+    def key(self, name, account, amount, timestamp):
+        name_id = self.name_ids.setdefault(normalize_name(name), len(self.name_ids))
+        return name_id, self.accounts.lookup(account), amount_key(amount), day_key(timestamp)
+
+    def find(self, name, account, amount, timestamp):
+        """Position of an existing row with the same name, account, amount and day, or None"""
+        if pd.isna(amount) or timestamp == MISSING_TIMESTAMP:
+            return None
+        return self.index.get(self.key(name, account, amount, timestamp))
+
+
+class DedupeCog:
+    def __init__(self, bot, allowed_user_id, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+
+        # Register command handler
+        @bot.message_handler(commands=['dedupe'])
+        def dedupe_command_handler(message):
+            self.dedupe_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def dedupe_command(self, message):
+        """List groups of entries with the same name, account, amount and day"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        clusters = duplicate_clusters(self.ledger)
+        if not clusters:
+            self.bot.reply_to(message, "No duplicate entries found.")
+            return
+
+        extra = sum(len(positions) - 1 for positions in clusters)
+        lines = []
+        # Most recent clusters first
+        for positions in sorted(clusters, key=lambda positions: positions[-1], reverse=True)[:MAX_CLUSTERS_SHOWN]:
+            name, account, category, amount, date = self.ledger.rows(positions[:1])[0]
+            lines.append(f"• {len(positions)}× {date.strftime('%Y-%m-%d')}  {name} · {account} · {category} · {amount:g}")
+
+        summary = f"Found {len(clusters)} groups of duplicates ({extra} extra entries):\n\n" + "\n".join(lines)
+        if len(clusters) > MAX_CLUSTERS_SHOWN:
+            summary += f"\n\n(showing the latest {MAX_CLUSTERS_SHOWN})"
+        self.bot.reply_to(message, summary)
@@ -0,0 +1,209 @@
+import math
+import pandas as pd
+from telebot import types
+from storage.ledger import EDITABLE_COLUMNS, MISSING_TIMESTAMP
+
+# How many of the latest entries /edit offers
+RECENT_ENTRIES = 5
+
+
+def describe_row(row_id, row):
+    name, account, category, amount, timestamp = row
+    date = pd.Timestamp(timestamp).strftime("%Y-%m-%d") if timestamp != MISSING_TIMESTAMP else "----------"
+    return f"#{row_id} {date}  {name} · {account} · {category} · {amount:g}"
+
+
+class EditCog:
+    def __init__(self, bot, allowed_user_id, accounts_cog, categories_cog, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.accounts_cog = accounts_cog
+        self.categories_cog = categories_cog
+        self.ledger = ledger
+        self.edit_entry_session = {}
+
+        # Register command handlers
+        @bot.message_handler(commands=['undo'])
+        def undo_command_handler(message):
+            self.undo_command(message)
+
+        @bot.message_handler(commands=['edit'])
+        def edit_command_handler(message):
+            self.edit_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def parse_row_id(self, message):
+        """The entry ID given after the command, the latest entry's if there is none, or None if invalid"""
+        parts = message.text.split()
+        if len(parts) < 2:
+            latest = self.ledger.latest(1)
+            return latest[0] if latest else None
+        try:
+            row_id = int(parts[1].lstrip("#"))
+        except ValueError:
+            return None
+        return row_id if row_id >= 0 and row_id in self.ledger.positions else None
+
+    def get_row(self, row_id):
+        with self.ledger.lock:
+            return self.ledger.row(self.ledger.positions[row_id])
+
+    def undo_command(self, message):
+        """Delete the latest entry, or the one whose ID is given, e.g. /undo 42"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        row_id = self.parse_row_id(message)
+        if row_id is None:
+            self.bot.reply_to(message, "No such entry. Entry IDs are shown by /query and /edit.")
+            return
+
+        row = self.ledger.delete(row_id)
+        self.bot.reply_to(message, f"Entry removed:\n\n{describe_row(row_id, row)}")
+
+    def edit_command(self, message):
+        """Edit one of the latest entries, or the one whose ID is given, e.g. /edit 42"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if len(message.text.split()) > 1:
+            row_id = self.parse_row_id(message)
+            if row_id is None:
+                self.bot.reply_to(message, "No such entry. Entry IDs are shown by /query and /edit.")
+                return
+            self.ask_for_field(message.chat.id, message.from_user.id, row_id)
+            return
+
+        row_ids = self.ledger.latest(RECENT_ENTRIES)
+        if not row_ids:
+            self.bot.reply_to(message, "There are no entries to edit.")
+            return
+
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(*[
+            types.InlineKeyboardButton(text=describe_row(row_id, self.get_row(row_id)),
+                                       callback_data=f"edit_entry_{row_id}")
+            for row_id in row_ids
+        ])
+        self.bot.send_message(message.chat.id, "Select an entry to edit:", reply_markup=markup)
+
+    def ask_for_field(self, chat_id, user_id, row_id):
+        self.edit_entry_session[user_id] = {"id": row_id}
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(*[
+            types.InlineKeyboardButton(text=column, callback_data=f"edit_field_{column}")
+            for column in EDITABLE_COLUMNS
+        ])
+        self.bot.send_message(chat_id, f"Editing:\n{describe_row(row_id, self.get_row(row_id))}\n\n"
+                                       f"Which field do you want to change?", reply_markup=markup)
+
+    def setup_callback_handlers(self):
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('edit_entry_'))
+        def process_edit_entry_callback(call):
+            self.process_edit_entry_callback_impl(call)
+
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith(('edit_field_', 'edit_value_')))
+        def process_edit_field_callback(call):
+            self.process_edit_field_callback_impl(call)
+
+    def process_edit_entry_callback_impl(self, call):
+        """Process the selection of the entry to edit"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID:
+            return
+
+        self.bot.answer_callback_query(call.id)
+        row_id = int(call.data.replace('edit_entry_', '', 1))
+        if row_id not in self.ledger.positions:
+            self.bot.send_message(call.message.chat.id, "This entry no longer exists.")
+            return
+        self.ask_for_field(call.message.chat.id, user_id, row_id)
+
+    def process_edit_field_callback_impl(self, call):
+        """Process the field to change and, for accounts and categories, the new value"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID:
+            return
+
+        self.bot.answer_callback_query(call.id)
+        session = self.edit_entry_session.get(user_id)
+        if not session:
+            self.bot.send_message(call.message.chat.id, "Session expired. Please try again.")
+            return
+
+        if call.data.startswith('edit_value_'):
+            self.save_edit(call.message.chat.id, user_id, call.data.replace('edit_value_', '', 1))
+            return
+
+        column = call.data.replace('edit_field_', '', 1)
+        session["column"] = column
+        if column in ("Account", "Category"):
+            values = self.accounts_cog.get_accounts() if column == "Account" else self.categories_cog.get_categories()
+            markup = types.InlineKeyboardMarkup(row_width=2)
+            markup.add(*[
+                types.InlineKeyboardButton(text=value, callback_data=f"edit_value_{value}")
+                for value in values
+            ])
+            self.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                       text=f"Select the new {column.lower()}:", reply_markup=markup)
+        else:
+            prompt = f"Please enter the new {column.lower()}:"
+            if column == "Currency":
+                prompt = "Please enter the new currency code, or '-' for the account's currency:"
+            self.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                       text=prompt)
+            self.bot.register_next_step_handler(call.message, self.process_edit_value)
+
+    def process_edit_value(self, message):
+        """Process a typed name or amount"""
+        if not self.is_authorized(message):
+            return
+
+        user_id = message.from_user.id
+        session = self.edit_entry_session.get(user_id)
+        if not session or "column" not in session:
+            self.bot.reply_to(message, "Session expired. Please try again.")
+            return
+
+        value = message.text.strip()
+        if value.startswith("/"):
+            # A command instead of a value, e.g. /cancel, ends the edit
+            self.edit_entry_session.pop(user_id, None)
+            self.bot.reply_to(message, "Edit canceled.")
+            return
+        if session["column"] == "Currency":
+            # '-' clears the entry's currency, so it follows its account's again
+            value = "" if value == "-" else value.upper()
+            if value and not (len(value) == 3 and value.isalpha()):
+                msg = self.bot.reply_to(message, "Please enter a three-letter currency code, e.g. USD, or '-':")
+                self.bot.register_next_step_handler(msg, self.process_edit_value)
+                return
+            # The account's own currency is stored as empty, as for new entries
+            if value and session["id"] in self.ledger.positions and \
+                    value == self.accounts_cog.currencies.get(self.get_row(session["id"])[1], ""):
+                value = ""
+        elif session["column"] == "Amount":
+            try:
+                value = float(value)
+                if not math.isfinite(value):
+                    raise ValueError(value)
+            except ValueError:
+                msg = self.bot.reply_to(message, "Please enter a valid number for the amount:")
+                self.bot.register_next_step_handler(msg, self.process_edit_value)
+                return
+        self.save_edit(message.chat.id, user_id, value)
+
+    def save_edit(self, chat_id, user_id, value):
+        session = self.edit_entry_session.pop(user_id)
+        row_id = session["id"]
+        if row_id not in self.ledger.positions:
+            self.bot.send_message(chat_id, "This entry no longer exists.")
+            return
+
+        old_row = self.ledger.update(row_id, {session["column"]: value})
+        self.bot.send_message(chat_id, f"Entry updated:\n\n{describe_row(row_id, old_row)}\n→ "
+                                       f"{describe_row(row_id, self.get_row(row_id))}")
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import pandas as pd
+
+
+class ExportCog:
+    def __init__(self, bot, allowed_user_id, accounts_cog, categories_cog, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.accounts_cog = accounts_cog
+        self.categories_cog = categories_cog
+        self.ledger = ledger
+        # Name of the document sent; each export is written to its own temporary directory
+        self.export_file = "export.xlsx"
+
+        # Register command handler
+        @bot.message_handler(commands=['export'])
+        def export_command_handler(message):
+            self.export_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def export_command(self, message):
+        """Build a complete workbook from the ledger and send it as a document"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if self.accounts_cog.is_first_time():
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, self.export_file)
+            count = self.export_to_excel(file_path)
+            with open(file_path, "rb") as document:
+                self.bot.send_document(message.chat.id, document, caption=f"{count} expense entries")
+
+    def export_to_excel(self, file_path):
+        """Write accounts, categories and every expense (archived months included) to one workbook, returning the expense count"""
+        expenses_df = self.ledger.frame
+        with pd.ExcelWriter(file_path) as writer:
+            pd.DataFrame({"Account": self.accounts_cog.get_accounts()}).to_excel(
+                writer, sheet_name="Accounts", index=False)
+            pd.DataFrame({"Category": self.categories_cog.get_categories()}).to_excel(
+                writer, sheet_name="Categories", index=False)
+            expenses_df.to_excel(writer, sheet_name="Expenses", index=False)
+        return len(expenses_df)
@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+from storage.ledger import MISSING_TIMESTAMP, to_timestamp
+
+NS_PER_DAY = 86_400_000_000_000
+
+# Complete months whose spending pattern shapes the rest of the current month's forecast
+HISTORY_MONTHS = 6
+
+# Rows added at a time when the daily array grows
+GROWTH_DAYS = 64
+
+
+def month_bounds(month):
+    """First day and the day after the last of a numpy datetime64[M] month, as day numbers"""
+    return (int(month.astype("datetime64[D]").astype(np.int64)),
+            int((month + 1).astype("datetime64[D]").astype(np.int64)))
+
+
+class DailySpend:
+    """Expenses in the base currency per day and per code of a ledger column, as a dense days x codes array
+
+    Day numbers count days since 1970-01-01; row 0 is first_day. An insert or a
+    deletion changes one cell, growing the array when a new day or code comes
+    up, and anything else rebuilds it with one bincount over the ledger. Only
+    positive amounts (expenses) are counted.
+    """
+
+    def __init__(self, ledger, column):
+        self.ledger = ledger
+        self.column = column
+        self.first_day = 0
+        self.totals = np.zeros((0, 0), dtype=np.float64)
+
+    def rebuild(self):
+        with self.ledger.lock:
+            positions = np.flatnonzero(self.ledger.live.view)
+            amounts = self.ledger.base_amounts.view[positions]
+            timestamps = self.ledger.timestamps.view[positions]
+            codes = self.ledger.codes[self.column].view[positions].astype(np.int64)
+            width = max(len(self.ledger.dictionaries[self.column]), 1)
+        valid = (amounts > 0) & (timestamps != MISSING_TIMESTAMP)
+        days = timestamps[valid] // NS_PER_DAY
+        self.first_day = int(days.min()) if len(days) else 0
+        length = int(days.max()) - self.first_day + 1 if len(days) else 0
+        cells = (days - self.first_day) * width + codes[valid]
+        # Without any cells bincount returns int64, which later additions would truncate
+        self.totals = np.bincount(cells, weights=amounts[valid], minlength=length * width) \
+            .astype(np.float64).reshape(length, width)
+
+    def add(self, code, amount, timestamp, sign=1):
+        if not amount > 0 or timestamp == MISSING_TIMESTAMP:
+            return
+        day = timestamp // NS_PER_DAY
+        if day < self.first_day and len(self.totals):
+            # Entries dated before everything else are rare enough to rebuild for
+            self.rebuild()
+            return
+        if not len(self.totals):
+            self.first_day = day
+        row = day - self.first_day
+        rows, width = self.totals.shape
+        if row >= rows or code >= width:
+            self.totals = np.pad(self.totals, ((0, max(row + GROWTH_DAYS - rows, 0)), (0, max(code + 1 - width, 0))))
+        self.totals[row, code] += sign * amount
+
+    def apply_deltas(self, codes, deltas, timestamps):
+        """Add deltas to the cells of many rows at once, returning the last day changed (None if none)"""
+        changed = (deltas != 0) & (timestamps != MISSING_TIMESTAMP)
+        if not changed.any():
+            return None
+        days = timestamps[changed] // NS_PER_DAY
+        codes = codes[changed].astype(np.int64)
+        if not len(self.totals) or days.min() < self.first_day:
+            self.rebuild()
+            return int(days.max())
+        rows = days - self.first_day
+        height, width = self.totals.shape
+        if rows.max() >= height or codes.max() >= width:
+            self.totals = np.pad(self.totals, ((0, max(int(rows.max()) + GROWTH_DAYS - height, 0)),
+                                               (0, max(int(codes.max()) + 1 - width, 0))))
+        np.add.at(self.totals, (rows, codes), deltas[changed])
+        return int(days.max())
+
+    def window(self, start, stop):
+        """Rows of days start to stop (excluded), zero for days outside the array"""
+        rows, width = self.totals.shape
+        result = np.zeros((stop - start, width))
+        low, high = max(start - self.first_day, 0), min(stop - self.first_day, rows)
+        if low < high:
+            result[low + self.first_day - start:high + self.first_day - start] = self.totals[low:high]
+        return result
+
+    def forecast(self, today):
+        """(spent so far, projected month-end total) per code, for the month of day number today
+
+        The rest of the month is projected two ways: at this month's daily rate so
+        far, and as the median of what the past HISTORY_MONTHS spent after the same
+        share of the month. Early in the month the past months weigh most.
+        """
+        month = np.datetime64(int(today), "D").astype("datetime64[M]")
+        start, end = month_bounds(month)
+        elapsed, length = today - start + 1, end - start
+        spent = self.window(start, today + 1).sum(axis=0)
+
+        rests = []
+        for back in range(1, HISTORY_MONTHS + 1):
+            past_start, past_end = month_bounds(month - back)
+            if past_end <= self.first_day:
+                break
+            cut = past_start + round(elapsed / length * (past_end - past_start))
+            rests.append(self.window(cut, past_end).sum(axis=0))
+
+        rest = spent / elapsed * (length - elapsed)
+        if rests:
+            weight = elapsed / length
+            rest = weight * rest + (1 - weight) * np.median(rests, axis=0)
+        return spent, spent + rest
+
+
+class ForecastCog:
+    def __init__(self, bot, allowed_user_id, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+        self.categories = DailySpend(ledger, "Category")
+        self.accounts = DailySpend(ledger, "Account")
+        # (ledger version, day) and the forecast text computed for it
+        self.cache = (None, None)
+        ledger.add_listener(self)
+
+        # Register command handler
+        @bot.message_handler(commands=['forecast'])
+        def forecast_command_handler(message):
+            self.forecast_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    # Daily spend, updated by the ledger
+
+    def on_load(self, ledger):
+        self.rebuild()
+
+    def on_append(self, position, name, account, category, amount, timestamp):
+        amount = self.ledger.base_amounts.view[position]
+        self.categories.add(int(self.ledger.codes["Category"].view[position]), amount, timestamp)
+        self.accounts.add(int(self.ledger.codes["Account"].view[position]), amount, timestamp)
+
+    def on_delete(self, position, name, account, category, amount, timestamp):
+        # A deleted row keeps its values, only its live flag is cleared
+        amount = self.ledger.base_amounts.view[position]
+        self.categories.add(int(self.ledger.codes["Category"].view[position]), amount, timestamp, sign=-1)
+        self.accounts.add(int(self.ledger.codes["Account"].view[position]), amount, timestamp, sign=-1)
+
+    def on_update(self, position, old_row, new_row):
+        # The old base amount is gone, so recount
+        self.rebuild()
+
+    def on_replace(self, column, old_value, new_value):
+        if column in ("Category", "Account"):
+            self.rebuild()
+
+    def on_rates(self, positions, old_base_amounts):
+        """Move each converted row's expense from its old to its new base amount"""
+        live = self.ledger.live.view[positions]
+        positions = positions[live]
+        old = np.where(old_base_amounts[live] > 0, old_base_amounts[live], 0.0)
+        new = self.ledger.base_amounts.view[positions]
+        deltas = np.where(new > 0, new, 0.0) - old
+        timestamps = self.ledger.timestamps.view[positions]
+        last_days = [spend.apply_deltas(self.ledger.codes[spend.column].view[positions], deltas, timestamps)
+                     for spend in (self.categories, self.accounts)]
+        # Rate reloads don't change the ledger version, so the cached forecast is dropped here,
+        # unless every changed row is older than the months it looks at
+        today = to_timestamp(pd.Timestamp.now()) // NS_PER_DAY
+        month = np.datetime64(int(today), "D").astype("datetime64[M]")
+        if last_days[0] is not None and last_days[0] >= month_bounds(month - HISTORY_MONTHS)[0]:
+            self.cache = (None, None)
+
+    def rebuild(self):
+        self.categories.rebuild()
+        self.accounts.rebuild()
+
+    def evict_caches(self):
+        """Drop the cached forecast, returning how many were cached"""
+        with self.ledger.lock:
+            dropped = int(self.cache[0] is not None)
+            self.cache = (None, None)
+            return dropped
+
+    def forecast_command(self, message):
+        """Project this month's spending per category and account"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        today = to_timestamp(pd.Timestamp.now()) // NS_PER_DAY
+        with self.ledger.lock:
+            key = (self.ledger.version, today)
+            if self.cache[0] != key:
+                self.cache = (key, self.format_forecast(today))
+            text = self.cache[1]
+        self.bot.reply_to(message, text)
+
+    def format_forecast(self, today):
+        day = pd.Timestamp(int(today) * NS_PER_DAY)
+        currency = f" {self.ledger.rates.base_currency}" if self.ledger.rates is not None else ""
+        lines = [f"Forecast for {day.strftime('%B %Y')} (day {day.day} of {day.days_in_month}):"]
+        total_spent = total_projected = 0.0
+        for title, spend in (("By category", self.categories), ("By account", self.accounts)):
+            spent, projected = spend.forecast(today)
+            values = self.ledger.dictionaries[spend.column].values
+            rows = [(projected[code], spent[code], values[code]) for code in range(len(spent))
+                    if code < len(values) and projected[code] > 0.005]
+            if not rows:
+                continue
+            lines.append(f"\n{title}:")
+            for projected_total, spent_total, value in sorted(rows, reverse=True):
+                lines.append(f"• {value}: {spent_total:.2f} so far → {projected_total:.2f}{currency}")
+            if spend is self.accounts:
+                total_spent, total_projected = spent.sum(), projected.sum()
+
+        if len(lines) == 1:
+            return "There is no spending to forecast from yet."
+        lines.append(f"\nTotal: {total_spent:.2f} so far → {total_projected:.2f}{currency}")
+        return "\n".join(lines)
@@ -0,0 +1,362 @@
+import argparse
+import os
+from collections import namedtuple
+import pandas as pd
+from cogs.accounts import TRANSFER_COLUMNS
+from cogs.categories import BUDGET_COLUMNS
+from cogs.recurring import RECURRING_COLUMNS
+from storage.ledger import EXPENSE_COLUMNS
+from storage.workbook import WORKBOOK_LOCK, read_sheets, write_sheets
+
+# A problem found in the workbook: row is the Excel row number (the header is row 1, None for the
+# whole sheet) and fix what repair() does about it, with value as its argument
+Issue = namedtuple("Issue", ["sheet", "row", "column", "problem", "fix", "value"])
+
+# Rows that can't be fixed are moved here instead of being deleted
+QUARANTINE_SHEET = "Quarantine"
+
+# Issues listed per kind of problem in a report
+EXAMPLES_PER_PROBLEM = 3
+
+
+def parse_number(value):
+    """A cell's value as a float, accepting a decimal comma, or None if it isn't a number"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if pd.isna(value) else float(value)
+    if isinstance(value, str):
+        text = value.strip().replace(" ", "")
+        if text.count(",") == 1 and "." not in text:
+            text = text.replace(",", ".")
+        try:
+            return float(text)
+        except ValueError:
+            return None
+    return None
+
+
+def is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip()) or (
+        isinstance(value, float) and pd.isna(value))
+
+
+def is_currency(value):
+    return isinstance(value, str) and len(value) == 3 and value.isalpha() and value.isupper()
+
+
+def iter_records(worksheet):
+    """Yield (Excel row number, {column: value}) for every non-empty row below the header"""
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    header = [str(column) if column is not None else "" for column in header]
+    for row_number, values in enumerate(rows, start=2):
+        if all(is_blank(value) for value in values):
+            continue
+        yield row_number, dict(zip(header, values))
+
+
+def sheet_header(worksheet):
+    for values in worksheet.iter_rows(max_row=1, values_only=True):
+        return [str(column) for column in values if column is not None]
+    return []
+
+
+class IdSet:
+    """Set of the non-negative entry IDs seen, as a bitmap, since IDs are dense from 0"""
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.max_id = -1
+
+    def add(self, row_id):
+        """Add row_id, returning False if it was already there"""
+        byte, bit = divmod(row_id, 8)
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        if self.bits[byte] & (1 << bit):
+            return False
+        self.bits[byte] |= 1 << bit
+        self.max_id = max(self.max_id, row_id)
+        return True
+
+
+def check_workbook(path):
+    """Stream every sheet of the workbook once and return the list of Issues
+
+    The workbook is opened read-only and parsed one row at a time; besides the
+    issues found, only the account and category names and a bitmap of the entry
+    IDs are kept in memory.
+    """
+    from openpyxl import load_workbook
+
+    issues = []
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheets = set(workbook.sheetnames)
+
+        def check_names(sheet_name, column):
+            if sheet_name not in sheets:
+                issues.append(Issue(sheet_name, None, None, f"{sheet_name} sheet is missing", "create_sheet", None))
+                return set()
+            if column not in sheet_header(workbook[sheet_name]):
+                issues.append(Issue(sheet_name, None, column, f"{column} column is missing", "add_column", None))
+                return set()
+            seen = set()
+            for row, record in iter_records(workbook[sheet_name]):
+                name = record.get(column)
+                if is_blank(name):
+                    issues.append(Issue(sheet_name, row, column, f"{column.lower()} without a name", "drop", None))
+                elif str(name) in seen:
+                    issues.append(Issue(sheet_name, row, column, f"{column.lower()} {name!r} is listed twice",
+                                        "drop", None))
+                else:
+                    seen.add(str(name))
+                    if sheet_name == "Accounts":
+                        check_account(row, record)
+            return seen
+
+        def check_account(row, record):
+            balance = record.get("Opening Balance")
+            if not is_blank(balance) and parse_number(balance) is None:
+                issues.append(Issue("Accounts", row, "Opening Balance", f"opening balance {balance!r} is not a number",
+                                    "replace", 0.0))
+            currency = record.get("Currency")
+            if not is_blank(currency) and not is_currency(currency):
+                fixed = str(currency).strip().upper()
+                issues.append(Issue("Accounts", row, "Currency", f"invalid currency code {currency!r}",
+                                    "replace", fixed if is_currency(fixed) else ""))
+
+        def check_reference(sheet_name, row, column, value, known, kind):
+            if not is_blank(value) and str(value) not in known:
+                issues.append(Issue(sheet_name, row, column, f"{kind} {value!r} doesn't exist",
+                                    f"add_{kind}", str(value)))
+
+        def check_amount(sheet_name, row, record, column="Amount"):
+            amount = record.get(column)
+            number = parse_number(amount)
+            if number is None:
+                issues.append(Issue(sheet_name, row, column, f"{column.lower()} {amount!r} is not a number",
+                                    "quarantine", None))
+            elif not isinstance(amount, (int, float)):
+                issues.append(Issue(sheet_name, row, column, f"{column.lower()} {amount!r} is stored as text",
+                                    "replace", number))
+
+        accounts = check_names("Accounts", "Account")
+        categories = check_names("Categories", "Category")
+
+        ids = IdSet()
+        if "Expenses" not in sheets:
+            issues.append(Issue("Expenses", None, None, "Expenses sheet is missing", "create_sheet", None))
+        else:
+            worksheet = workbook["Expenses"]
+            header = sheet_header(worksheet)
+            for column in EXPENSE_COLUMNS:
+                if column not in header:
+                    issues.append(Issue("Expenses", None, column, f"{column} column is missing", "add_column", None))
+            for row, record in iter_records(worksheet):
+                check_reference("Expenses", row, "Account", record.get("Account"), accounts, "account")
+                check_reference("Expenses", row, "Category", record.get("Category"), categories, "category")
+                check_amount("Expenses", row, record)
+                date = record.get("Date")
+                if not is_blank(date) and pd.isna(pd.to_datetime(date, errors="coerce")):
+                    issues.append(Issue("Expenses", row, "Date", f"date {date!r} can't be read", "replace", None))
+                currency = record.get("Currency")
+                if not is_blank(currency) and not is_currency(currency):
+                    issues.append(Issue("Expenses", row, "Currency", f"invalid currency code {currency!r}",
+                                        "replace", ""))
+                row_id = parse_number(record.get("ID"))
+                if row_id is None or row_id < 0 or row_id != int(row_id):
+                    issues.append(Issue("Expenses", row, "ID", "entry without a valid ID", "assign_id", None))
+                elif not ids.add(int(row_id)):
+                    issues.append(Issue("Expenses", row, "ID", f"ID {int(row_id)} is used twice", "assign_id", None))
+
+        if "Transfers" in sheets:
+            for row, record in iter_records(workbook["Transfers"]):
+                check_reference("Transfers", row, "From", record.get("From"), accounts, "account")
+                check_reference("Transfers", row, "To", record.get("To"), accounts, "account")
+                check_amount("Transfers", row, record)
+
+        if "Budgets" in sheets:
+            for row, record in iter_records(workbook["Budgets"]):
+                check_reference("Budgets", row, "Category", record.get("Category"), categories, "category")
+                check_amount("Budgets", row, record, "Limit")
+                month = record.get("Month")
+                if pd.isna(pd.to_datetime(str(month), format="%Y-%m", errors="coerce")):
+                    issues.append(Issue("Budgets", row, "Month", f"month {month!r} is not YYYY-MM",
+                                        "quarantine", None))
+
+        if "Recurring" in sheets:
+            for row, record in iter_records(workbook["Recurring"]):
+                check_reference("Recurring", row, "Account", record.get("Account"), accounts, "account")
+                check_reference("Recurring", row, "Category", record.get("Category"), categories, "category")
+                check_amount("Recurring", row, record)
+                day = parse_number(record.get("Day"))
+                if day is None or not 1 <= day <= 31:
+                    issues.append(Issue("Recurring", row, "Day", f"day {record.get('Day')!r} is not 1-31",
+                                        "quarantine", None))
+
+        if "Log" in sheets:
+            for row, record in iter_records(workbook["Log"]):
+                next_id = parse_number(record.get("Next ID"))
+                if next_id is not None and next_id <= ids.max_id:
+                    issues.append(Issue("Log", row, "Next ID", f"next ID {int(next_id)} is already in use",
+                                        "replace", ids.max_id + 1))
+                break
+    finally:
+        workbook.close()
+    return issues
+
+
+def format_report(issues):
+    """Group the issues by sheet, column and fix, with the first few rows of each group"""
+    if not issues:
+        return "No problems found."
+    groups = {}
+    for issue in issues:
+        groups.setdefault((issue.sheet, issue.column, issue.fix), []).append(issue)
+    lines = [f"Found {len(issues)} problems:"]
+    for group in groups.values():
+        line = f"• {group[0].sheet}: {group[0].problem}"
+        rows = [str(issue.row) for issue in group if issue.row is not None]
+        if rows:
+            shown = ", ".join(rows[:EXAMPLES_PER_PROBLEM])
+            line += f" (row {shown})" if len(rows) == 1 else \
+                f" and {len(rows) - 1} more like it (rows {shown}{', …' if len(rows) > EXAMPLES_PER_PROBLEM else ''})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def repair_workbook(path, issues):
+    """Apply every issue's fix and write the changed sheets with a single write_sheets, returning their names"""
+    if not issues:
+        return []
+    with WORKBOOK_LOCK:
+        sheets = read_sheets(path)
+        columns = {"Accounts": ["Account", "Opening Balance", "Currency"], "Categories": ["Category"],
+                   "Expenses": EXPENSE_COLUMNS, "Transfers": TRANSFER_COLUMNS, "Budgets": BUDGET_COLUMNS,
+                   "Recurring": RECURRING_COLUMNS}
+        changed = set()
+        quarantined = []
+        drop = {}
+
+        for issue in issues:
+            if issue.fix == "create_sheet":
+                sheets[issue.sheet] = pd.DataFrame(columns=columns[issue.sheet])
+            elif issue.fix == "add_column":
+                sheets[issue.sheet][issue.column] = None
+            changed.add(issue.sheet)
+
+        for issue in issues:
+            df = sheets[issue.sheet]
+            index = issue.row - 2 if issue.row is not None else None
+            if issue.fix == "replace":
+                df[issue.column] = df[issue.column].astype(object)
+                df.at[index, issue.column] = issue.value
+            elif issue.fix in ("drop", "quarantine"):
+                dropped = drop.setdefault(issue.sheet, set())
+                if issue.fix == "quarantine" and index not in dropped:
+                    quarantined.append({"Sheet": issue.sheet, "Problem": issue.problem,
+                                        **df.loc[index].astype(object).to_dict()})
+                dropped.add(index)
+            elif issue.fix in ("add_account", "add_category"):
+                sheet, column = ("Accounts", "Account") if issue.fix == "add_account" else ("Categories", "Category")
+                if issue.value not in set(sheets[sheet][column].astype(str)):
+                    sheets[sheet] = pd.concat([sheets[sheet], pd.DataFrame({column: [issue.value]})],
+                                              ignore_index=True)
+                    changed.add(sheet)
+
+        # Entries without a usable ID get new ones above every ID in use
+        assign = [issue.row - 2 for issue in issues if issue.fix == "assign_id"]
+        if assign:
+            expenses = sheets["Expenses"]
+            valid = pd.to_numeric(expenses["ID"], errors="coerce")
+            next_id = int(valid.max()) + 1 if valid.notna().any() else 0
+            expenses["ID"] = valid.astype(object)
+            for offset, index in enumerate(assign):
+                expenses.at[index, "ID"] = next_id + offset
+            if "Log" in sheets and "Next ID" in sheets["Log"].columns:
+                logged = pd.to_numeric(sheets["Log"]["Next ID"], errors="coerce").max()
+                sheets["Log"]["Next ID"] = max(int(logged) if pd.notna(logged) else 0, next_id + len(assign))
+                changed.add("Log")
+
+        for sheet, indices in drop.items():
+            sheets[sheet] = sheets[sheet].drop(index=sorted(indices)).reset_index(drop=True)
+        if quarantined:
+            previous = sheets.get(QUARANTINE_SHEET, pd.DataFrame())
+            sheets[QUARANTINE_SHEET] = pd.concat([previous, pd.DataFrame(quarantined)], ignore_index=True)
+            changed.add(QUARANTINE_SHEET)
+
+        write_sheets(path, {sheet: sheets[sheet] for sheet in changed})
+        return sorted(changed)
+
+
+class FsckCog:
+    def __init__(self, bot, allowed_user_id, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+
+        # Register command handler
+        @bot.message_handler(commands=['fsck'])
+        def fsck_command_handler(message):
+            self.fsck_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def fsck_command(self, message):
+        """Check data.xlsx for inconsistencies, and fix them with /fsck repair"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if not os.path.exists(self.ledger.data_file):
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
+
+        repair = message.text.split()[1:2] == ["repair"]
+        with self.ledger.lock, WORKBOOK_LOCK:
+            # The workbook must hold every change before it is checked and rewritten
+            self.ledger.flush()
+            try:
+                issues = check_workbook(self.ledger.data_file)
+                report = format_report(issues)
+                if repair and issues:
+                    changed = repair_workbook(self.ledger.data_file, issues)
+                    # The cogs read the repaired sheets again, then the ledger its expenses
+                    for listener in self.ledger.listeners:
+                        if hasattr(listener, "reload"):
+                            listener.reload()
+                    self.ledger.reload()
+                    report += f"\n\nRepaired, rewriting the {', '.join(changed)} sheets."
+                    if any(issue.fix == "quarantine" for issue in issues):
+                        report += f" Rows that couldn't be fixed were moved to the {QUARANTINE_SHEET} sheet."
+                elif issues:
+                    report += "\n\nUse /fsck repair to fix them."
+            except Exception as e:
+                print(f"Error checking {self.ledger.data_file}: {e}")
+                report = f"Sorry, {self.ledger.data_file} could not be checked: {e}"
+
+        if self.ledger.archive:
+            report += "\n\n(Archived months are kept outside the workbook and weren't checked.)"
+        self.bot.reply_to(message, report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check data.xlsx for inconsistencies and optionally repair it")
+    parser.add_argument("path", nargs="?", default="data.xlsx")
+    parser.add_argument("--repair", action="store_true", help="fix the problems with one rewrite of the workbook")
+    args = parser.parse_args()
+
+    issues = check_workbook(args.path)
+    print(format_report(issues))
+    if args.repair and issues:
+        wal_path = args.path + ".wal"
+        if os.path.exists(wal_path) and os.path.getsize(wal_path) > 0:
+            print(f"\n{wal_path} holds changes not in the workbook yet; stop the bot cleanly (it checkpoints "
+                  f"on exit) or use /fsck repair instead.")
+            raise SystemExit(1)
+        print(f"\nRepaired, rewriting the {', '.join(repair_workbook(args.path, issues))} sheets.")
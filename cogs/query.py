@@ -0,0 +1,190 @@
+import re
+import shlex
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from storage.ledger import MISSING_TIMESTAMP
+
+# field -> operators it accepts
+QUERY_FIELDS = {
+    "name": ("=", "!=", "~"),
+    "account": ("=", "!="),
+    "category": ("=", "!="),
+    "amount": ("=", "!=", ">", "<", ">=", "<="),
+    "since": ("=",),
+    "until": ("=",),
+}
+
+TERM_PATTERN = re.compile(r"^([a-z]+)(>=|<=|!=|=|>|<|~)(.+)$")
+
+MAX_RESULT_LINES = 10
+
+
+def parse_period(text, end=False):
+    """Parse YYYY, YYYY-MM or YYYY-MM-DD into the first instant of the period (or of the next one if end)"""
+    parts = text.split("-")
+    try:
+        if len(parts) == 1:
+            start, offset = pd.Timestamp(year=int(parts[0]), month=1, day=1), pd.DateOffset(years=1)
+        elif len(parts) == 2:
+            start, offset = pd.Timestamp(year=int(parts[0]), month=int(parts[1]), day=1), pd.DateOffset(months=1)
+        elif len(parts) == 3:
+            start, offset = pd.Timestamp(text), pd.DateOffset(days=1)
+        else:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"Invalid date '{text}', use YYYY, YYYY-MM or YYYY-MM-DD.")
+    return start + offset if end else start
+
+
+@lru_cache(maxsize=64)
+def compile_query(text):
+    """Compile a query string such as 'category=Food amount>20 since=2026-01' into a tuple of terms"""
+    terms = []
+    try:
+        tokens = shlex.split(text)
+    except ValueError as e:
+        raise ValueError(f"Could not parse query: {e}")
+
+    for token in tokens:
+        match = TERM_PATTERN.match(token)
+        if not match:
+            raise ValueError(f"Invalid filter '{token}'. Use field=value, e.g. category=Food.")
+
+        field, op, value = match.groups()
+        if field not in QUERY_FIELDS:
+            raise ValueError(f"Unknown field '{field}'. Available: {', '.join(QUERY_FIELDS)}.")
+        if op not in QUERY_FIELDS[field]:
+            raise ValueError(f"Operator '{op}' is not supported for '{field}'.")
+
+        if field == "amount":
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f"Invalid amount '{value}'.")
+        elif field in ("since", "until"):
+            value = parse_period(value, end=(field == "until")).as_unit("ns").value
+        elif field == "name":
+            value = value.lower() if op == "~" else value
+        else:
+            # account=Cash,Bank matches either account
+            value = tuple(value.split(","))
+
+        terms.append((field, op, value))
+
+    return tuple(terms)
+
+
+def compare(column, op, value):
+    """Vectorized comparison of a column array against a scalar"""
+    if op == "=":
+        return column == value
+    if op == "!=":
+        return column != value
+    if op == ">":
+        return column > value
+    if op == "<":
+        return column < value
+    if op == ">=":
+        return column >= value
+    return column <= value
+
+
+def match_codes(ledger, column, wanted):
+    """Match a dictionary-encoded column against a set of values by comparing integer codes"""
+    dictionary = ledger.dictionaries[column]
+    codes = [dictionary.lookup(value) for value in wanted]
+    return np.isin(ledger.codes[column].view, [code for code in codes if code >= 0])
+
+
+def run_query(ledger, terms):
+    """Evaluate compiled terms over the ledger columns and return a boolean mask"""
+    # Deleted entries stay in the buffers until the next checkpoint
+    mask = ledger.live.view.copy()
+
+    for field, op, value in terms:
+        if field == "amount":
+            mask &= compare(ledger.amounts.view, op, value)
+        elif field == "since":
+            mask &= ledger.timestamps.view >= value
+        elif field == "until":
+            # Undated rows from before the Date column existed hold MISSING_TIMESTAMP
+            timestamps = ledger.timestamps.view
+            mask &= (timestamps < value) & (timestamps != MISSING_TIMESTAMP)
+        elif field == "name" and op == "~":
+            # Substring search runs once per distinct name, then fans out through the codes
+            names = ledger.dictionaries["Name"].values
+            hits = np.array([value in name.lower() for name in names], dtype=bool)
+            mask &= hits[ledger.codes["Name"].view]
+        else:
+            wanted = (value,) if field == "name" else value
+            matches = match_codes(ledger, field.capitalize(), wanted)
+            mask &= matches if op == "=" else ~matches
+
+    return mask
+
+
+class QueryCog:
+    def __init__(self, bot, allowed_user_id, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.ledger = ledger
+
+        # Register command handler
+        @bot.message_handler(commands=['query'])
+        def query_command_handler(message):
+            self.query_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def query_command(self, message):
+        """Filter the expense ledger, e.g. /query category=Food amount>20 since=2026-01"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        parts = message.text.split(maxsplit=1)
+        if len(parts) < 2:
+            self.bot.reply_to(
+                message,
+                "Usage: /query field=value ...\n\n"
+                "Fields: name (= != ~), account, category (= !=, comma separated), "
+                "amount (= != > < >= <=), since, until (YYYY, YYYY-MM or YYYY-MM-DD)\n\n"
+                "Example: /query category=Food amount>20 since=2026-01"
+            )
+            return
+
+        try:
+            terms = compile_query(parts[1].strip())
+        except ValueError as e:
+            self.bot.reply_to(message, str(e))
+            return
+
+        with self.ledger.lock:
+            mask = run_query(self.ledger, terms)
+            positions = np.flatnonzero(mask)
+            # Totals are in the base currency; the lines show each entry's own amount and currency
+            total = np.nansum(self.ledger.base_amounts.view[mask])
+            by_category = self.ledger.totals_by("Category", mask)
+            latest = self.ledger.rows(positions[-MAX_RESULT_LINES:])
+            latest_ids = self.ledger.ids.view[positions[-MAX_RESULT_LINES:]]
+            currencies = self.ledger.dictionaries["Currency"].values
+            latest_currencies = [currencies[code] for code in self.ledger.currency_codes(positions[-MAX_RESULT_LINES:])]
+
+        if len(positions) == 0:
+            self.bot.reply_to(message, "No entries match this query.")
+            return
+
+        lines = []
+        for row_id, currency, (name, account, category, amount, date) in zip(latest_ids, latest_currencies, latest):
+            date = date.strftime("%Y-%m-%d") if not pd.isna(date) else "----------"
+            lines.append(f"#{row_id} {date}  {name} · {account} · {category} · {amount:g} {currency}".rstrip())
+
+        summary = f"Found {len(positions)} entries, total {total:g}\n\n"
+        if len(by_category) > 1:
+            summary += "\n".join(f"{category}: {amount:g}" for category, amount in by_category.items()) + "\n\n"
+        summary += "\n".join(lines)
+        if len(positions) > MAX_RESULT_LINES:
+            summary += f"\n\n(showing the latest {MAX_RESULT_LINES})"
+        self.bot.reply_to(message, summary)
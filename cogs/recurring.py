@@ -0,0 +1,315 @@
+import os
+import numpy as np
+import pandas as pd
+from telebot import types
+from storage.ledger import to_timestamp
+from storage.workbook import write_sheets
+
+RECURRING_COLUMNS = ["Name", "Account", "Category", "Amount", "Day", "Next"]
+
+
+def occurrence(year, month, day):
+    """Date of a monthly rule's occurrence, moved to the last day of short months"""
+    first = pd.Timestamp(year=year, month=month, day=1)
+    return first.replace(day=min(day, first.days_in_month))
+
+
+def next_occurrence(day, after):
+    """First occurrence of a day-of-month rule on or after the given date"""
+    after = pd.Timestamp(after).normalize()
+    date = occurrence(after.year, after.month, day)
+    if date < after:
+        following = after + pd.offsets.MonthBegin(1)
+        date = occurrence(following.year, following.month, day)
+    return date
+
+
+class RecurringCog:
+    def __init__(self, bot, allowed_user_id, accounts_cog, categories_cog, ledger):
+        self.bot = bot
+        self.ALLOWED_USER_ID = allowed_user_id
+        self.accounts_cog = accounts_cog
+        self.categories_cog = categories_cog
+        self.ledger = ledger
+        self.data_file = "data.xlsx"
+        self.sheet_name = "Recurring"
+        # The scheduler thread materializes rules while handlers may be editing them. The ledger's lock
+        # is shared rather than a lock of its own, since on_replace is called under it and
+        # materialize_due appends under it: two locks would be taken in opposite orders
+        self.lock = ledger.lock
+        self.rules = self.load_rules()
+        self.recurring_session = {}
+        ledger.add_listener(self)
+
+        # Register command handlers
+        @bot.message_handler(commands=['recurring'])
+        def recurring_command_handler(message):
+            self.list_recurring_command(message)
+
+        @bot.message_handler(commands=['addrecurring'])
+        def add_recurring_handler(message):
+            self.add_recurring_command(message)
+
+        @bot.message_handler(commands=['removerecurring'])
+        def remove_recurring_handler(message):
+            self.remove_recurring_command(message)
+
+    def is_authorized(self, message):
+        return message.from_user.id == self.ALLOWED_USER_ID
+
+    def load_rules(self):
+        """Load recurring entries from the Recurring sheet"""
+        if os.path.exists(self.data_file):
+            try:
+                return self.parse_rules(pd.read_excel(self.data_file, sheet_name=self.sheet_name))
+            except Exception:
+                pass
+        return []
+
+    @staticmethod
+    def parse_rules(df):
+        df["Next"] = pd.to_datetime(df["Next"])
+        return df[RECURRING_COLUMNS].to_dict("records")
+
+    def reload(self):
+        """Read the recurring entries again after another process changed them"""
+        with self.lock:
+            self.rules = self.load_rules()
+
+    def reload_sheets(self, frames):
+        """Apply a Recurring sheet edited outside the bot, returning a note if it changed"""
+        if self.sheet_name not in frames:
+            return []
+        try:
+            rules = self.parse_rules(frames[self.sheet_name])
+        except Exception as e:
+            print(f"Error reading the edited Recurring sheet: {e}")
+            return []
+        with self.lock:
+            added = [rule for rule in rules if rule not in self.rules]
+            removed = [rule for rule in self.rules if rule not in rules]
+            self.rules = rules
+        return [f"recurring entries: {len(added)} added, {len(removed)} removed"] if added or removed else []
+
+    def save_rules(self):
+        """Save recurring entries to the Recurring sheet"""
+        write_sheets(self.data_file, {self.sheet_name: pd.DataFrame(self.rules, columns=RECURRING_COLUMNS)})
+
+    def materialize_due(self, now=None):
+        """Add every occurrence that is due, catching up missed months, with one bulk write to the ledger"""
+        today = pd.Timestamp.now().normalize() if now is None else pd.Timestamp(now).normalize()
+        with self.lock:
+            rows = []
+            advanced = []
+            for rule in self.rules:
+                next_date = rule["Next"]
+                while next_date <= today:
+                    rows.append([rule["Name"], rule["Account"], rule["Category"], float(rule["Amount"]), next_date])
+                    following = next_date + pd.offsets.MonthBegin(1)
+                    next_date = occurrence(following.year, following.month, int(rule["Day"]))
+                if next_date != rule["Next"]:
+                    advanced.append((rule, next_date))
+            if not rows:
+                return 0
+
+            # The entries are made durable before the rules move on, so a crash can't lose an occurrence;
+            # the ones added before a crash that kept the rules from moving on aren't added again
+            existing = self.existing_rows(rows)
+            rows = [row for row in rows if (*row[:4], to_timestamp(row[4])) not in existing]
+            self.ledger.append_many(rows)
+            for rule, next_date in advanced:
+                rule["Next"] = next_date
+            self.save_rules()
+
+        if not rows:
+            return 0
+        lines = [f"• {date.strftime('%Y-%m-%d')} {name} · {account} · {category} · {amount:g}"
+                 for name, account, category, amount, date in rows]
+        self.bot.send_message(self.ALLOWED_USER_ID, f"Added {len(rows)} recurring entries:\n\n" + "\n".join(lines))
+        return len(rows)
+
+    def existing_rows(self, rows):
+        """(name, account, category, amount, timestamp) of the live entries dated on or after the earliest row"""
+        earliest = to_timestamp(min(row[4] for row in rows))
+        with self.ledger.lock:
+            positions = np.flatnonzero(self.ledger.live.view & (self.ledger.timestamps.view >= earliest))
+            return {self.ledger.row(position) for position in positions.tolist()}
+
+    def on_replace(self, column, old_value, new_value):
+        """Keep rules pointing at renamed accounts and categories"""
+        if column not in ("Account", "Category"):
+            return
+        with self.lock:
+            changed = False
+            for rule in self.rules:
+                if rule[column] == old_value:
+                    rule[column] = new_value
+                    changed = True
+            if changed:
+                self.save_rules()
+
+    def list_recurring_command(self, message):
+        """Command to list recurring entries"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if not self.rules:
+            self.bot.reply_to(message, "No recurring entries. Use /addrecurring to add one.")
+            return
+
+        lines = [
+            f"• {rule['Name']} · {rule['Account']} · {rule['Category']} · {rule['Amount']:g} "
+            f"on day {rule['Day']}, next {rule['Next'].strftime('%Y-%m-%d')}"
+            for rule in self.rules
+        ]
+        self.bot.reply_to(message, "Recurring entries:\n\n" + "\n".join(lines))
+
+    def add_recurring_command(self, message):
+        """Start adding a recurring entry by asking for its name"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if self.accounts_cog.is_first_time():
+            self.bot.reply_to(message, "Please complete the initial setup first by using the /start command.")
+            return
+
+        self.recurring_session[message.from_user.id] = {}
+        msg = self.bot.reply_to(message, "Please enter the name of the recurring entry (e.g. Rent):")
+        self.bot.register_next_step_handler(msg, self.process_recurring_name)
+
+    def process_recurring_name(self, message):
+        """Process the name and ask for the account"""
+        if not self.is_authorized(message):
+            return
+
+        user_id = message.from_user.id
+        if user_id not in self.recurring_session:
+            self.bot.reply_to(message, "Session expired. Please try again.")
+            return
+
+        self.recurring_session[user_id]["name"] = message.text
+        self.bot.reply_to(message, "Please select an account:",
+                          reply_markup=self.accounts_cog.account_buttons("recur_acc_"))
+
+    def setup_callback_handlers(self):
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith(('recur_acc_', 'recur_cat_')))
+        def process_recurring_callback(call):
+            self.process_recurring_callback_impl(call)
+
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('recur_del_'))
+        def process_remove_recurring_callback(call):
+            self.process_remove_recurring_callback_impl(call)
+
+    def process_recurring_callback_impl(self, call):
+        """Handle the account and category selection of a recurring entry"""
+        user_id = call.from_user.id
+        if user_id != self.ALLOWED_USER_ID or user_id not in self.recurring_session:
+            return
+
+        self.bot.answer_callback_query(call.id)
+        session = self.recurring_session[user_id]
+
+        if call.data.startswith("recur_acc_"):
+            session["account"] = call.data.replace("recur_acc_", "", 1)
+            self.bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=f"Selected account: {session['account']}"
+            )
+            markup = types.InlineKeyboardMarkup(row_width=2)
+            markup.add(*[
+                types.InlineKeyboardButton(text=category, callback_data=f"recur_cat_{category}")
+                for category in self.categories_cog.get_categories()
+            ])
+            self.bot.send_message(call.message.chat.id, "Please select a category:", reply_markup=markup)
+
+        elif call.data.startswith("recur_cat_"):
+            session["category"] = call.data.replace("recur_cat_", "", 1)
+            self.bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=f"Selected category: {session['category']}"
+            )
+            msg = self.bot.send_message(call.message.chat.id,
+                                        "Please enter the amount and the day of the month (1-31), e.g. '950 1':")
+            self.bot.register_next_step_handler(msg, self.process_recurring_amount)
+
+    def process_recurring_amount(self, message):
+        """Process the amount and day, then save the recurring entry"""
+        if not self.is_authorized(message):
+            return
+
+        user_id = message.from_user.id
+        session = self.recurring_session.get(user_id)
+        if not session or "category" not in session:
+            self.bot.reply_to(message, "Session expired. Please try again.")
+            return
+
+        try:
+            amount, day = message.text.split()
+            amount, day = float(amount), int(day)
+            if not 1 <= day <= 31:
+                raise ValueError
+        except ValueError:
+            msg = self.bot.reply_to(message, "Please enter a number and a day between 1 and 31, e.g. '950 1':")
+            self.bot.register_next_step_handler(msg, self.process_recurring_amount)
+            return
+
+        del self.recurring_session[user_id]
+        rule = {
+            "Name": session["name"],
+            "Account": session["account"],
+            "Category": session["category"],
+            "Amount": amount,
+            "Day": day,
+            "Next": next_occurrence(day, pd.Timestamp.now()),
+        }
+        with self.lock:
+            self.rules.append(rule)
+            self.save_rules()
+
+        self.bot.reply_to(message, f"Recurring entry saved: {rule['Name']} · {rule['Account']} · "
+                                   f"{rule['Category']} · {amount:g} on day {day} of every month.\n"
+                                   f"Next entry: {rule['Next'].strftime('%Y-%m-%d')}")
+        # An entry due today is added right away rather than at the next scheduled run
+        self.materialize_due()
+
+    def remove_recurring_command(self, message):
+        """Command to remove a recurring entry"""
+        if not self.is_authorized(message):
+            self.bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+            return
+
+        if not self.rules:
+            self.bot.reply_to(message, "No recurring entries to remove.")
+            return
+
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(*[
+            types.InlineKeyboardButton(text=f"{rule['Name']} · {rule['Amount']:g} (day {rule['Day']})",
+                                       callback_data=f"recur_del_{index}")
+            for index, rule in enumerate(self.rules)
+        ])
+        self.bot.send_message(message.chat.id, "Select a recurring entry to remove:", reply_markup=markup)
+
+    def process_remove_recurring_callback_impl(self, call):
+        """Remove the selected recurring entry"""
+        if call.from_user.id != self.ALLOWED_USER_ID:
+            return
+
+        index = int(call.data.replace("recur_del_", "", 1))
+        with self.lock:
+            if index >= len(self.rules):
+                self.bot.answer_callback_query(call.id, "This entry no longer exists.")
+                return
+            rule = self.rules.pop(index)
+            self.save_rules()
+
+        self.bot.answer_callback_query(call.id)
+        self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=f"Recurring entry '{rule['Name']}' removed. Entries already added are kept."
+        )
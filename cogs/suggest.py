@@ -0,0 +1,141 @@
+import numpy as np
+
+
+def normalize_name(name):
+    return str(name).strip().casefold()
+
+
+class TrieNode:
+    __slots__ = ("children", "best_name", "best_count")
+
+    def __init__(self):
+        self.children = {}
+        self.best_name = None
+        self.best_count = 0
+
+
+class SuggestionEngine:
+    """Suggests the account and category of an expense from the names entered before
+
+    Counts of (account, category) are kept per normalized name, and a prefix trie
+    remembers at every node the most frequent name below it, so a name that was
+    never entered exactly still gets the pair of its most common completion.
+    An insert fixes each node's best name with a single walk down the trie; an edit
+    or delete takes its count back and recomputes the best names along the name's
+    path from the bottom up. Renames rebuild everything from the ledger. All of it
+    happens under the ledger's lock, so a suggestion never sees a half-built trie.
+    """
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.counts = {}
+        self.totals = {}
+        self.root = TrieNode()
+        ledger.add_listener(self)
+
+    def on_load(self, ledger):
+        self.rebuild()
+
+    def on_append(self, position, name, account, category, amount, timestamp):
+        self.add(name, account, category)
+
+    def on_replace(self, column, old_value, new_value):
+        self.rebuild()
+
+    def on_update(self, position, old_row, new_row):
+        if old_row[:3] != new_row[:3]:
+            with self.ledger.lock:
+                self.remove(*old_row[:3])
+                self.add(*new_row[:3])
+
+    def on_delete(self, position, name, account, category, amount, timestamp):
+        with self.ledger.lock:
+            self.remove(name, account, category)
+
+    def rebuild(self):
+        """Count every distinct (name, account, category) of the ledger in one vectorized pass"""
+        with self.ledger.lock:
+            live = self.ledger.live.view
+            names = self.ledger.codes["Name"].view[live].astype(np.int64)
+            accounts = self.ledger.codes["Account"].view[live].astype(np.int64)
+            categories = self.ledger.codes["Category"].view[live].astype(np.int64)
+            name_values = self.ledger.dictionaries["Name"].values
+            account_values = self.ledger.dictionaries["Account"].values
+            category_values = self.ledger.dictionaries["Category"].values
+
+            self.counts = {}
+            self.totals = {}
+            self.root = TrieNode()
+            if len(names) == 0:
+                return
+
+            # Pack the three codes of a row into one integer so np.unique groups them
+            width_accounts = len(account_values)
+            width_categories = len(category_values)
+            keys = (names * width_accounts + accounts) * width_categories + categories
+            unique_keys, counts = np.unique(keys, return_counts=True)
+            for key, count in zip(unique_keys.tolist(), counts.tolist()):
+                rest, category = divmod(key, width_categories)
+                name, account = divmod(rest, width_accounts)
+                self.add(name_values[name], account_values[account], category_values[category], count)
+
+    def add(self, name, account, category, count=1):
+        key = normalize_name(name)
+        if not key:
+            return
+        pairs = self.counts.setdefault(key, {})
+        pairs[(account, category)] = pairs.get((account, category), 0) + count
+        total = self.totals.get(key, 0) + count
+        self.totals[key] = total
+
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, TrieNode())
+            if total > node.best_count or node.best_name == key:
+                node.best_name, node.best_count = key, total
+
+    def remove(self, name, account, category):
+        """Take back one count of an entry that was edited or deleted"""
+        key = normalize_name(name)
+        pairs = self.counts.get(key)
+        if not pairs or (account, category) not in pairs:
+            return
+        pairs[(account, category)] -= 1
+        if not pairs[(account, category)]:
+            del pairs[(account, category)]
+        self.totals[key] -= 1
+        if not self.totals[key]:
+            del self.totals[key]
+            del self.counts[key]
+
+        path = [self.root]
+        for char in key:
+            path.append(path[-1].children[char])
+        # Each node's best is the name ending there or the best of a child, so fix them deepest first
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            prefix = key[:depth]
+            node.best_name, node.best_count = (prefix, self.totals[prefix]) if prefix in self.totals else (None, 0)
+            for char, child in list(node.children.items()):
+                if child.best_name is None:
+                    del node.children[char]
+                elif child.best_count > node.best_count:
+                    node.best_name, node.best_count = child.best_name, child.best_count
+        if path[1].best_name is None:
+            del self.root.children[key[0]]
+
+    def suggest(self, name):
+        """Most frequent (account, category) for a name or, failing that, for its most common completion"""
+        key = normalize_name(name)
+        with self.ledger.lock:
+            pairs = self.counts.get(key)
+            if pairs is None:
+                node = self.root
+                for char in key:
+                    node = node.children.get(char)
+                    if node is None:
+                        return None
+                if node.best_name is None:
+                    return None
+                pairs = self.counts[node.best_name]
+            return max(pairs.items(), key=lambda item: item[1])[0]
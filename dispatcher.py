@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import deque
+import telebot
+
+
+def update_chat_id(update):
+    """Chat a telebot Update belongs to, or 0 for updates without one"""
+    if update.callback_query is not None:
+        message = update.callback_query.message
+        return message.chat.id if message is not None else update.callback_query.from_user.id
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    return 0
+
+
+class ChatDispatcher:
+    """Runs items on a pool of threads, strictly in order per chat and in parallel across chats
+
+    Each chat has its own queue and at most one thread working on it: a chat with
+    queued items waits in the ready queue until a thread is free, the thread
+    handles one item and puts the chat back if more arrived meanwhile, so a busy
+    chat can't hold a thread while others wait. At most max_pending items are
+    queued in total; submit() blocks beyond that, which stops polling and leaves
+    further updates with Telegram until the bot catches up.
+    """
+
+    def __init__(self, handler, workers=4, max_pending=100):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        # chat -> deque of (time queued, item)
+        self.queues = {}
+        # Chats with queued items and no thread on them; a chat is "scheduled" while ready or running
+        self.ready = deque()
+        self.scheduled = set()
+        self.pending = 0
+        self.stopped = False
+
+        self.processed = 0
+        self.failures = 0
+        self.max_pending_seen = 0
+        self.max_chat_depth = 0
+        self.blocked = 0
+        self.blocked_time = 0.0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+
+        self.threads = [threading.Thread(target=self.run, name=f"chat-worker-{index}", daemon=True)
+                        for index in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, chat_id, item):
+        """Queue an item for its chat, waiting while max_pending items are already queued"""
+        with self.condition:
+            if self.pending >= self.max_pending:
+                self.blocked += 1
+                started = time.perf_counter()
+                while self.pending >= self.max_pending and not self.stopped:
+                    self.condition.wait()
+                self.blocked_time += time.perf_counter() - started
+            if self.stopped:
+                return
+
+            queue = self.queues.setdefault(chat_id, deque())
+            queue.append((time.perf_counter(), item))
+            self.pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self.pending)
+            self.max_chat_depth = max(self.max_chat_depth, len(queue))
+            if chat_id not in self.scheduled:
+                self.scheduled.add(chat_id)
+                self.ready.append(chat_id)
+                self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.ready and not (self.stopped and self.pending == 0):
+                    self.condition.wait()
+                if not self.ready:
+                    return
+                chat_id = self.ready.popleft()
+                queued, item = self.queues[chat_id].popleft()
+
+            started = time.perf_counter()
+            try:
+                self.handler(item)
+                failed = False
+            except Exception as e:
+                failed = True
+                print(f"Error handling an update of chat {chat_id}: {e}")
+            duration = time.perf_counter() - started
+
+            with self.condition:
+                self.pending -= 1
+                self.processed += 1
+                self.failures += failed
+                self.total_wait += started - queued
+                self.max_wait = max(self.max_wait, started - queued)
+                self.total_duration += duration
+                self.max_duration = max(self.max_duration, duration)
+                if self.queues[chat_id]:
+                    self.ready.append(chat_id)
+                else:
+                    del self.queues[chat_id]
+                    self.scheduled.discard(chat_id)
+                self.condition.notify_all()
+
+    def stop(self):
+        """Finish the queued items and stop the threads"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self):
+        with self.condition:
+            processed = max(self.processed, 1)
+            return {
+                "workers": len(self.threads),
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "max_pending_seen": self.max_pending_seen,
+                "active_chats": len(self.scheduled),
+                "max_chat_depth": self.max_chat_depth,
+                "processed": self.processed,
+                "failures": self.failures,
+                "blocked": self.blocked,
+                "blocked_time": self.blocked_time,
+                "mean_wait": self.total_wait / processed,
+                "max_wait": self.max_wait,
+                "mean_duration": self.total_duration / processed,
+                "max_duration": self.max_duration,
+            }
+
+
+class OrderedTeleBot(telebot.TeleBot):
+    """TeleBot whose updates run on a ChatDispatcher instead of pyTelegramBotAPI's thread pool
+
+    Handlers of one chat, including next-step and callback handlers, never run
+    concurrently, so a conversation's session state can't be changed by its own
+    next update halfway through a step.
+    """
+
+    def __init__(self, token, workers=4, max_pending=100, **kwargs):
+        # Handlers run inline on the dispatcher's threads
+        super().__init__(token, threaded=False, **kwargs)
+        self.dispatcher = ChatDispatcher(self.handle_update, workers=workers, max_pending=max_pending)
+        # Called before the handlers of every update, e.g. to pick up changes made to the data outside the bot
+        self.before_update = []
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            self.dispatcher.submit(update_chat_id(update), update)
+
+    def handle_update(self, update):
+        """Run the handlers of one update on the calling thread"""
+        for hook in self.before_update:
+            hook()
+        super().process_new_updates([update])
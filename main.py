@@ -1,9 +1,26 @@
 import os
-import telebot
+import time
+import tracemalloc
 from dotenv import load_dotenv
 from cogs.add import AddCommandCog
+from cogs.backup import BackupCog
 from cogs.categories import CategoriesCog
 from cogs.accounts import AccountsCog
+from cogs.query import QueryCog
+from cogs.export import ExportCog
+from cogs.chart import ChartCog
+from cogs.debugstats import DebugStatsCog
+from cogs.dedupe import DedupeCog
+from cogs.edit import EditCog
+from cogs.forecast import ForecastCog
+from cogs.fsck import FsckCog
+from cogs.recurring import RecurringCog
+from dispatcher import OrderedTeleBot
+from replay import record_updates
+from scheduler import Scheduler
+from watcher import WorkbookWatcher
+from storage.ledger import ExpenseLedger
+from storage.rates import RateTable
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,36 +29,97 @@ load_dotenv()
 TOKEN = os.getenv("TOKEN")
 ALLOWED_USER_ID = int(os.getenv("ALLOWED_USER_ID"))  # Convert to integer
 
-# Initialize the bot
-bot = telebot.TeleBot(TOKEN)
+DATA_FILE = "data.xlsx"
+# Optional: keep expenses in month partition files under this directory instead of data.xlsx
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+# Totals are reported in the base currency; other currencies are converted with the rates in RATES_FILE
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "EUR")
+RATES_FILE = os.getenv("RATES_FILE", "rates.csv")
+# How often (in seconds) account balances are recomputed from scratch to catch drift
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "3600"))
+# How often (in seconds) recurring entries are checked, the write-ahead log is flushed and the archive compacted
+RECURRING_INTERVAL = 900
+CHECKPOINT_INTERVAL = 300
+COMPACT_INTERVAL = 3600
+# How often (in seconds) the rates file is checked for changes
+RATES_INTERVAL = 300
+# How often (in seconds) data.xlsx is checked for changes made outside the bot, besides before every update
+WATCH_INTERVAL = 10
+# How often (in seconds) the usual range of amounts is recomputed from the whole history
+ANOMALY_INTERVAL = 3600
+# Incremental snapshots of data.xlsx, its log, the archive and the rates file
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "86400"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "30"))
+# Optional: append every update received to this log, for replaying with replay.py
+RECORD_UPDATES = os.getenv("RECORD_UPDATES")
+# Worker processes handling updates, sharded by chat; more than one needs the write-ahead log (no ARCHIVE_DIR)
+WORKERS = int(os.getenv("WORKERS", "1"))
+# Threads handling updates (each chat's in order) and how many updates may wait before polling pauses
+UPDATE_THREADS = int(os.getenv("UPDATE_THREADS", "4"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "100"))
+
+# Memory diagnostics for /debugstats: tracemalloc frames to record (0 = off), resident memory in MiB above
+# which caches are dropped (0 = no limit), and how often (in seconds) to print the report (0 = never)
+TRACEMALLOC = int(os.getenv("TRACEMALLOC", "0"))
+MEMORY_SOFT_LIMIT_MB = int(os.getenv("MEMORY_SOFT_LIMIT_MB", "0"))
+DEBUGSTATS_INTERVAL = int(os.getenv("DEBUGSTATS_INTERVAL", "0"))
+
+# Background jobs run on the scheduler's thread, next to bot.polling
+scheduler = Scheduler()
+
+# Created by load_cogs, not on import: processes spawned by the chart renderers and the workers import
+# this module again and must not start a bot of their own
+bot = None
 
 # Help text
 help_text = """
 Welcome to your expense tracker bot!
 
 *Expense Tracking Commands:*
-    /add - Add a new expense entry
+    /add - Add a new expense entry (a negative amount records income)
+    /query - Filter expenses, e.g. /query category=Food amount>20 since=2026-01
+    /export - Download all expenses as an Excel workbook
+    /chart - Chart spending, e.g. /chart pie since=2026-01 or /chart trend
+    /dedupe - Find duplicate entries
+    /edit - Fix a recent entry, or /edit <id>
+    /undo - Remove the latest entry, or /undo <id>
+    /recurring - List recurring entries (rent, subscriptions, ...)
+    /addrecurring - Add an entry repeated every month
+    /removerecurring - Remove a recurring entry
 
 *Account Management:*
     /accounts - List all available accounts
     /addaccount - Add a new account
     /editaccount - Edit/rename an account
     /removeaccount - Remove an account
+    /balances - Show the balance of every account
+    /transfer - Move money between accounts
+    /setopening - Set an account's opening balance
+    /setcurrency - Set the currency of an account
+    /rates - Show the latest exchange rates
 
 *Category Management:*
     /categories - List all available categories
     /addcategory - Add a new category
     /editcategory - Edit/rename a category
     /removecategory - Remove a category
+    /setbudget - Set a monthly budget for a category
+    /budgets - Show this month's budgets
+    /forecast - Project this month's spending per category and account
 
 *General Commands:*
     /start - Start the bot
     /help - Show this help message
+    /jobs - Show background job timings
+    /debugstats - Show memory use per cog and storage buffer
+    /backup - Back up your data now
+    /backups - List backups
+    /fsck - Check your data for inconsistencies (/fsck repair to fix them)
 """
 
 
 # Start command handler
-@bot.message_handler(commands=['start'])
 def start_command(message):
     if message.from_user.id != ALLOWED_USER_ID:
         bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
@@ -56,14 +134,40 @@ def start_command(message):
 
 
 # Help command handler
-@bot.message_handler(commands=['help'])
 def help_command(message):
     if message.from_user.id != ALLOWED_USER_ID:
         return
     bot.reply_to(message, help_text, parse_mode="Markdown")
 
 
-@bot.message_handler(commands=['cancel'])
+# Jobs command handler
+def jobs_command(message):
+    if message.from_user.id != ALLOWED_USER_ID:
+        bot.reply_to(message, "Sorry, you're not authorized to use this bot.")
+        return
+
+    lines = []
+    for job in scheduler.stats():
+        due = max(0, job["next_run"] - time.time())
+        line = (f"• {job['name']} every {job['interval']}s: {job['runs']} runs, "
+                f"last {job['last_duration'] * 1000:.1f} ms, mean {job['mean_duration'] * 1000:.1f} ms, "
+                f"max {job['max_duration'] * 1000:.1f} ms, next in {due:.0f}s")
+        if job["last_error"]:
+            line += f"\n    last error: {job['last_error']}"
+        lines.append(line)
+    reply = "Background jobs:\n\n" + "\n".join(lines) if lines else "No background jobs scheduled."
+
+    stats = bot.dispatcher.stats()
+    reply += (f"\n\nUpdates: {stats['processed']} handled on {stats['workers']} threads, {stats['failures']} failed\n"
+              f"• queued now {stats['pending']} of {stats['max_pending']} (peak {stats['max_pending_seen']}, "
+              f"{stats['active_chats']} chats, deepest chat {stats['max_chat_depth']})\n"
+              f"• wait mean {stats['mean_wait'] * 1000:.1f} ms, max {stats['max_wait'] * 1000:.1f} ms\n"
+              f"• handling mean {stats['mean_duration'] * 1000:.1f} ms, max {stats['max_duration'] * 1000:.1f} ms\n"
+              f"• polling paused {stats['blocked']} times, {stats['blocked_time']:.1f} s in total")
+    bot.reply_to(message, reply)
+
+
+# Cancel command handler
 def cancel_command(message):
     user_id = message.from_user.id
     cancelled = False
@@ -78,6 +182,11 @@ def cancel_command(message):
         del accounts_cog.onboarding_data[user_id]
         cancelled = True
 
+    # Clear any entry being edited in EditCog.
+    if user_id in edit_cog.edit_entry_session:
+        del edit_cog.edit_entry_session[user_id]
+        cancelled = True
+
     # You can repeat this process for any other in-progress command states.
 
     if cancelled:
@@ -86,20 +195,84 @@ def cancel_command(message):
         bot.reply_to(message, "No operation in progress to cancel.")
 
 
+def create_bot():
+    """Create the bot and register the commands handled here"""
+    global bot
+    bot = OrderedTeleBot(TOKEN, workers=UPDATE_THREADS, max_pending=MAX_PENDING_UPDATES)
+    bot.register_message_handler(start_command, commands=['start'])
+    bot.register_message_handler(help_command, commands=['help'])
+    bot.register_message_handler(jobs_command, commands=['jobs'])
+    bot.register_message_handler(cancel_command, commands=['cancel'])
+    return bot
+
+
 # Load cogs
 def load_cogs():
+    if TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC)
+    create_bot()
+    # The expense ledger is shared by every cog and loaded once the account/category lists are known
+    ledger = ExpenseLedger(DATA_FILE, archive_dir=ARCHIVE_DIR, rates=RateTable(RATES_FILE, BASE_CURRENCY))
     # Initialize the accounts cog first (for onboarding)
-    accounts_cog = AccountsCog(bot, ALLOWED_USER_ID)
+    accounts_cog = AccountsCog(bot, ALLOWED_USER_ID, ledger)
     # Initialize the categories cog
-    categories_cog = CategoriesCog(bot, ALLOWED_USER_ID, accounts_cog)
+    categories_cog = CategoriesCog(bot, ALLOWED_USER_ID, accounts_cog, ledger)
     # Initialize the add command cog
-    add_cog = AddCommandCog(bot, ALLOWED_USER_ID, categories_cog, accounts_cog)
+    add_cog = AddCommandCog(bot, ALLOWED_USER_ID, categories_cog, accounts_cog, ledger)
+    # Initialize the query cog
+    query_cog = QueryCog(bot, ALLOWED_USER_ID, ledger)
+    # Initialize the export cog
+    export_cog = ExportCog(bot, ALLOWED_USER_ID, accounts_cog, categories_cog, ledger)
+    # Initialize the chart cog
+    chart_cog = ChartCog(bot, ALLOWED_USER_ID, ledger)
+    # Initialize the forecast cog
+    forecast_cog = ForecastCog(bot, ALLOWED_USER_ID, ledger)
+    # Initialize the duplicate finder cog
+    dedupe_cog = DedupeCog(bot, ALLOWED_USER_ID, ledger)
+    # Initialize the entry editing cog
+    edit_cog = EditCog(bot, ALLOWED_USER_ID, accounts_cog, categories_cog, ledger)
+    # Initialize the recurring entries cog
+    recurring_cog = RecurringCog(bot, ALLOWED_USER_ID, accounts_cog, categories_cog, ledger)
+    # Initialize the backup cog
+    backup_cog = BackupCog(bot, ALLOWED_USER_ID, ledger, BACKUP_DIR, archive_dir=ARCHIVE_DIR,
+                           extra_files=[RATES_FILE], keep=BACKUP_KEEP)
+    # Initialize the integrity checker cog
+    fsck_cog = FsckCog(bot, ALLOWED_USER_ID, ledger)
+    # Initialize the memory diagnostics cog
+    debugstats_cog = DebugStatsCog(
+        bot, ALLOWED_USER_ID, ledger,
+        [accounts_cog, categories_cog, add_cog, query_cog, export_cog, chart_cog, forecast_cog, dedupe_cog,
+         edit_cog, recurring_cog, backup_cog, fsck_cog],
+        soft_limit=MEMORY_SOFT_LIMIT_MB * 1024 * 1024 or None,
+    )
+    # Load expenses, encoding accounts and categories in the order the cogs hold them
+    ledger.load(accounts_cog.get_accounts(), categories_cog.get_categories(), accounts_cog.currencies)
+    # Sheets edited by hand are applied to the cogs and the ledger as they are saved
+    watcher = WorkbookWatcher(ledger, [accounts_cog, categories_cog, recurring_cog])
+    bot.before_update.append(watcher.check)
     # Setup callback handlers after initialization
     accounts_cog.setup_callback_handlers()
     categories_cog.setup_callback_handlers()
     add_cog.setup_callback_handlers()
+    recurring_cog.setup_callback_handlers()
+    edit_cog.setup_callback_handlers()
+
+    # Recurring entries run first, so occurrences missed while the bot was down are added on startup
+    scheduler.every("recurring", RECURRING_INTERVAL, recurring_cog.materialize_due, first_run=time.time())
+    scheduler.every("reconcile", RECONCILE_INTERVAL, accounts_cog.reconcile_balances)
+    scheduler.every("checkpoint", CHECKPOINT_INTERVAL, ledger.flush)
+    scheduler.every("watch", WATCH_INTERVAL, watcher.check)
+    scheduler.every("rates", RATES_INTERVAL, ledger.reload_rates)
+    scheduler.every("anomalies", ANOMALY_INTERVAL, add_cog.anomalies.rebuild)
+    scheduler.every("backup", BACKUP_INTERVAL, backup_cog.run_backup)
+    if DEBUGSTATS_INTERVAL:
+        scheduler.every("debugstats", DEBUGSTATS_INTERVAL, debugstats_cog.dump)
+    elif MEMORY_SOFT_LIMIT_MB:
+        scheduler.every("memory", 60, debugstats_cog.enforce_limits)
+    if ARCHIVE_DIR:
+        scheduler.every("compact", COMPACT_INTERVAL, ledger.rollover)
 
-    return accounts_cog, categories_cog, add_cog
+    return accounts_cog, categories_cog, add_cog, edit_cog
 
 
 # Start the bot
@@ -112,8 +285,28 @@ if __name__ == "__main__":
         print("Error: ALLOWED_USER_ID not found in .env file")
         exit(1)
 
+    if WORKERS > 1:
+        if ARCHIVE_DIR:
+            print("Error: WORKERS > 1 can't be combined with ARCHIVE_DIR")
+            exit(1)
+        # Only polls here; the cogs run in the worker processes
+        from workers import run_sharded
+        if RECORD_UPDATES:
+            record_updates(RECORD_UPDATES)
+        print(f"Bot started successfully with {WORKERS} workers!")
+        run_sharded(TOKEN, WORKERS)
+        exit(0)
+
     # Load all cogs
-    accounts_cog, categories_cog, add_cog = load_cogs()
+    accounts_cog, categories_cog, add_cog, edit_cog = load_cogs()
+    scheduler.start()
+    if RECORD_UPDATES:
+        record_updates(RECORD_UPDATES)
 
     print("Bot started successfully!")
     bot.polling(none_stop=True)
+
+    bot.dispatcher.stop()
+    scheduler.stop()
+    # Fold anything still only in the write-ahead log into the workbook
+    add_cog.ledger.checkpoint()
@@ -0,0 +1,188 @@
+"""Record the updates the bot receives and replay them against a stubbed Telegram API
+
+Recording is switched on with RECORD_UPDATES=<path> and appends every update
+returned by getUpdates to a gzip-compressed JSON lines log, with the time it
+arrived. The log holds the users' messages as sent, so keep it private.
+
+Replaying feeds the log through main.load_cogs exactly as polling would, one
+update at a time, while every Bot API request is answered locally:
+
+    python replay.py updates.jsonl.gz [--speed 0] [--profile]
+
+Replaying changes the data files like the live bot did, so run it in a copy of
+the data directory, e.g. one restored with `python -m storage.backup restore`.
+"""
+import argparse
+import cProfile
+import gzip
+import itertools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from telebot import apihelper
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Lines of each section of the profile report
+PROFILE_LINES = 20
+
+
+def record_updates(path):
+    """Wrap apihelper.get_updates so every update polled is also appended to the log at path"""
+    original = apihelper.get_updates
+    lock = threading.Lock()
+
+    def get_updates(*args, **kwargs):
+        updates = original(*args, **kwargs)
+        if updates:
+            received = time.time()
+            lines = "".join(json.dumps({"t": received, "update": update}, separators=(",", ":")) + "\n"
+                            for update in updates)
+            # One gzip member per batch, so a crash loses at most the batch being written
+            with lock, gzip.open(path, "at", encoding="utf-8") as f:
+                f.write(lines)
+        return updates
+
+    apihelper.get_updates = get_updates
+
+
+def read_log(path):
+    """Return the recorded (time, update) pairs; a torn final batch from a crash is ignored"""
+    records = []
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                records.append((record["t"], record["update"]))
+    except (EOFError, ValueError):
+        print(f"Ignoring incomplete records at the end of {path}")
+    return records
+
+
+def sender_id(update):
+    for key in ("message", "edited_message", "callback_query"):
+        if key in update:
+            return update[key]["from"]["id"]
+    return None
+
+
+class StubResponse:
+    """Just enough of a requests.Response for apihelper to accept"""
+
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, result):
+        self.text = json.dumps({"ok": True, "result": result})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StubTelegram:
+    """Answers every Bot API request locally and counts them per method"""
+
+    def __init__(self):
+        self.calls = {}
+        self.message_ids = itertools.count(1_000_000)
+        self.lock = threading.Lock()
+
+    def __call__(self, method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        params = kwargs.get("params") or {}
+        with self.lock:
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+            message_id = next(self.message_ids)
+        if api_method.startswith(("send", "edit")):
+            return StubResponse({
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": str(params.get("text", "")),
+            })
+        if api_method == "getMe":
+            return StubResponse({"id": 1, "is_bot": True, "first_name": "replay", "username": "replay_bot"})
+        return StubResponse(True)
+
+
+def replay(records, speed=0.0):
+    """Feed the updates to the bot in order, returning the time each one took to handle"""
+    import main
+    from telebot import types
+
+    main.accounts_cog, main.categories_cog, main.add_cog, main.edit_cog = main.load_cogs()
+
+    durations = []
+    started = time.perf_counter()
+    first_time = records[0][0] if records else 0.0
+    for received, update in records:
+        if speed > 0:
+            delay = (received - first_time) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        start = time.perf_counter()
+        # Handlers run on this thread, one update after the other, as in a deterministic run
+        main.bot.handle_update(types.Update.de_json(update))
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def profile_report(profiler):
+    """Cumulative time per function of the cogs and of the storage modules"""
+    stats = pstats.Stats(profiler).stats
+    sections = {"cogs": [], "storage": []}
+    for (file_name, line, function), (_, calls, _, cumulative, _) in stats.items():
+        relative = os.path.relpath(file_name, ROOT) if os.path.isabs(file_name) else file_name
+        section = relative.split(os.sep, 1)[0]
+        if section in sections:
+            sections[section].append((cumulative, calls, f"{relative}:{line}({function})"))
+
+    lines = []
+    for section, entries in sections.items():
+        lines.append(f"\nTime per {'cog method' if section == 'cogs' else 'storage call'} (cumulative):")
+        for cumulative, calls, name in sorted(entries, reverse=True)[:PROFILE_LINES]:
+            lines.append(f"  {cumulative * 1000:10.1f} ms  {calls:8d} calls  {cumulative / calls * 1000:8.3f} ms/call  {name}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded updates against a stubbed Telegram API")
+    parser.add_argument("log", help="log written with RECORD_UPDATES")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="1 replays at the original timing, 2 twice as fast; 0 (default) as fast as possible")
+    parser.add_argument("--profile", action="store_true", help="report time per cog method and storage call")
+    args = parser.parse_args()
+
+    records = read_log(args.log)
+    if not records:
+        print(f"No updates in {args.log}")
+        sys.exit(1)
+
+    # main reads these on import; the recorded user is the one allowed to use the bot
+    os.environ.setdefault("TOKEN", "0:replay")
+    os.environ.setdefault("ALLOWED_USER_ID", str(next(filter(None, map(sender_id, (u for _, u in records))), 0)))
+    stub = StubTelegram()
+    apihelper.CUSTOM_REQUEST_SENDER = stub
+    sys.path.insert(0, ROOT)
+    # Imported before profiling starts, so module imports don't show up as cog time
+    import main  # noqa: F401
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    durations = replay(records, args.speed)
+    if profiler:
+        profiler.disable()
+
+    total = sum(durations)
+    ordered = sorted(durations)
+    print(f"Replayed {len(durations)} updates in {total:.3f} s "
+          f"({len(durations) / total if total else 0:.0f} updates/s)")
+    print(f"Per update: median {ordered[len(ordered) // 2] * 1000:.2f} ms, "
+          f"95th percentile {ordered[int(len(ordered) * 0.95)] * 1000:.2f} ms, max {ordered[-1] * 1000:.2f} ms")
+    print("Bot API calls: " + ", ".join(f"{method} {count}" for method, count in sorted(stub.calls.items())))
+    if profiler:
+        print(profile_report(profiler))
@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class Job:
+    """A function run every interval seconds, with timings of its runs"""
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_error = None
+
+    def run(self):
+        started = time.perf_counter()
+        self.last_run = time.time()
+        try:
+            self.func()
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"Error running scheduled job {self.name}: {e}")
+        duration = time.perf_counter() - started
+        self.runs += 1
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+
+
+class Scheduler:
+    """Runs jobs on one background thread, ordered by a heap of next run times
+
+    The thread sleeps until the earliest job is due, so an idle scheduler costs
+    nothing. A job that fell behind (e.g. the machine was suspended) runs once
+    and is rescheduled from the current time instead of firing for every missed
+    interval; jobs that must catch up on missed periods track them themselves.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def every(self, name, interval, func, first_run=None):
+        """Schedule func every interval seconds, first at first_run (a time.time() value) or one interval from now"""
+        job = Job(name, func, interval)
+        job.next_run = time.time() + interval if first_run is None else first_run
+        with self.condition:
+            # Re-registering a name replaces the job; its stale heap entry is skipped when popped
+            self.jobs[name] = job
+            heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+            self.condition.notify()
+        return job
+
+    def run_pending(self, now=None):
+        """Run every job that is due and return the number of seconds until the next one"""
+        while True:
+            with self.condition:
+                current = time.time() if now is None else now
+                if not self.heap:
+                    return None
+                next_run, _, job = self.heap[0]
+                if self.jobs.get(job.name) is not job:
+                    heapq.heappop(self.heap)
+                    continue
+                if next_run > current:
+                    return next_run - current
+                heapq.heappop(self.heap)
+
+            job.run()
+
+            with self.condition:
+                if self.jobs.get(job.name) is job:
+                    job.next_run = max(next_run + job.interval, time.time() if now is None else now)
+                    heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+
+    def start(self):
+        """Start the scheduler thread next to the bot's polling loop"""
+        self.stopped = False
+        self.thread = threading.Thread(target=self.loop, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def loop(self):
+        while not self.stopped:
+            delay = self.run_pending()
+            with self.condition:
+                if not self.stopped:
+                    self.condition.wait(delay)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self):
+        """Timings of every job, in seconds, sorted by name"""
+        with self.condition:
+            jobs = sorted(self.jobs.values(), key=lambda job: job.name)
+        return [
+            {
+                "name": job.name,
+                "interval": job.interval,
+                "runs": job.runs,
+                "failures": job.failures,
+                "last_run": job.last_run,
+                "next_run": job.next_run,
+                "last_duration": job.last_duration,
+                "mean_duration": job.total_duration / job.runs if job.runs else 0.0,
+                "max_duration": job.max_duration,
+                "last_error": job.last_error,
+            }
+            for job in jobs
+        ]
@@ -0,0 +1,216 @@
+import csv
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from storage.ledger import EXPENSE_COLUMNS, TEXT_COLUMNS, MISSING_ID, MISSING_TIMESTAMP, normalize_expenses
+
+UNDATED_PARTITION = "undated"
+MANIFEST_FILE = "manifest.json"
+CSV_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Manifest key listing the distinct values of each text column the manifest tracks
+MANIFEST_KEYS = {"Account": "accounts", "Category": "categories"}
+
+
+def month_keys(dates):
+    """Partition key of every row of a datetime Series"""
+    return dates.dt.strftime("%Y-%m").fillna(UNDATED_PARTITION)
+
+
+def month_key(date):
+    """Partition key of a single date"""
+    return UNDATED_PARTITION if date is None or pd.isna(date) else pd.Timestamp(date).strftime("%Y-%m")
+
+
+class ExpenseArchive:
+    """The expense ledger split into one file per month, plus a manifest
+
+    Closed months are uncompressed Arrow IPC files that can be memory-mapped and
+    read without parsing or copying, with text columns dictionary-encoded. The
+    current month is an append-only CSV, so an insert appends a single line.
+    manifest.json records each partition's file, row count and the accounts and
+    categories it uses, so a rename only rewrites the partitions holding the name.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self.load_manifest()
+
+    def path(self, month, closed=True):
+        return os.path.join(self.directory, f"expenses-{month}.{'arrow' if closed else 'csv'}")
+
+    def load_manifest(self):
+        """Read manifest.json, rebuilding it from the partition files if it is missing or unreadable"""
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    return json.load(f)["partitions"]
+            except Exception as e:
+                print(f"Error reading archive manifest, rebuilding it: {e}")
+
+        self.manifest = {}
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.startswith("expenses-") and file_name.endswith((".arrow", ".csv")):
+                month, extension = file_name[len("expenses-"):].rsplit(".", 1)
+                closed = extension == "arrow"
+                self.manifest[month] = self.describe(self.read_frame(month, closed), closed)
+        self.save_manifest()
+        return self.manifest
+
+    def save_manifest(self):
+        """Write manifest.json atomically"""
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"partitions": self.manifest}, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def describe(df, closed):
+        """Manifest entry for a partition holding df"""
+        entry = {"closed": closed, "rows": len(df)}
+        for column, key in MANIFEST_KEYS.items():
+            entry[key] = sorted(set(df[column]))
+        return entry
+
+    def months(self):
+        """Return the partitions in chronological order (undated rows first)"""
+        return sorted(self.manifest, key=lambda month: (month != UNDATED_PARTITION, month))
+
+    def is_closed(self, month):
+        return self.manifest[month]["closed"]
+
+    def read(self, month):
+        """Memory-map a closed partition and return it as a pyarrow Table backed by the mapped file"""
+        source = pa.memory_map(self.path(month), "r")
+        return pa.ipc.open_file(source).read_all()
+
+    def read_frame(self, month, closed=None):
+        """Read any partition back as a normalized Expenses frame"""
+        if closed is None:
+            closed = self.is_closed(month)
+        if closed:
+            return normalize_expenses(self.read(month).to_pandas())
+        df = pd.read_csv(self.path(month, closed=False),
+                         dtype={"Name": str, "Account": str, "Category": str, "Currency": str},
+                         keep_default_na=False, na_values={"Amount": [""], "Date": [""]})
+        df["Date"] = pd.to_datetime(df["Date"], format=CSV_DATE_FORMAT, errors="coerce")
+        return normalize_expenses(df)
+
+    def write(self, month, df, closed=True):
+        """Write a normalized Expenses frame as a whole partition, replacing the old file atomically"""
+        df = df[EXPENSE_COLUMNS].copy()
+        path = self.path(month, closed)
+        temp_path = path + ".tmp"
+
+        if closed:
+            df["Date"] = df["Date"].astype("datetime64[ns]")
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            for column in TEXT_COLUMNS:
+                index = table.schema.get_field_index(column)
+                table = table.set_column(index, column, table.column(column).dictionary_encode())
+            with pa.OSFile(temp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            df.to_csv(temp_path, index=False, date_format=CSV_DATE_FORMAT)
+        os.replace(temp_path, path)
+
+        # Closing a month replaces its CSV with the Arrow file
+        other_path = self.path(month, not closed)
+        if os.path.exists(other_path):
+            os.remove(other_path)
+
+        self.manifest[month] = self.describe(df, closed)
+        self.save_manifest()
+
+    def append(self, month, name, account, category, amount, date, row_id, currency=""):
+        """Append one expense to a month's partition"""
+        self.append_many(month, [[name, account, category, amount, date, row_id, currency]])
+
+    def append_many(self, month, rows):
+        """Append [name, account, category, amount, date, id, currency] rows to a month's partition with one write"""
+        if month in self.manifest and self.is_closed(month):
+            # Late entries for a closed month: rewrite that one partition
+            rows = normalize_expenses(pd.DataFrame(rows, columns=EXPENSE_COLUMNS))
+            self.write(month, pd.concat([self.read_frame(month), rows], ignore_index=True))
+            return
+
+        path = self.path(month, closed=False)
+        is_new = not os.path.exists(path)
+        if not is_new:
+            with open(path, newline="") as f:
+                header = next(csv.reader(f), [])
+            if header != EXPENSE_COLUMNS:
+                # Written before a column was added: rewrite it once with the current columns
+                self.write(month, self.read_frame(month, closed=False), closed=False)
+        with open(path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(EXPENSE_COLUMNS)
+            for name, account, category, amount, date, row_id, currency in rows:
+                date_text = "" if date is None or pd.isna(date) else pd.Timestamp(date).strftime(CSV_DATE_FORMAT)
+                writer.writerow([name, account, category, amount, date_text, row_id, currency])
+            f.flush()
+            os.fsync(f.fileno())
+
+        entry = self.manifest.setdefault(month, {"closed": False, "rows": 0, "accounts": [], "categories": []})
+        entry["rows"] += len(rows)
+        for key, index in (("accounts", 1), ("categories", 2)):
+            entry[key] = sorted(set(entry[key]) | {row[index] for row in rows})
+        self.save_manifest()
+
+    def update(self, month, row_id, fields):
+        """Change some columns of one entry, rewriting only the partition that holds it"""
+        df = self.read_frame(month)
+        row = df["ID"].eq(row_id).fillna(False).astype(bool)
+        for column, value in fields.items():
+            df.loc[row, column] = value
+        self.write(month, df, closed=self.is_closed(month))
+
+    def delete(self, month, row_id):
+        """Remove one entry, rewriting only the partition that holds it"""
+        df = self.read_frame(month)
+        row = df["ID"].eq(row_id).fillna(False).astype(bool)
+        self.write(month, df[~row], closed=self.is_closed(month))
+
+    def partitions_with(self, column, value):
+        """Months whose partition may contain value in column; names are not tracked, so every month"""
+        key = MANIFEST_KEYS.get(column)
+        if key is None:
+            return self.months()
+        return [month for month in self.months() if value in self.manifest[month][key]]
+
+    def rename(self, column, old_value, new_value):
+        """Rewrite only the partitions that contain old_value, returning the months touched"""
+        months = self.partitions_with(column, old_value)
+        for month in months:
+            df = self.read_frame(month)
+            df.loc[df[column] == old_value, column] = new_value
+            self.write(month, df, closed=self.is_closed(month))
+        return months
+
+    @staticmethod
+    def decode(table):
+        """Split a partition table into (values, codes) per text column plus amount and timestamp arrays"""
+        columns = {}
+        for column in TEXT_COLUMNS:
+            if column not in table.column_names:
+                # Partitions closed before the column existed hold the empty value everywhere
+                columns[column] = ([""], np.zeros(table.num_rows, dtype=np.int32))
+                continue
+            array = table.column(column).combine_chunks()
+            if not isinstance(array, pa.DictionaryArray):
+                array = array.dictionary_encode()
+            columns[column] = (array.dictionary.to_pylist(), array.indices.to_numpy(zero_copy_only=False))
+        columns["Amount"] = table.column("Amount").to_numpy()
+        dates = table.column("Date").cast(pa.timestamp("ns")).cast(pa.int64()).fill_null(MISSING_TIMESTAMP)
+        columns["Timestamp"] = dates.to_numpy()
+        if "ID" in table.column_names:
+            columns["ID"] = table.column("ID").cast(pa.int64()).fill_null(MISSING_ID).to_numpy()
+        else:
+            columns["ID"] = np.full(table.num_rows, MISSING_ID, dtype=np.int64)
+        return columns
@@ -0,0 +1,247 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
+import numpy as np
+from storage.workbook import WORKBOOK_LOCK, fsync_directory
+
+# Content-defined chunking: a boundary falls where the rolling hash of the last
+# WINDOW bytes has its low bits all zero, giving chunks of about 16 KiB on average
+WINDOW = 64
+CHUNK_MASK = (1 << 14) - 1
+MIN_CHUNK = 4 * 1024
+MAX_CHUNK = 64 * 1024
+
+# Fixed random value per byte, so boundaries depend on content only
+GEAR = np.random.default_rng(0x5EED).integers(0, 2 ** 63, size=256, dtype=np.uint64)
+
+
+def chunk_boundaries(data):
+    """End offsets of the content-defined chunks of data
+
+    The rolling hash is the sum of the gear values of the last WINDOW bytes,
+    computed for every offset at once from a cumulative sum (uint64 wraps
+    around, which the difference undoes). Inserting bytes only moves the
+    boundaries near the insertion, so the chunks around it keep their hashes.
+    """
+    if len(data) == 0:
+        return []
+    gear = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    sums = np.cumsum(gear, dtype=np.uint64)
+    rolling = sums.copy()
+    rolling[WINDOW:] -= sums[:-WINDOW]
+    candidates = (np.flatnonzero((rolling & np.uint64(CHUNK_MASK)) == 0) + 1).tolist()
+
+    boundaries = []
+    start = 0
+    for end in candidates:
+        while end - start > MAX_CHUNK:
+            start += MAX_CHUNK
+            boundaries.append(start)
+        if end - start >= MIN_CHUNK:
+            boundaries.append(end)
+            start = end
+    while len(data) - start > MAX_CHUNK:
+        start += MAX_CHUNK
+        boundaries.append(start)
+    if start < len(data):
+        boundaries.append(len(data))
+    return boundaries
+
+
+class SnapshotStore:
+    """Content-addressed, deduplicated snapshots of the bot's data files in a local directory
+
+    Files are cut into content-defined chunks stored once under objects/, named by
+    their SHA-256 and zlib-compressed; a snapshot is a small JSON file under
+    snapshots/ listing each file's chunk hashes. A backup therefore only writes the
+    chunks that changed since any earlier snapshot: unchanged sheets of the
+    workbook, closed archive partitions and the appended part of the write-ahead
+    log are stored once. Snapshots are written after their chunks, each with a
+    rename, so an interrupted backup never leaves a snapshot with missing chunks.
+    Backups from every thread and process (bot workers, the command line) take
+    turns on a file lock, so a prune never drops a chunk another backup reuses.
+    """
+
+    def __init__(self, directory, keep=30):
+        self.directory = directory
+        self.keep = keep
+        self.objects_dir = os.path.join(directory, "objects")
+        self.snapshots_dir = os.path.join(directory, "snapshots")
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def snapshots(self):
+        """Snapshot IDs, oldest first"""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.snapshots_dir) if name.endswith(".json"))
+
+    def read_snapshot(self, snapshot_id):
+        with open(os.path.join(self.snapshots_dir, f"{snapshot_id}.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    @contextmanager
+    def locked(self):
+        """Hold an exclusive flock on <directory>/lock"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "lock"), "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def create(self, contents):
+        """Store a snapshot of {relative path: bytes}, returning (snapshot ID, stats) or (None, stats) if unchanged"""
+        with self.locked():
+            return self.create_locked(contents)
+
+    def create_locked(self, contents):
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        stats = {"files": len(contents), "bytes": 0, "chunks": 0, "new_chunks": 0, "new_bytes": 0}
+        files = {}
+        for path, data in sorted(contents.items()):
+            digests = []
+            start = 0
+            for end in chunk_boundaries(data):
+                chunk = data[start:end]
+                digest = hashlib.sha256(chunk).hexdigest()
+                digests.append(digest)
+                stats["chunks"] += 1
+                if self.write_object(digest, chunk):
+                    stats["new_chunks"] += 1
+                    stats["new_bytes"] += len(chunk)
+                start = end
+            files[path] = {"size": len(data), "chunks": digests}
+            stats["bytes"] += len(data)
+
+        previous = self.snapshots()
+        if previous and self.read_snapshot(previous[-1])["files"] == files:
+            return None, stats
+
+        snapshot_id = base_id = time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while snapshot_id in previous:
+            suffix += 1
+            snapshot_id = f"{base_id}-{suffix}"
+        path = os.path.join(self.snapshots_dir, f"{snapshot_id}.json")
+        write_atomic(path, json.dumps({"id": snapshot_id, "created": time.time(), "files": files}).encode())
+        self.prune()
+        return snapshot_id, stats
+
+    def write_object(self, digest, chunk):
+        """Store a chunk unless it is already there, returning whether it was new"""
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, zlib.compress(chunk), sync_directory=False)
+        return True
+
+    def read_object(self, digest):
+        with open(self.object_path(digest), "rb") as f:
+            chunk = zlib.decompress(f.read())
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"Backup chunk {digest} is corrupted")
+        return chunk
+
+    def restore(self, snapshot_id, target_dir):
+        """Write every file of a snapshot under target_dir, returning the paths written"""
+        snapshot = self.read_snapshot(snapshot_id)
+        written = []
+        for path, entry in snapshot["files"].items():
+            # Absolute paths (an ARCHIVE_DIR outside the working directory) land inside target_dir too
+            target = os.path.join(target_dir, os.path.relpath(path, "/") if os.path.isabs(path) else path)
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            data = b"".join(self.read_object(digest) for digest in entry["chunks"])
+            if len(data) != entry["size"]:
+                raise ValueError(f"{path} in snapshot {snapshot_id} has the wrong size")
+            write_atomic(target, data)
+            written.append(target)
+        return written
+
+    def prune(self):
+        """Drop the oldest snapshots beyond keep, then every chunk no remaining snapshot uses; see locked()"""
+        snapshot_ids = self.snapshots()
+        if len(snapshot_ids) <= self.keep:
+            return 0
+        for snapshot_id in snapshot_ids[:-self.keep]:
+            os.remove(os.path.join(self.snapshots_dir, f"{snapshot_id}.json"))
+
+        used = set()
+        for snapshot_id in snapshot_ids[-self.keep:]:
+            for entry in self.read_snapshot(snapshot_id)["files"].values():
+                used.update(entry["chunks"])
+        removed = 0
+        for prefix in os.listdir(self.objects_dir):
+            for digest in os.listdir(os.path.join(self.objects_dir, prefix)):
+                if digest not in used:
+                    os.remove(os.path.join(self.objects_dir, prefix, digest))
+                    removed += 1
+        return removed
+
+
+def write_atomic(path, data, sync_directory=True):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    if sync_directory:
+        fsync_directory(path)
+
+
+def data_files(data_file, archive_dir=None, extra_files=()):
+    """Relative paths of the files that make up the bot's data"""
+    paths = [data_file, data_file + ".wal", *extra_files]
+    if archive_dir and os.path.isdir(archive_dir):
+        paths += [os.path.join(archive_dir, name) for name in sorted(os.listdir(archive_dir))
+                  if not name.endswith(".tmp")]
+    return [path for path in paths if os.path.isfile(path)]
+
+
+def read_files(paths, ledger=None):
+    """Read the files while no workbook rewrite or ledger write is in progress"""
+    contents = {}
+    # Same order as a checkpoint takes them: the ledger's lock, then the workbook's
+    with ledger.lock if ledger is not None else nullcontext(), WORKBOOK_LOCK:
+        for path in paths:
+            with open(path, "rb") as f:
+                contents[path] = f.read()
+    return contents
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List, create or restore backups of the bot's data")
+    parser.add_argument("--dir", default=os.getenv("BACKUP_DIR", "backups"), help="backup directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list snapshots")
+    create_parser = commands.add_parser("create", help="back up data.xlsx, its log, the archive and the rates file")
+    create_parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR"))
+    restore_parser = commands.add_parser("restore", help="write a snapshot's files into a directory")
+    restore_parser.add_argument("snapshot", help="snapshot ID, or 'latest'")
+    restore_parser.add_argument("target", nargs="?", default="restored", help="directory to restore into")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.dir)
+    if args.command == "list":
+        for snapshot_id in store.snapshots():
+            files = store.read_snapshot(snapshot_id)["files"]
+            print(f"{snapshot_id}  {len(files)} files, {sum(entry['size'] for entry in files.values())} bytes")
+    elif args.command == "create":
+        paths = data_files("data.xlsx", args.archive_dir, [os.getenv("RATES_FILE", "rates.csv")])
+        snapshot_id, stats = store.create(read_files(paths))
+        print(f"{snapshot_id or 'No changes since the last snapshot'}: {stats['new_chunks']} of "
+              f"{stats['chunks']} chunks new ({stats['new_bytes']} of {stats['bytes']} bytes)")
+    else:
+        snapshot_ids = store.snapshots()
+        snapshot_id = snapshot_ids[-1] if args.snapshot == "latest" and snapshot_ids else args.snapshot
+        for path in store.restore(snapshot_id, args.target):
+            print(f"Restored {path}")
@@ -0,0 +1,882 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from storage.wal import WriteAheadLog
+from storage.workbook import WORKBOOK_LOCK, write_sheets
+
+EXPENSE_COLUMNS = ["Name", "Account", "Category", "Amount", "Date", "ID", "Currency"]
+TEXT_COLUMNS = ["Name", "Account", "Category", "Currency"]
+# Columns an entry can be edited in after it was saved
+EDITABLE_COLUMNS = ["Name", "Account", "Category", "Amount", "Currency"]
+
+# Row ID of rows saved before entries had IDs, until load assigns them one
+MISSING_ID = -1
+
+# Timestamps are stored as int64 nanoseconds; this is numpy's NaT bit pattern
+MISSING_TIMESTAMP = np.iinfo(np.int64).min
+
+
+def normalize_expenses(df):
+    """Return a copy of an Expenses frame with every column present and typed"""
+    df = df.copy()
+    for column in EXPENSE_COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+
+    for column in TEXT_COLUMNS:
+        df[column] = df[column].fillna("").astype(str)
+    df["Amount"] = pd.to_numeric(df["Amount"], errors="coerce").astype("float64")
+    df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
+    df["ID"] = pd.to_numeric(df["ID"], errors="coerce").astype("Int64")
+
+    return df[EXPENSE_COLUMNS].reset_index(drop=True)
+
+
+def sheet_fingerprint(df):
+    """Hash of every row of an Expenses frame, indexed by ID, to tell which rows an outside edit changed"""
+    df = normalize_expenses(df)
+    df = df[df["ID"].notna()].astype({"Date": "datetime64[ns]"})
+    hashes = pd.util.hash_pandas_object(df.drop(columns="ID"), index=False)
+    return pd.Series(hashes.to_numpy(), index=df["ID"].astype(np.int64).to_numpy())
+
+
+def to_timestamp(date):
+    """Convert a date-like value to int64 nanoseconds, MISSING_TIMESTAMP if it is empty"""
+    date = pd.Timestamp(date) if date is not None else pd.NaT
+    return MISSING_TIMESTAMP if pd.isna(date) else date.as_unit("ns").value
+
+
+class Dictionary:
+    """Distinct values of a text column; rows store the integer code of their value"""
+
+    def __init__(self, dtype, values=()):
+        self.dtype = dtype
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.encode(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return value in self.codes
+
+    def encode(self, value):
+        """Return the code for value, adding it to the dictionary if it is new"""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            if code > np.iinfo(self.dtype).max:
+                raise ValueError(f"Too many distinct values for a {np.dtype(self.dtype).name} column")
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    def encode_many(self, values):
+        """Encode a whole column at once, hashing each distinct value only once"""
+        local_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        return self.encode_codes(uniques, local_codes)
+
+    def encode_codes(self, uniques, local_codes):
+        """Translate codes into another dictionary (e.g. an Arrow partition's) into this one"""
+        lookup = np.array([self.encode(value) for value in uniques], dtype=self.dtype)
+        return lookup[local_codes] if len(local_codes) else np.empty(0, dtype=self.dtype)
+
+    def lookup(self, value):
+        """Return the code for value, or -1 if it never appears"""
+        return self.codes.get(value, -1)
+
+    def rename(self, old_value, new_value):
+        """Rename a value in place; every row holding its code follows without being touched"""
+        code = self.codes.pop(old_value)
+        self.values[code] = new_value
+        self.codes[new_value] = code
+
+
+class ColumnBuffer:
+    """Append-only typed array that doubles its capacity when full"""
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, extra):
+        needed = self.size + extra
+        if needed > len(self.data):
+            capacity = max(needed, 2 * len(self.data))
+            data = np.empty(capacity, dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, value):
+        self.reserve(1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        self.reserve(len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    @property
+    def view(self):
+        """The filled part of the buffer, without copying"""
+        return self.data[:self.size]
+
+
+class ExpenseLedger:
+    """In-memory column store of the Expenses sheet, loaded once and kept up to date by the cogs
+
+    Amounts are float64, dates int64 nanoseconds and the text columns small integer
+    codes into per-column dictionaries. The account and category dictionaries are
+    seeded from AccountsCog.accounts and CategoriesCog.categories, so their codes
+    follow the order of those lists.
+
+    The ledger is the only writer of expenses. By default every mutation is
+    recorded in a write-ahead log next to the workbook and the Expenses sheet is
+    rewritten atomically every checkpoint_every mutations; the hidden Log sheet
+    holds the sequence number of the last record it contains. With an archive
+    directory expenses live in month partitions instead (see storage.archive).
+
+    An entry's Currency is empty when it is in its account's currency, and
+    accounts without a currency use the base one. With a RateTable every amount
+    is also kept converted to the base currency in base_amounts, which is what
+    totals and reports add up; conversion runs over whole columns at once, and
+    only the rows of currencies whose rates changed are converted again. A rate
+    change doesn't bump version: caches check rates_stamp() of their rows instead.
+
+    Every entry has a stable integer ID, saved in the ID column, and positions
+    maps it to the entry's row in the buffers. Edits change that row in place and
+    deletions only clear its live flag, so positions never shift while the bot
+    runs; deleted rows are left out of checkpoints and partitions.
+
+    Cogs that keep derived state register as listeners and implement any of
+    on_load(ledger), on_append(position, name, account, category, amount, timestamp),
+    on_update(position, old_row, new_row), on_delete(position, name, account, category,
+    amount, timestamp), on_replace(column, old_value, new_value) and
+    on_rates(positions, old_base_amounts); they are called under the ledger lock.
+    Rows passed to on_update are (name, account, category, amount, timestamp)
+    tuples with the amount in the entry's own currency.
+
+    After share(), several processes can use the same workbook and log: every
+    mutation takes the workbook's file lock and first applies the records other
+    processes appended to the log, and a checkpoint by another process (which
+    empties the log) makes the next sync reload from the workbook.
+    """
+
+    def __init__(self, data_file="data.xlsx", sheet_name="Expenses", archive_dir=None, checkpoint_every=20,
+                 rates=None):
+        self.data_file = data_file
+        self.sheet_name = sheet_name
+        self.lock = threading.RLock()
+        self.version = 0
+        # Currency -> how many rate reloads changed it, see rates_stamp()
+        self.rate_versions = {}
+        self.archive = None
+        self.wal = None
+        self.hot_month = None
+        self.checkpoint_every = checkpoint_every
+        self.listeners = []
+        self.rates = rates
+        self.shared = False
+        # Sheet -> function making a DataFrame of rows added with append_row(), see track_sheet()
+        self.row_frames = {}
+        # Workbook generation this process last caught up with, when shared
+        self.generation = 0
+        if archive_dir:
+            from storage.archive import ExpenseArchive
+            self.archive = ExpenseArchive(archive_dir)
+        else:
+            self.wal = WriteAheadLog(data_file + ".wal")
+        self.reset()
+
+    def reset(self):
+        """Empty the column buffers"""
+        self.loaded = False
+        # Account code -> currency code, for accounts that aren't in the base currency
+        self.account_currencies = {}
+        self.dictionaries = {
+            "Name": Dictionary(np.int32),
+            "Account": Dictionary(np.int16),
+            "Category": Dictionary(np.int16),
+            # Code 0 is the empty currency: the account's own
+            "Currency": Dictionary(np.int16, [""]),
+        }
+        self.codes = {column: ColumnBuffer(d.dtype) for column, d in self.dictionaries.items()}
+        self.amounts = ColumnBuffer(np.float64)
+        self.base_amounts = ColumnBuffer(np.float64)
+        self.timestamps = ColumnBuffer(np.int64)
+        self.ids = ColumnBuffer(np.int64)
+        self.live = ColumnBuffer(np.bool_)
+        self.positions = {}
+        self.next_id = 0
+        # Row hashes of the Expenses sheet as the ledger last read or wrote it, see merge_sheet()
+        self.sheet_rows = sheet_fingerprint(pd.DataFrame(columns=EXPENSE_COLUMNS))
+        # Sheet -> {column: value} rows added with append_row() since the last checkpoint
+        self.logged_rows = {}
+
+    def load(self, accounts=(), categories=(), currencies=None):
+        """Read the Expenses sheet from the Excel file into the column buffers"""
+        with self.lock:
+            for account in accounts:
+                self.dictionaries["Account"].encode(account)
+            for category in categories:
+                self.dictionaries["Category"].encode(category)
+            for account, currency in (currencies or {}).items():
+                self.account_currencies[self.dictionaries["Account"].encode(account)] = \
+                    self.dictionaries["Currency"].encode(currency)
+
+            # Where each source's rows landed, to save IDs given to rows that had none
+            segments = []
+            if self.archive:
+                for month in self.archive.months():
+                    start = len(self)
+                    if self.archive.is_closed(month):
+                        self.extend_decoded(self.archive.decode(self.archive.read(month)))
+                    else:
+                        self.extend(self.archive.read_frame(month))
+                    segments.append((month, start, len(self)))
+
+            sheet_df = self.read_sheet()
+            if sheet_df is not None:
+                start = len(self)
+                self.extend(sheet_df)
+                segments.append((None, start, len(self)))
+
+            assigned = self.assign_missing_ids()
+            if assigned and sheet_df is not None:
+                sheet_df["ID"] = self.ids.view[segments[-1][1]:segments[-1][2]]
+            if sheet_df is not None and not self.archive:
+                self.sheet_rows = sheet_fingerprint(sheet_df)
+
+            if self.archive:
+                # Partitions written before entries had IDs are rewritten once with the new IDs
+                for month, start, end in segments:
+                    if assigned and month is not None:
+                        df = self.archive.read_frame(month)
+                        if df["ID"].isna().any():
+                            df["ID"] = self.ids.view[start:end]
+                            self.archive.write(month, df, closed=self.archive.is_closed(month))
+                self.compact(sheet_df)
+            else:
+                self.recover(force_checkpoint=assigned > 0)
+
+            self.loaded = True
+            self.notify("on_load", self)
+
+    def share(self):
+        """Let other processes write the same workbook and log, see sync()"""
+        if self.archive:
+            raise ValueError("Sharing the ledger between processes needs the write-ahead log, not ARCHIVE_DIR")
+        with self.lock, WORKBOOK_LOCK:
+            self.shared = True
+            self.generation = WORKBOOK_LOCK.generation()
+
+    def sync(self):
+        """Catch up with the changes other processes made since this one last looked"""
+        if not self.shared:
+            return
+        with self.lock, WORKBOOK_LOCK:
+            self.generation, changed = WORKBOOK_LOCK.changed_since(self.generation)
+            if changed or self.wal.size() < self.wal.offset:
+                self.reload()
+            else:
+                # Applied one by one, so listeners see them as if they were made here
+                self.apply_records(self.wal.tail(), batched=False)
+
+    def reload(self):
+        """Read everything again, keeping the order of the account and category codes"""
+        with self.lock:
+            accounts = list(self.dictionaries["Account"].values)
+            categories = list(self.dictionaries["Category"].values)
+            currencies = {
+                accounts[account_code]: self.dictionaries["Currency"].values[currency_code]
+                for account_code, currency_code in self.account_currencies.items()
+            }
+            self.reset()
+            self.load(accounts, categories, currencies)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def track_sheet(self, sheet_name, to_frame):
+        """Let append_row() add rows to another sheet; to_frame turns a list of logged rows into a DataFrame"""
+        self.row_frames[sheet_name] = to_frame
+
+    def notify(self, event, *args):
+        """Call event on every listener that implements it, once the ledger is loaded"""
+        if not self.loaded:
+            return
+        for listener in self.listeners:
+            handler = getattr(listener, event, None)
+            if handler is not None:
+                handler(*args)
+
+    def assign_missing_ids(self):
+        """Give rows saved before entries had IDs new ones above every existing ID, returning how many"""
+        ids = self.ids.view
+        missing = ids == MISSING_ID
+        self.next_id = max(self.next_id, int(ids.max()) + 1 if len(ids) else 0)
+        count = int(missing.sum())
+        if count:
+            ids[missing] = np.arange(self.next_id, self.next_id + count)
+            self.next_id += count
+            positions = np.flatnonzero(missing)
+            self.positions.update(zip(ids[positions].tolist(), positions.tolist()))
+        return count
+
+    def recover(self, force_checkpoint=False):
+        """Replay log records newer than the last checkpoint, batching consecutive inserts"""
+        checkpoint_seq, next_id = self.read_log()
+        self.wal.seq = checkpoint_seq
+        # IDs of deleted entries are never handed out again, even once the checkpoint dropped them
+        self.next_id = max(self.next_id, next_id)
+        records = [record for record in self.wal.read() if record["seq"] > checkpoint_seq]
+        if not records:
+            if force_checkpoint:
+                self.checkpoint()
+            elif not self.shared:
+                self.wal.truncate()
+            return
+
+        self.apply_records(records)
+        self.assign_missing_ids()
+
+        print(f"Recovered {len(records)} logged changes to the expense ledger")
+        self.checkpoint()
+
+    def apply_records(self, records, batched=True):
+        """Apply log records in order; batched, consecutive inserts become one bulk extend"""
+        batch = []
+        for record in records:
+            # Rows logged before the ID and Currency columns existed are shorter
+            if record["op"] in ("append", "extend"):
+                rows = [record["row"]] if record["op"] == "append" else record["rows"]
+                rows = [row + [None] * (len(EXPENSE_COLUMNS) - len(row)) for row in rows]
+                if batched:
+                    batch.extend(rows)
+                else:
+                    for row in rows:
+                        self.apply_append(*row)
+                continue
+            if batch:
+                self.extend(normalize_expenses(pd.DataFrame(batch, columns=EXPENSE_COLUMNS)))
+                batch = []
+            if record["op"] == "replace":
+                self.apply_replace(record["column"], record["old"], record["new"])
+            elif record["op"] == "update":
+                self.apply_update(record["id"], record["fields"])
+            elif record["op"] == "delete":
+                self.apply_delete(record["id"])
+            elif record["op"] == "row":
+                self.apply_row(record["sheet"], record["row"])
+        if batch:
+            self.extend(normalize_expenses(pd.DataFrame(batch, columns=EXPENSE_COLUMNS)))
+
+    def read_log(self):
+        """Sequence number of the last log record included in the workbook and the next free entry ID"""
+        if not os.path.exists(self.data_file):
+            return 0, 0
+        try:
+            log = pd.read_excel(self.data_file, sheet_name="Log")
+        except Exception:
+            return 0, 0
+        next_id = int(log["Next ID"].iloc[0]) if "Next ID" in log.columns else 0
+        return int(log["Checkpoint"].iloc[0]), next_id
+
+    def checkpoint(self):
+        """Atomically rewrite the Expenses sheet from memory and empty the write-ahead log"""
+        if self.wal is None:
+            return
+        with self.lock, WORKBOOK_LOCK:
+            self.sync()
+            sheets = {
+                self.sheet_name: self.frame,
+                "Log": pd.DataFrame({"Checkpoint": [self.wal.seq], "Next ID": [self.next_id]}),
+                **self.logged_sheets(self.logged_rows),
+            }
+            write_sheets(self.data_file, sheets)
+            self.sheet_rows = sheet_fingerprint(sheets[self.sheet_name])
+            self.logged_rows = {}
+            self.wal.truncate()
+
+    def logged_sheets(self, rows):
+        """Each sheet of rows ({sheet: [row, ...]}) as saved in the workbook with those rows added"""
+        sheets = {}
+        for sheet_name, sheet_rows in rows.items():
+            added = self.row_frames.get(sheet_name, pd.DataFrame)(sheet_rows)
+            try:
+                saved = pd.read_excel(self.data_file, sheet_name=sheet_name)
+            except Exception:
+                saved = None
+            sheets[sheet_name] = added if saved is None or saved.empty else \
+                pd.concat([saved, added], ignore_index=True)
+        return sheets
+
+    def maybe_checkpoint(self):
+        if self.wal is not None and self.wal.pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def flush(self):
+        """Checkpoint if the write-ahead log holds anything, so a quiet bot doesn't leave changes only in the log"""
+        if self.wal is not None and self.wal.pending > 0:
+            self.checkpoint()
+
+    def rollover(self):
+        """Compact the archive if the month changed since the last compaction, returning whether it did"""
+        with self.lock:
+            if self.archive and pd.Timestamp.now().strftime("%Y-%m") != self.hot_month:
+                self.compact()
+                return True
+            return False
+
+    def read_sheet(self):
+        """Read the Expenses sheet, or None if the file or sheet is missing"""
+        if not os.path.exists(self.data_file):
+            return None
+        try:
+            df = pd.read_excel(self.data_file, sheet_name=self.sheet_name)
+            return normalize_expenses(df)
+        except Exception as e:
+            print(f"Error loading expenses from Excel: {e}")
+            return None
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def compact(self, sheet_df=None):
+        """Move rows left in the Expenses sheet into partitions and close the partitions of past months"""
+        from storage.archive import month_keys
+
+        with self.lock:
+            if sheet_df is None:
+                sheet_df = self.read_sheet()
+            self.hot_month = pd.Timestamp.now().strftime("%Y-%m")
+
+            moved = 0
+            if sheet_df is not None and not sheet_df.empty:
+                keys = month_keys(sheet_df["Date"])
+                for month, rows in sheet_df.groupby(keys, sort=True):
+                    if month in self.archive.manifest:
+                        rows = pd.concat([self.archive.read_frame(month), rows], ignore_index=True)
+                    self.archive.write(month, rows, closed=(month != self.hot_month))
+                moved = len(sheet_df)
+
+                # Leave an empty sheet behind so the workbook keeps its layout
+                write_sheets(self.data_file, {self.sheet_name: sheet_df.head(0)})
+
+            for month in self.archive.months():
+                if month != self.hot_month and not self.archive.is_closed(month):
+                    self.archive.write(month, self.archive.read_frame(month), closed=True)
+            return moved
+
+    def extend(self, df):
+        """Bulk-append a normalized Expenses frame"""
+        with self.lock:
+            for column, dictionary in self.dictionaries.items():
+                self.codes[column].extend(dictionary.encode_many(df[column].to_numpy()))
+            self.amounts.extend(df["Amount"].to_numpy(dtype=np.float64))
+            dates = df["Date"].to_numpy(dtype="datetime64[ns]")
+            self.timestamps.extend(dates.view(np.int64))
+            self.extend_ids(df["ID"].fillna(MISSING_ID).to_numpy(dtype=np.int64))
+            self.base_amounts.extend(self.convert(np.arange(len(self.base_amounts), len(self))))
+            self.version += 1
+
+    def extend_decoded(self, columns):
+        """Bulk-append columns that are already dictionary-encoded, as read from an archive partition"""
+        with self.lock:
+            for column, dictionary in self.dictionaries.items():
+                values, codes = columns[column]
+                self.codes[column].extend(dictionary.encode_codes(values, codes))
+            self.amounts.extend(columns["Amount"])
+            self.timestamps.extend(columns["Timestamp"])
+            self.extend_ids(columns["ID"])
+            self.base_amounts.extend(self.convert(np.arange(len(self.base_amounts), len(self))))
+            self.version += 1
+
+    def extend_ids(self, ids):
+        start = len(self.ids)
+        self.ids.extend(ids)
+        self.live.extend(np.ones(len(ids), dtype=np.bool_))
+        # Rows without an ID get one from assign_missing_ids, which adds them then
+        known = np.flatnonzero(ids != MISSING_ID)
+        self.positions.update(zip(ids[known].tolist(), (known + start).tolist()))
+        if len(ids):
+            self.next_id = max(self.next_id, int(ids.max()) + 1)
+
+    def append(self, name, account, category, amount, date, currency=""):
+        """Durably record a new expense and add it to the columns, returning its ID"""
+        with self.lock, WORKBOOK_LOCK:
+            self.sync()
+            row_id = self.next_id
+            if self.archive:
+                from storage.archive import month_key
+
+                # The first entry of a new month closes the previous one
+                self.rollover()
+                self.archive.append(month_key(date), name, account, category, amount, date, row_id, currency)
+            else:
+                self.wal.append("append", row=[name, account, category, amount, date, row_id, currency])
+
+            self.apply_append(name, account, category, amount, date, row_id, currency)
+            self.maybe_checkpoint()
+            return row_id
+
+    def append_many(self, rows):
+        """Durably record several [name, account, category, amount, date(, currency)] expenses with one write per file"""
+        if not rows:
+            return
+        with self.lock, WORKBOOK_LOCK:
+            self.sync()
+            rows = [list(row[:5]) + [self.next_id + offset, row[5] if len(row) > 5 else ""]
+                    for offset, row in enumerate(rows)]
+            if self.archive:
+                from storage.archive import month_key
+
+                self.rollover()
+                by_month = {}
+                for row in rows:
+                    by_month.setdefault(month_key(row[4]), []).append(row)
+                for month, month_rows in by_month.items():
+                    self.archive.append_many(month, month_rows)
+            else:
+                self.wal.append("extend", rows=rows)
+
+            for row in rows:
+                self.apply_append(*row)
+            self.maybe_checkpoint()
+
+    def append_row(self, sheet_name, row):
+        """Durably add a {column: value} row to another sheet, as a log record written out at the next checkpoint"""
+        with self.lock, WORKBOOK_LOCK:
+            self.sync()
+            if self.archive:
+                # Without a log the sheet is rewritten right away
+                write_sheets(self.data_file, self.logged_sheets({sheet_name: [row]}))
+            else:
+                self.wal.append("row", sheet=sheet_name, row=row)
+            self.apply_row(sheet_name, row)
+            self.maybe_checkpoint()
+
+    def apply_row(self, sheet_name, row):
+        with self.lock:
+            if self.wal is not None:
+                self.logged_rows.setdefault(sheet_name, []).append(row)
+            self.notify("on_row", sheet_name, row)
+
+    def apply_append(self, name, account, category, amount, date, row_id, currency=""):
+        with self.lock:
+            for column, value in (("Name", name), ("Account", account), ("Category", category),
+                                  ("Currency", currency)):
+                self.codes[column].append(self.dictionaries[column].encode(value))
+            self.amounts.append(amount)
+            timestamp = to_timestamp(date)
+            self.timestamps.append(timestamp)
+            self.ids.append(row_id)
+            self.live.append(True)
+            self.positions[row_id] = len(self) - 1
+            self.next_id = max(self.next_id, row_id + 1)
+            self.base_amounts.extend(self.convert(np.array([len(self) - 1])))
+            self.version += 1
+            self.notify("on_append", len(self) - 1, name, account, category, amount, timestamp)
+
+    def update(self, row_id, fields):
+        """Durably change some EDITABLE_COLUMNS of one entry, as a single log record or partition rewrite"""
+        with self.lock, WORKBOOK_LOCK:
+            self.sync()
+            date = self.row_date(row_id)
+            # Recorded before the columns change, like append, so memory is never ahead of the files
+            if self.archive:
+                from storage.archive import month_key
+
+                self.archive.update(month_key(date), row_id, fields)
+            else:
+                self.wal.append("update", id=row_id, fields=fields)
+            old_row = self.apply_update(row_id, fields)
+            if not self.archive:
+                self.maybe_checkpoint()
+            return old_row
+
+    def delete(self, row_id):
+        """Durably remove one entry, as a single tombstone record or partition rewrite"""
+        with self.lock, WORKBOOK_LOCK:
+            self.sync()
+            date = self.row_date(row_id)
+            # Recorded before the row is dropped, like append, so memory is never ahead of the files
+            if self.archive:
+                from storage.archive import month_key
+
+                self.archive.delete(month_key(date), row_id)
+            else:
+                self.wal.append("delete", id=row_id)
+            old_row = self.apply_delete(row_id)
+            if not self.archive:
+                self.maybe_checkpoint()
+            return old_row
+
+    def row(self, position):
+        """The (name, account, category, amount, timestamp) of a row position"""
+        return (
+            self.dictionaries["Name"].values[self.codes["Name"].view[position]],
+            self.dictionaries["Account"].values[self.codes["Account"].view[position]],
+            self.dictionaries["Category"].values[self.codes["Category"].view[position]],
+            float(self.amounts.view[position]),
+            int(self.timestamps.view[position]),
+        )
+
+    def row_date(self, row_id):
+        timestamp = self.timestamps.view[self.positions[row_id]]
+        return None if timestamp == MISSING_TIMESTAMP else pd.Timestamp(int(timestamp))
+
+    def apply_update(self, row_id, fields):
+        with self.lock:
+            position = self.positions[row_id]
+            old_row = self.row(position)
+            for column, value in fields.items():
+                if column == "Amount":
+                    self.amounts.view[position] = value
+                elif column == "Date":
+                    self.timestamps.view[position] = to_timestamp(value)
+                else:
+                    self.codes[column].view[position] = self.dictionaries[column].encode(value)
+            self.base_amounts.view[position] = self.convert(np.array([position]))[0]
+            self.version += 1
+            self.notify("on_update", position, old_row, self.row(position))
+            return old_row
+
+    def apply_delete(self, row_id):
+        with self.lock:
+            position = self.positions.pop(row_id)
+            old_row = self.row(position)
+            self.live.view[position] = False
+            self.version += 1
+            self.notify("on_delete", position, *old_row)
+            return old_row
+
+    def merge_sheet(self, df):
+        """Apply the changes made to the Expenses sheet outside the bot, returning (added, updated, deleted)
+
+        The sheet's rows are matched by ID against sheet_rows, the hashes of the
+        sheet as the ledger last read or wrote it, so only rows edited since are
+        touched; changes still only in the write-ahead log are in neither version
+        of the sheet and are kept. New rows, and copies of a row with its ID,
+        get new IDs. Listeners are notified of every row as for any other change,
+        and the workbook catches up at the next checkpoint.
+        """
+        df = normalize_expenses(df)
+        with self.lock:
+            hashes = sheet_fingerprint(df.assign(ID=df["ID"].fillna(MISSING_ID)))
+            new = (df["ID"].isna() | df["ID"].duplicated()).to_numpy(copy=True)
+            known = ~new & df["ID"].isin(self.sheet_rows.index).to_numpy()
+            # IDs typed in by hand are kept if they are free
+            new |= ~new & ~known & df["ID"].fillna(MISSING_ID).isin(list(self.positions)).to_numpy()
+
+            old_hashes = self.sheet_rows.reindex(df["ID"].fillna(MISSING_ID).to_numpy()).to_numpy()
+            changed = known & (old_hashes != hashes.to_numpy())
+            deleted = self.sheet_rows.index.difference(df["ID"][~new].dropna().astype(np.int64))
+
+            for row_id in deleted.tolist():
+                if row_id in self.positions:
+                    self.apply_delete(row_id)
+            fields = [column for column in EXPENSE_COLUMNS if column != "ID"]
+            for index in np.flatnonzero(changed):
+                row_id = int(df.at[index, "ID"])
+                if row_id in self.positions:
+                    self.apply_update(row_id, df.loc[index, fields].to_dict())
+            ids = df["ID"].to_numpy(dtype=object)
+            for index in np.flatnonzero(~known):
+                row_id = self.next_id if new[index] else int(ids[index])
+                ids[index] = row_id
+                self.apply_append(*df.loc[index, ["Name", "Account", "Category", "Amount", "Date"]], row_id,
+                                  df.at[index, "Currency"])
+
+            self.sheet_rows = sheet_fingerprint(df.assign(ID=ids))
+            return int((~known).sum()), int(changed.sum()), len(deleted)
+
+    def latest(self, count):
+        """IDs of the most recently added live entries, newest first"""
+        with self.lock:
+            positions = np.flatnonzero(self.live.view)[-count:][::-1]
+            return self.ids.view[positions].tolist()
+
+    def replace_value(self, column, old_value, new_value):
+        """Durably rename every occurrence of old_value in a column, returning the number of rows changed"""
+        with self.lock, WORKBOOK_LOCK:
+            self.sync()
+            old_code = self.dictionaries[column].lookup(old_value)
+            if old_code < 0 or not (self.codes[column].view == old_code).any():
+                return 0
+            # Recorded before the columns change, like append, so memory is never ahead of the files
+            if self.archive:
+                self.archive.rename(column, old_value, new_value)
+            else:
+                self.wal.append("replace", column=column, old=old_value, new=new_value)
+            updated_count = self.apply_replace(column, old_value, new_value)
+            if not self.archive:
+                self.maybe_checkpoint()
+            return updated_count
+
+    def apply_replace(self, column, old_value, new_value):
+        with self.lock:
+            dictionary = self.dictionaries[column]
+            codes = self.codes[column].view
+            old_code = dictionary.lookup(old_value)
+            if old_code < 0:
+                return 0
+
+            mask = codes == old_code
+            updated_count = int(mask.sum())
+            if new_value in dictionary:
+                # Merging into an existing value: move the rows over to its code
+                codes[mask] = dictionary.lookup(new_value)
+                if column == "Account":
+                    # The rows now follow the currency of the account they were merged into
+                    positions = np.flatnonzero(mask)
+                    self.base_amounts.view[positions] = self.convert(positions)
+            else:
+                dictionary.rename(old_value, new_value)
+            if updated_count > 0:
+                self.version += 1
+                self.notify("on_replace", column, old_value, new_value)
+            return updated_count
+
+    def account_currency_codes(self, positions):
+        """Currency code of each row's account, 0 for accounts in the base currency"""
+        lookup = np.zeros(len(self.dictionaries["Account"]), dtype=self.dictionaries["Currency"].dtype)
+        for account_code, currency_code in self.account_currencies.items():
+            lookup[account_code] = currency_code
+        return lookup[self.codes["Account"].view[positions]]
+
+    def currency_codes(self, positions):
+        """Currency code each row's amount is in: its own, else its account's, else the base currency's (0)"""
+        codes = self.codes["Currency"].view[positions]
+        if not self.account_currencies:
+            return codes
+        return np.where(codes == 0, self.account_currency_codes(positions), codes)
+
+    def rate_of(self, codes, timestamps):
+        """Rate of each row's currency code at its timestamp, one vectorized lookup per distinct currency"""
+        rates = np.ones(len(codes))
+        values = self.dictionaries["Currency"].values
+        for code in np.unique(codes):
+            if code != 0:
+                rows = codes == code
+                rates[rows] = self.rates.lookup(values[code], timestamps[rows])
+        return rates
+
+    def convert(self, positions):
+        """Amounts of the rows at positions in the base currency
+
+        Amounts in a currency without a known rate become NaN and are left out of totals.
+        """
+        amounts = self.amounts.view[positions].astype(np.float64)
+        if self.rates is None:
+            return amounts
+        return amounts * self.rate_of(self.currency_codes(positions), self.timestamps.view[positions])
+
+    def account_amounts(self, positions):
+        """Amounts of the rows at positions in their account's currency
+
+        Only entries made in another currency than their account's are converted,
+        through the base currency at the entry's date.
+        """
+        amounts = self.amounts.view[positions].astype(np.float64)
+        if self.rates is None:
+            return amounts
+        own = self.codes["Currency"].view[positions]
+        account = self.account_currency_codes(positions)
+        foreign = (own != 0) & (own != account)
+        if foreign.any():
+            timestamps = self.timestamps.view[positions][foreign]
+            amounts[foreign] *= self.rate_of(own[foreign], timestamps) / self.rate_of(account[foreign], timestamps)
+        return amounts
+
+    def set_account_currency(self, account, currency):
+        """Change the currency of an account and convert its rows again"""
+        with self.lock:
+            account_code = self.dictionaries["Account"].encode(account)
+            if currency:
+                self.account_currencies[account_code] = self.dictionaries["Currency"].encode(currency)
+            else:
+                self.account_currencies.pop(account_code, None)
+            positions = np.flatnonzero((self.codes["Account"].view == account_code) & (self.codes["Currency"].view == 0))
+            if len(positions):
+                old_amounts = self.base_amounts.view[positions].copy()
+                self.base_amounts.view[positions] = self.convert(positions)
+                self.version += 1
+                self.notify("on_rates", positions, old_amounts)
+
+    def reload_rates(self):
+        """Pick up a changed rates file, converting only the rows in currencies whose rates changed"""
+        if self.rates is None:
+            return 0
+        with self.lock:
+            changed = self.rates.reload()
+            codes = [self.dictionaries["Currency"].lookup(currency) for currency in changed]
+            codes = [code for code in codes if code > 0]
+            if not codes:
+                return 0
+            positions = np.flatnonzero(np.isin(self.currency_codes(slice(None)), codes))
+            if len(positions):
+                old_amounts = self.base_amounts.view[positions].copy()
+                self.base_amounts.view[positions] = self.convert(positions)
+                # Amounts in other currencies didn't change, so version stays and only caches whose
+                # rows are in one of these currencies go stale
+                for code in codes:
+                    currency = self.dictionaries["Currency"].values[code]
+                    self.rate_versions[currency] = self.rate_versions.get(currency, 0) + 1
+                self.notify("on_rates", positions, old_amounts)
+            return len(positions)
+
+    def rates_stamp(self, mask):
+        """The rate reloads the converted amounts of the masked rows depend on, to store with derived results"""
+        with self.lock:
+            codes = np.unique(self.currency_codes(np.flatnonzero(mask)))
+            values = self.dictionaries["Currency"].values
+            return tuple((values[code], self.rate_versions.get(values[code], 0)) for code in codes.tolist() if code)
+
+    def rates_current(self, stamp):
+        """Whether no rate a rates_stamp() result depends on has changed since"""
+        return all(self.rate_versions.get(currency, 0) == count for currency, count in stamp)
+
+    def totals_by(self, column, mask=None, amounts=None):
+        """Sum base currency amounts (or the given amounts) per value of a text column with a single bincount"""
+        with self.lock:
+            live = self.live.view
+            mask = live if mask is None else mask & live
+            amounts = self.base_amounts.view if amounts is None else amounts
+            codes, amounts = self.codes[column].view[mask], amounts[mask]
+            valid = ~np.isnan(amounts)
+            totals = np.bincount(codes[valid], weights=amounts[valid], minlength=len(self.dictionaries[column]))
+            values = self.dictionaries[column].values
+            return {values[code]: float(total) for code, total in enumerate(totals) if total != 0}
+
+    def rows(self, indices):
+        """Decode the given row positions back into (name, account, category, amount, date) tuples"""
+        with self.lock:
+            decoded = {
+                column: [self.dictionaries[column].values[code] for code in self.codes[column].view[indices]]
+                for column in TEXT_COLUMNS
+            }
+            amounts = self.amounts.view[indices]
+            dates = pd.to_datetime(self.timestamps.view[indices].view("datetime64[ns]"))
+            return list(zip(decoded["Name"], decoded["Account"], decoded["Category"], amounts, dates))
+
+    @property
+    def frame(self):
+        """Return the live entries as a DataFrame with categorical text columns"""
+        with self.lock:
+            live = self.live.view
+            data = {
+                column: pd.Categorical.from_codes(self.codes[column].view[live], self.dictionaries[column].values)
+                for column in TEXT_COLUMNS
+            }
+            data["Amount"] = self.amounts.view[live]
+            data["Date"] = self.timestamps.view[live].view("datetime64[ns]")
+            data["ID"] = self.ids.view[live]
+            return pd.DataFrame(data, columns=EXPENSE_COLUMNS)
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pandas as pd
+
+RATE_COLUMNS = ["Date", "Currency", "Rate"]
+
+NS_PER_DAY = 86_400_000_000_000
+
+
+class RateTable:
+    """Exchange rates read from a local CSV file with Date, Currency and Rate columns
+
+    Rate is the value of one unit of Currency in the base currency on that date.
+    Each currency's rates are held as sorted arrays of days and values, so a whole
+    column of dates is converted with one searchsorted: every date uses the latest
+    rate on or before it, and dates before the first rate use the first one. The
+    file is read once and only read again when its modification time changes.
+    """
+
+    def __init__(self, path, base_currency):
+        self.path = path
+        self.base_currency = base_currency
+        self.mtime = None
+        # currency -> (days as int64, rates as float64), both sorted by day
+        self.series = {}
+        self.reload()
+
+    def __contains__(self, currency):
+        return currency in ("", self.base_currency) or currency in self.series
+
+    def reload(self):
+        """Read the file again if it changed, returning the currencies whose rates differ"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return set()
+        self.mtime = mtime
+
+        series = {}
+        if mtime is not None:
+            try:
+                df = pd.read_csv(self.path)
+                df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
+                df["Rate"] = pd.to_numeric(df["Rate"], errors="coerce")
+                df["Currency"] = df["Currency"].astype(str).str.strip().str.upper()
+                df = df.dropna(subset=["Date", "Rate"])
+                df = df[df["Rate"] > 0]
+                days = df["Date"].to_numpy(dtype="datetime64[ns]").view(np.int64) // NS_PER_DAY
+                df = df.assign(Day=days).sort_values(["Currency", "Day"]).drop_duplicates(["Currency", "Day"], keep="last")
+                for currency, rows in df.groupby("Currency"):
+                    series[currency] = (rows["Day"].to_numpy(), rows["Rate"].to_numpy(dtype=np.float64))
+            except Exception as e:
+                print(f"Error loading exchange rates from {self.path}: {e}")
+                return set()
+
+        changed = {
+            currency for currency in set(series) | set(self.series)
+            if currency not in series or currency not in self.series
+            or not all(np.array_equal(a, b) for a, b in zip(series[currency], self.series[currency]))
+        }
+        self.series = series
+        return changed
+
+    def lookup(self, currency, timestamps):
+        """Rate of currency at each int64 nanosecond timestamp; NaN when the currency has no rates"""
+        if currency in ("", self.base_currency):
+            return np.ones(len(timestamps))
+        if currency not in self.series:
+            return np.full(len(timestamps), np.nan)
+        days, rates = self.series[currency]
+        # Undated rows (int64 min) sort before every day and get the first rate
+        index = np.searchsorted(days, timestamps // NS_PER_DAY, side="right") - 1
+        return rates[np.clip(index, 0, len(rates) - 1)]
+
+    def latest(self):
+        """The most recent rate of every currency, as {currency: (date, rate)}"""
+        return {
+            currency: (pd.Timestamp(int(days[-1]) * NS_PER_DAY), float(rates[-1]))
+            for currency, (days, rates) in sorted(self.series.items())
+        }
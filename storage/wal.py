@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+
+
+class WriteAheadLog:
+    """Append-only log of ledger mutations, one JSON record per line
+
+    Each record is flushed and fsynced before the mutation is applied, so it
+    survives a crash; the log is emptied once a checkpoint of the workbook has
+    been written. Records carry increasing sequence numbers, which lets recovery
+    skip the ones a checkpoint already contains. offset is how far the log has
+    been read or written by this process, so records appended by other processes
+    sharing the file can be read with tail().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.pending = 0
+        self.offset = 0
+
+    def read(self, start=0):
+        """Return every complete record from byte start on; a torn final line from a crash is ignored"""
+        records = []
+        self.offset = start
+        if not os.path.exists(self.path):
+            self.offset = 0
+            return records
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"Ignoring incomplete record at the end of {self.path}")
+                    break
+                self.offset += len(line)
+        if records:
+            self.seq = max(self.seq, records[-1]["seq"])
+        return records
+
+    def tail(self):
+        """Return the records appended since this process last read or wrote the log"""
+        return self.read(self.offset)
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def append(self, op, **fields):
+        """Durably record one mutation with a single write and fsync, returning its sequence number"""
+        with self.lock:
+            self.seq += 1
+            record = {"seq": self.seq, "op": op, **fields}
+            with open(self.path, "ab") as f:
+                f.write(json.dumps(record, default=str).encode() + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+                self.offset = f.tell()
+            self.pending += 1
+            return self.seq
+
+    def truncate(self):
+        """Empty the log after a checkpoint has made its records redundant"""
+        with self.lock:
+            with open(self.path, "wb") as f:
+                os.fsync(f.fileno())
+            self.pending = 0
+            self.offset = 0
@@ -0,0 +1,180 @@
+import fcntl
+import os
+import posixpath
+import threading
+import zipfile
+from xml.etree import ElementTree
+import pandas as pd
+
+
+class WorkbookLock:
+    """Reentrant lock around rewrites of the workbook, shared with other processes once share() is called
+
+    Shared, it also holds an exclusive flock on <data file>.lock while taken, and
+    counts rewrites in <data file>.generation so every process can tell whether
+    another one changed the workbook since it last looked.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+        self.generation_file = None
+        # Generations written by this process, which never make its own state stale
+        self.own_generations = set()
+        # Per workbook, the file stamps before and after this process's latest run of back-to-back
+        # rewrites, so a watcher can tell them from changes made by someone else
+        self.writes = {}
+
+    def share(self, data_file):
+        self.lock_file = open(data_file + ".lock", "a+")
+        self.generation_file = data_file + ".generation"
+
+    @property
+    def shared(self):
+        return self.lock_file is not None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.depth == 0 and self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0 and self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock.release()
+
+    def generation(self):
+        if self.generation_file is None:
+            return 0
+        try:
+            with open(self.generation_file) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self):
+        """Record a rewrite of the workbook by this process"""
+        if self.generation_file is None:
+            return
+        with self:
+            generation = self.generation() + 1
+            temp_path = self.generation_file + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write(str(generation))
+            os.replace(temp_path, self.generation_file)
+            self.own_generations.add(generation)
+
+    def record_write(self, file_path, before, after):
+        """Note that this process rewrote the workbook, changing its stamp from before to after
+
+        A before of None means the write created the file, which starts a run like any other stamp.
+        """
+        run = self.writes.get(file_path)
+        self.writes[file_path] = (run[0] if run is not None and run[1] == before else before, after)
+
+    def changed_since(self, seen):
+        """The current generation, and whether another process rewrote the workbook after generation seen"""
+        with self:
+            generation = self.generation()
+            return generation, any(g not in self.own_generations for g in range(seen + 1, generation + 1))
+
+
+# Serializes every rewrite of the workbook; pyTelegramBotAPI runs handlers on several threads,
+# and with WORKERS > 1 several processes share the files
+WORKBOOK_LOCK = WorkbookLock()
+
+# Sheets written for the bot's own bookkeeping, hidden from people opening the file by hand
+HIDDEN_SHEETS = ["Log"]
+
+
+def read_sheets(file_path):
+    """Read every sheet of the workbook, or an empty dict if the file doesn't exist"""
+    if not os.path.exists(file_path):
+        return {}
+    return pd.read_excel(file_path, sheet_name=None)
+
+
+def write_sheets(file_path, sheets):
+    """Replace the given sheets, keeping the others, without ever leaving a partial file behind
+
+    The whole workbook is written to a temporary file next to the original,
+    fsynced and renamed over it, so a crash leaves either the old or the new file.
+    """
+    with WORKBOOK_LOCK:
+        try:
+            all_sheets = read_sheets(file_path)
+        except Exception as e:
+            # An unreadable workbook must not be silently replaced by a partial one
+            raise RuntimeError(f"Cannot rewrite {file_path}, it could not be read: {e}")
+        all_sheets.update(sheets)
+
+        # pandas picks the writer from the extension, so keep it on the temporary file
+        base, extension = os.path.splitext(file_path)
+        temp_path = f"{base}.tmp{extension}"
+        with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
+            for sheet_name, df in all_sheets.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+            for sheet_name in HIDDEN_SHEETS:
+                if sheet_name in all_sheets and len(all_sheets) > 1:
+                    writer.book[sheet_name].sheet_state = "hidden"
+
+        with open(temp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        before = file_stamp(file_path)
+        os.replace(temp_path, file_path)
+        fsync_directory(file_path)
+        WORKBOOK_LOCK.record_write(file_path, before, file_stamp(file_path))
+        WORKBOOK_LOCK.bump()
+
+
+def file_stamp(file_path):
+    """(modification time, size) of a file, or None if it doesn't exist"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def sheet_checksums(file_path):
+    """CRC-32 of every sheet's XML part, by sheet name, read from the zip directory without decompressing
+
+    An .xlsx file is a zip archive: xl/workbook.xml lists the sheets and
+    xl/_rels/workbook.xml.rels maps each one to its part.
+    """
+    namespaces = {
+        "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+        "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+    }
+    relationship_id = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+    with zipfile.ZipFile(file_path) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        relationships = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in relationships.findall("rel:Relationship", namespaces)}
+        checksums = {}
+        for sheet in workbook.findall("main:sheets/main:sheet", namespaces):
+            target = targets.get(sheet.get(relationship_id), "")
+            # Targets are relative to xl/, or absolute within the package
+            part = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+            try:
+                checksums[sheet.get("name")] = archive.getinfo(part).CRC
+            except KeyError:
+                continue
+        return checksums
+
+
+def fsync_directory(file_path):
+    """Make a rename in the file's directory durable"""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,68 @@
+import os
+import pandas as pd
+from storage.archive import MANIFEST_FILE, ExpenseArchive
+from storage.ledger import ExpenseLedger
+
+
+def open_ledger(path):
+    ledger = ExpenseLedger(str(path / "data.xlsx"), archive_dir=str(path / "archive"))
+    ledger.load(["Cash", "Bank"], ["Food", "Rent"])
+    return ledger
+
+
+def entries(ledger):
+    return sorted((int(row.ID), row.Name, row.Account, row.Category, row.Amount, row.Date)
+                  for row in ledger.frame.itertuples(index=False))
+
+
+def test_entries_go_to_their_month_and_past_months_close(tmp_path):
+    ledger = open_ledger(tmp_path)
+    this_month = pd.Timestamp.now().normalize()
+    ledger.append("Lunch", "Cash", "Food", 12.5, pd.Timestamp("2026-01-15"))
+    ledger.append("Rent", "Bank", "Rent", 900.0, pd.Timestamp("2026-02-01"))
+    ledger.append("Tea", "Cash", "Food", 3.0, this_month)
+    ledger.compact()
+
+    archive = ledger.archive
+    current = this_month.strftime("%Y-%m")
+    assert archive.months() == ["2026-01", "2026-02", current]
+    assert archive.is_closed("2026-01") and archive.is_closed("2026-02")
+    assert not archive.is_closed(current)
+    assert archive.manifest["2026-02"]["accounts"] == ["Bank"]
+
+    assert entries(open_ledger(tmp_path)) == entries(ledger)
+
+
+def test_rename_touches_only_partitions_with_the_value(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("Lunch", "Cash", "Food", 12.5, pd.Timestamp("2026-01-15"))
+    ledger.append("Rent", "Bank", "Rent", 900.0, pd.Timestamp("2026-02-01"))
+    ledger.compact()
+    january = os.stat(ledger.archive.path("2026-01")).st_mtime_ns
+
+    assert ledger.archive.partitions_with("Account", "Bank") == ["2026-02"]
+    ledger.replace_value("Account", "Bank", "Savings")
+
+    assert os.stat(ledger.archive.path("2026-01")).st_mtime_ns == january
+    assert ledger.archive.read_frame("2026-02")["Account"].tolist() == ["Savings"]
+    assert [row[2] for row in entries(open_ledger(tmp_path))] == ["Cash", "Savings"]
+
+
+def test_update_and_delete_rewrite_one_partition(tmp_path):
+    ledger = open_ledger(tmp_path)
+    lunch = ledger.append("Lunch", "Cash", "Food", 12.5, pd.Timestamp("2026-01-15"))
+    dinner = ledger.append("Dinner", "Cash", "Food", 20.0, pd.Timestamp("2026-01-16"))
+    ledger.update(lunch, {"Amount": 14.0})
+    ledger.delete(dinner)
+
+    assert entries(open_ledger(tmp_path)) == [(lunch, "Lunch", "Cash", "Food", 14.0, pd.Timestamp("2026-01-15"))]
+
+
+def test_missing_manifest_is_rebuilt(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("Lunch", "Cash", "Food", 12.5, pd.Timestamp("2026-01-15"))
+    ledger.compact()
+    manifest = dict(ledger.archive.manifest)
+    os.remove(os.path.join(ledger.archive.directory, MANIFEST_FILE))
+
+    assert ExpenseArchive(ledger.archive.directory).manifest == manifest
@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+import random
+from storage.backup import SnapshotStore
+
+
+def back_up(directory, seed, shared):
+    """Snapshots mixing chunks shared with the other process and new ones, pruning down to two"""
+    rng = random.Random(seed)
+    store = SnapshotStore(directory, keep=2)
+    for _ in range(15):
+        store.create({"data.xlsx": shared + rng.randbytes(64 * 1024)})
+
+
+def test_prunes_in_other_processes_keep_reused_chunks(tmp_path):
+    shared = random.Random(0).randbytes(256 * 1024)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=back_up, args=(str(tmp_path), seed, shared)) for seed in (1, 2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0]
+
+    store = SnapshotStore(str(tmp_path), keep=2)
+    assert len(store.snapshots()) == 2
+    for snapshot_id in store.snapshots():
+        restored = store.restore(snapshot_id, str(tmp_path / snapshot_id))
+        with open(restored[0], "rb") as f:
+            assert f.read().startswith(shared)
+    assert os.path.exists(tmp_path / "lock")
@@ -0,0 +1,72 @@
+import threading
+import time
+from dispatcher import ChatDispatcher
+
+
+def test_items_of_a_chat_run_in_order():
+    handled = []
+    dispatcher = ChatDispatcher(lambda item: handled.append(item), workers=4)
+    for index in range(50):
+        for chat in (1, 2, 3):
+            dispatcher.submit(chat, (chat, index))
+    dispatcher.stop()
+
+    for chat in (1, 2, 3):
+        assert [index for item_chat, index in handled if item_chat == chat] == list(range(50))
+    assert dispatcher.stats()["processed"] == 150
+
+
+def test_a_slow_chat_does_not_hold_up_others():
+    release = threading.Event()
+    handled = []
+
+    def handle(item):
+        if item == "slow":
+            release.wait(5)
+        handled.append(item)
+
+    dispatcher = ChatDispatcher(handle, workers=2)
+    dispatcher.submit(1, "slow")
+    dispatcher.submit(1, "after slow")
+    dispatcher.submit(2, "fast")
+    deadline = time.time() + 5
+    while "fast" not in handled and time.time() < deadline:
+        time.sleep(0.01)
+    assert handled == ["fast"]
+
+    release.set()
+    dispatcher.stop()
+    assert handled == ["fast", "slow", "after slow"]
+
+
+def test_submit_blocks_beyond_max_pending():
+    release = threading.Event()
+    dispatcher = ChatDispatcher(lambda item: release.wait(5), workers=1, max_pending=2)
+    dispatcher.submit(1, 0)
+    dispatcher.submit(1, 1)
+    blocked = threading.Thread(target=dispatcher.submit, args=(1, 2))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+
+    release.set()
+    blocked.join(5)
+    dispatcher.stop()
+    assert dispatcher.stats()["blocked"] == 1
+    assert dispatcher.stats()["processed"] == 3
+
+
+def test_failures_are_counted_and_later_items_still_run():
+    handled = []
+
+    def handle(item):
+        if item == "bad":
+            raise ValueError(item)
+        handled.append(item)
+
+    dispatcher = ChatDispatcher(handle, workers=1)
+    dispatcher.submit(1, "bad")
+    dispatcher.submit(1, "good")
+    dispatcher.stop()
+    assert handled == ["good"]
+    assert dispatcher.stats()["failures"] == 1
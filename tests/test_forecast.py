@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+import telebot
+from cogs.forecast import NS_PER_DAY, ForecastCog
+from storage.ledger import ExpenseLedger, to_timestamp
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = ExpenseLedger(str(tmp_path / "data.xlsx"))
+    ledger.load(["Cash"], ["Food"])
+    return ledger
+
+
+def test_fractional_amounts_after_empty_ledger(ledger):
+    cog = ForecastCog(telebot.TeleBot("1:test"), 42, ledger)
+    ledger.reload()
+    date = pd.Timestamp("2026-10-10")
+    ledger.append("Lunch", "Cash", "Food", 3.5, date)
+    ledger.append("Lunch", "Cash", "Food", 3.5, date)
+
+    food = ledger.dictionaries["Category"].lookup("Food")
+    spent, _ = cog.categories.forecast(to_timestamp(date) // NS_PER_DAY)
+    assert spent[food] == pytest.approx(7.0)
+    spent, _ = cog.accounts.forecast(to_timestamp(date) // NS_PER_DAY)
+    assert spent.sum() == pytest.approx(7.0)
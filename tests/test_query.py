@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from cogs.query import compile_query, run_query
+from storage.ledger import ExpenseLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = ExpenseLedger(str(tmp_path / "data.xlsx"))
+    ledger.load(["Cash", "Bank"], ["Food", "Rent"])
+    ledger.append("Lunch", "Cash", "Food", 12.5, pd.Timestamp("2026-01-15"))
+    ledger.append("Team lunch", "Bank", "Food", 40.0, pd.Timestamp("2026-02-03"))
+    ledger.append("Rent", "Bank", "Rent", 900.0, pd.Timestamp("2026-02-01"))
+    ledger.append("Refund", "Cash", "Food", -5.0, pd.Timestamp("2026-03-10"))
+    return ledger
+
+
+def matching_names(ledger, text):
+    mask = run_query(ledger, compile_query(text))
+    return sorted(ledger.frame.loc[mask[ledger.live.view], "Name"].astype(str))
+
+
+def test_ledger_columns(ledger):
+    assert len(ledger) == 4
+    assert ledger.totals_by("Category") == {"Food": 47.5, "Rent": 900.0}
+    assert ledger.row(ledger.positions[0]) == ("Lunch", "Cash", "Food", 12.5, pd.Timestamp("2026-01-15").value)
+
+
+def test_filters_combine(ledger):
+    assert matching_names(ledger, "category=Food amount>20") == ["Team lunch"]
+    assert matching_names(ledger, "account=Cash,Bank since=2026-02 until=2026-02") == ["Rent", "Team lunch"]
+    assert matching_names(ledger, "name~LUNCH") == ["Lunch", "Team lunch"]
+    assert matching_names(ledger, "category!=Food") == ["Rent"]
+    assert matching_names(ledger, "account=Nowhere") == []
+
+
+def test_deleted_entries_never_match(ledger):
+    position = ledger.positions[1]
+    ledger.delete(1)
+    assert matching_names(ledger, "name~lunch") == ["Lunch"]
+    assert not run_query(ledger, compile_query(""))[position]
+
+
+@pytest.mark.parametrize("text", ["category", "colour=red", "amount~3", "amount>ten", "since=2026-13"])
+def test_invalid_queries(text):
+    with pytest.raises(ValueError):
+        compile_query(text)
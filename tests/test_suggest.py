@@ -0,0 +1,59 @@
+import random
+import pandas as pd
+import pytest
+from cogs.suggest import SuggestionEngine
+from storage.ledger import ExpenseLedger
+
+DATE = pd.Timestamp("2026-10-01")
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = ExpenseLedger(str(tmp_path / "data.xlsx"), checkpoint_every=1000)
+    ledger.load(["Cash", "Bank"], ["Food", "Rent"])
+    return ledger
+
+
+def trie(node, prefix=""):
+    """Every node's prefix and best (name, count), for comparing tries"""
+    nodes = {prefix: (node.best_name, node.best_count)}
+    for char, child in node.children.items():
+        nodes.update(trie(child, prefix + char))
+    return nodes
+
+
+def test_edits_and_deletes_take_back_counts(ledger):
+    engine = SuggestionEngine(ledger)
+    lunch = ledger.append("Lunch", "Cash", "Food", 12.0, DATE)
+    ledger.append("Lunch", "Bank", "Food", 15.0, DATE)
+    ledger.append("Lunch", "Bank", "Food", 9.0, DATE)
+    ledger.append("Lunchbox", "Cash", "Rent", 4.0, DATE)
+    assert engine.suggest("lun") == ("Bank", "Food")
+
+    ledger.update(lunch, {"Name": "Lunchbox"})
+    ledger.delete(ledger.latest(4)[2])
+    # Lunch is down to one entry, Lunchbox has two
+    assert engine.counts == {"lunch": {("Bank", "Food"): 1}, "lunchbox": {("Cash", "Food"): 1, ("Cash", "Rent"): 1}}
+    assert engine.suggest("lun") in (("Cash", "Food"), ("Cash", "Rent"))
+
+
+def test_incremental_counts_match_a_rebuild(ledger):
+    rng = random.Random(7)
+    engine = SuggestionEngine(ledger)
+    names = ["Tea", "Taxi", "Tax", "Rent", "Rental", "T"]
+    ids = []
+    for _ in range(300):
+        action = rng.random()
+        if action < 0.5 or not ids:
+            ids.append(ledger.append(rng.choice(names), rng.choice(["Cash", "Bank"]), rng.choice(["Food", "Rent"]),
+                                     1.0, DATE))
+        elif action < 0.8:
+            ledger.update(rng.choice(ids), {"Name": rng.choice(names), "Account": rng.choice(["Cash", "Bank"])})
+        else:
+            ledger.delete(ids.pop(rng.randrange(len(ids))))
+
+    counts, totals = engine.counts, engine.totals
+    best = {prefix: count for prefix, (_, count) in trie(engine.root).items()}
+    engine.rebuild()
+    assert (counts, totals) == (engine.counts, engine.totals)
+    assert best == {prefix: count for prefix, (_, count) in trie(engine.root).items()}
@@ -0,0 +1,104 @@
+import json
+import pandas as pd
+import pytest
+from storage.ledger import ExpenseLedger
+
+DATE = pd.Timestamp("2026-10-01")
+
+
+def open_ledger(path):
+    ledger = ExpenseLedger(str(path / "data.xlsx"), checkpoint_every=1000)
+    ledger.load(["Cash", "Bank"], ["Food", "Rent"])
+    return ledger
+
+
+def entries(ledger):
+    """(ID, name, account, category, amount) of every live entry, in ID order"""
+    return sorted((int(row.ID), row.Name, row.Account, row.Category, row.Amount)
+                  for row in ledger.frame.itertuples(index=False))
+
+
+def test_torn_last_record_is_ignored(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("Lunch", "Cash", "Food", 12.5, DATE)
+    ledger.append("Dinner", "Cash", "Food", 20.0, DATE)
+    # A crash halfway through writing the third record
+    with open(ledger.wal.path, "ab") as f:
+        f.write(b'{"seq": 3, "op": "append", "row": ["Bre')
+
+    recovered = open_ledger(tmp_path)
+    assert entries(recovered) == [(0, "Lunch", "Cash", "Food", 12.5), (1, "Dinner", "Cash", "Food", 20.0)]
+
+
+def test_records_in_the_checkpoint_are_skipped(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.append("Lunch", "Cash", "Food", 12.5, DATE)
+    ledger.append("Dinner", "Cash", "Food", 20.0, DATE)
+    with open(ledger.wal.path, "rb") as f:
+        logged = f.read()
+    ledger.checkpoint()
+    # The log as it was before the checkpoint emptied it; its records are all in the workbook
+    with open(ledger.wal.path, "wb") as f:
+        f.write(logged)
+
+    recovered = open_ledger(tmp_path)
+    assert len(recovered.frame) == 2
+
+
+def test_crash_between_checkpoint_write_and_truncate(tmp_path, monkeypatch):
+    ledger = open_ledger(tmp_path)
+    ledger.append("Lunch", "Cash", "Food", 12.5, DATE)
+    ledger.append("Dinner", "Cash", "Food", 20.0, DATE)
+
+    def crash():
+        raise OSError("crashed before truncating the log")
+
+    monkeypatch.setattr(ledger.wal, "truncate", crash)
+    with pytest.raises(OSError):
+        ledger.checkpoint()
+    monkeypatch.undo()
+
+    recovered = open_ledger(tmp_path)
+    assert entries(recovered) == entries(ledger)
+    # Later entries don't reuse IDs
+    assert recovered.append("Tea", "Cash", "Food", 3.0, DATE) == 2
+
+
+def test_update_delete_and_replace_are_replayed(tmp_path):
+    ledger = open_ledger(tmp_path)
+    lunch = ledger.append("Lunch", "Cash", "Food", 12.5, DATE)
+    dinner = ledger.append("Dinner", "Cash", "Food", 20.0, DATE)
+    rent = ledger.append("Rent", "Bank", "Rent", 900.0, DATE)
+    ledger.update(lunch, {"Amount": 14.0, "Name": "Brunch"})
+    ledger.delete(dinner)
+    ledger.replace_value("Category", "Rent", "Housing")
+    with open(ledger.wal.path) as f:
+        assert [json.loads(line)["op"] for line in f] == ["append"] * 3 + ["update", "delete", "replace"]
+
+    recovered = open_ledger(tmp_path)
+    assert entries(recovered) == [(lunch, "Brunch", "Cash", "Food", 14.0), (rent, "Rent", "Bank", "Housing", 900.0)]
+    assert entries(recovered) == entries(ledger)
+
+
+def test_rows_of_other_sheets_are_replayed_and_checkpointed(tmp_path):
+    from cogs.accounts import transfers_frame
+
+    ledger = open_ledger(tmp_path)
+    ledger.track_sheet("Transfers", transfers_frame)
+    ledger.append_row("Transfers", {"Date": "2026-10-01 09:00:00", "From": "Cash", "To": "Bank",
+                                    "Amount": 50.0, "Received": 50.0})
+    with open(ledger.wal.path) as f:
+        assert [json.loads(line)["op"] for line in f] == ["row"]
+
+    # Only the log holds the transfer until a checkpoint, which recovery makes
+    recovered = ExpenseLedger(str(tmp_path / "data.xlsx"), checkpoint_every=1000)
+    recovered.track_sheet("Transfers", transfers_frame)
+    recovered.load(["Cash", "Bank"], ["Food", "Rent"])
+    assert recovered.logged_rows == {}
+    recovered.append_row("Transfers", {"Date": "2026-10-02 09:00:00", "From": "Bank", "To": "Cash",
+                                       "Amount": 20.0, "Received": 20.0})
+    recovered.checkpoint()
+
+    transfers = pd.read_excel(tmp_path / "data.xlsx", sheet_name="Transfers")
+    assert transfers[["From", "To", "Amount"]].values.tolist() == [["Cash", "Bank", 50.0], ["Bank", "Cash", 20.0]]
+    assert transfers["Date"].tolist() == [pd.Timestamp("2026-10-01 09:00"), pd.Timestamp("2026-10-02 09:00")]
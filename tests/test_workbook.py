@@ -0,0 +1,50 @@
+import pandas as pd
+from storage.workbook import WORKBOOK_LOCK, write_sheets
+from watcher import WorkbookWatcher
+
+
+class StubLedger:
+    """Just what WorkbookWatcher reads from the ledger"""
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.sheet_name = "Expenses"
+        self.archive = None
+        self.lock = WORKBOOK_LOCK
+
+
+class RecordingCog:
+    def __init__(self):
+        self.reloads = []
+
+    def reload_sheets(self, frames):
+        self.reloads.append(sorted(frames))
+        return []
+
+
+def test_writes_creating_the_workbook_are_not_external(tmp_path):
+    data_file = str(tmp_path / "data.xlsx")
+    cog = RecordingCog()
+    watcher = WorkbookWatcher(StubLedger(data_file), [cog])
+
+    # Onboarding creates the workbook, then rewrites it sheet by sheet
+    write_sheets(data_file, {"Accounts": pd.DataFrame({"Account": ["Cash"]})})
+    write_sheets(data_file, {"Categories": pd.DataFrame({"Category": ["Food"]})})
+
+    assert watcher.check() == []
+    assert cog.reloads == []
+
+
+def test_external_edit_after_creation_is_applied(tmp_path):
+    data_file = str(tmp_path / "data.xlsx")
+    cog = RecordingCog()
+    watcher = WorkbookWatcher(StubLedger(data_file), [cog])
+    write_sheets(data_file, {"Accounts": pd.DataFrame({"Account": ["Cash"]})})
+    assert watcher.check() == []
+
+    # Written without going through write_sheets, as a spreadsheet app would
+    with pd.ExcelWriter(data_file) as writer:
+        pd.DataFrame({"Account": ["Cash", "Bank"]}).to_excel(writer, sheet_name="Accounts", index=False)
+
+    assert watcher.check() == ["Accounts"]
+    assert cog.reloads == [["Accounts"]]
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+from storage.ledger import ExpenseLedger
+from storage.workbook import WORKBOOK_LOCK
+from workers import chat_id
+
+DATE = pd.Timestamp("2026-10-01")
+
+
+def test_updates_shard_by_chat():
+    message = {"update_id": 1, "message": {"chat": {"id": 42}, "text": "/add"}}
+    callback = {"update_id": 2, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 42}}}}
+    inline = {"update_id": 3, "callback_query": {"from": {"id": 7}}}
+    assert chat_id(message) == chat_id(callback) == 42
+    assert chat_id(inline) == 7
+    assert chat_id({"update_id": 4, "poll": {}}) == 0
+
+
+@pytest.fixture
+def shared_lock(tmp_path, monkeypatch):
+    # Sharing is process-wide; undone after the test so other tests keep a private lock
+    monkeypatch.setattr(WORKBOOK_LOCK, "lock_file", None)
+    monkeypatch.setattr(WORKBOOK_LOCK, "generation_file", None)
+    monkeypatch.setattr(WORKBOOK_LOCK, "own_generations", set())
+    WORKBOOK_LOCK.share(str(tmp_path / "data.xlsx"))
+    yield
+    WORKBOOK_LOCK.lock_file.close()
+
+
+def open_shared(path):
+    ledger = ExpenseLedger(str(path / "data.xlsx"), checkpoint_every=1000)
+    ledger.load(["Cash"], ["Food"])
+    ledger.share()
+    return ledger
+
+
+def entries(ledger):
+    return sorted((int(row.ID), row.Name, row.Amount) for row in ledger.frame.itertuples(index=False))
+
+
+def test_workers_see_each_others_changes(tmp_path, shared_lock):
+    first, second = open_shared(tmp_path), open_shared(tmp_path)
+
+    lunch = first.append("Lunch", "Cash", "Food", 12.5, DATE)
+    # IDs stay unique across workers, since every write first applies the others' records
+    dinner = second.append("Dinner", "Cash", "Food", 20.0, DATE)
+    assert lunch != dinner
+    first.update(lunch, {"Amount": 14.0})
+    second.delete(dinner)
+
+    first.sync()
+    second.sync()
+    assert entries(first) == entries(second) == [(lunch, "Lunch", 14.0)]
+
+    # A checkpoint empties the log, so the other worker reads everything again
+    first.checkpoint()
+    tea = first.append("Tea", "Cash", "Food", 3.0, DATE)
+    second.sync()
+    assert entries(second) == [(lunch, "Lunch", 14.0), (tea, "Tea", 3.0)]
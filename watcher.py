@@ -0,0 +1,79 @@
+"""Pick up changes made to data.xlsx outside the bot, e.g. by fixing entries in a spreadsheet app
+
+The watcher compares the workbook's modification time and size with what it
+saw last, which costs one stat() and runs before every update and on the
+scheduler. When they differ it reads the CRC-32 of every sheet from the zip
+directory and only reads the sheets whose checksum changed. Each cog then
+diffs the edited rows against its in-memory state and updates it in place,
+and the ledger matches the Expenses rows by ID, so caches and indexes see the
+edit as ordinary inserts, updates and deletions instead of a restart.
+Rewrites made by the bot itself are recognized and skipped.
+"""
+import zipfile
+from xml.etree import ElementTree
+import pandas as pd
+from storage.workbook import WORKBOOK_LOCK, file_stamp, sheet_checksums
+
+
+class WorkbookWatcher:
+    def __init__(self, ledger, cogs):
+        self.ledger = ledger
+        self.data_file = ledger.data_file
+        # Cogs with a reload_sheets(frames) method, given every changed sheet
+        self.cogs = cogs
+        with ledger.lock, WORKBOOK_LOCK:
+            WORKBOOK_LOCK.writes.pop(self.data_file, None)
+            self.stamp = file_stamp(self.data_file)
+            self.checksums = self.read_checksums(self.stamp) or {}
+
+    def read_checksums(self, stamp):
+        """Checksums per sheet, or None if the file can't be read, e.g. while it is being saved"""
+        if stamp is None:
+            return {}
+        try:
+            return sheet_checksums(self.data_file)
+        except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+            return None
+
+    def check(self):
+        """Apply the sheets changed outside the bot since the last check, returning their names"""
+        if file_stamp(self.data_file) == self.stamp:
+            return []
+        with self.ledger.lock, WORKBOOK_LOCK:
+            stamp = file_stamp(self.data_file)
+            own_writes = WORKBOOK_LOCK.writes.pop(self.data_file, None)
+            checksums = self.read_checksums(stamp)
+            if stamp == self.stamp or checksums is None:
+                return []
+
+            previous_stamp, previous = self.stamp, self.checksums
+            self.stamp, self.checksums = stamp, checksums
+            if own_writes == (previous_stamp, stamp):
+                # Every change since the last check was the bot's own
+                return []
+            changed = [sheet for sheet, checksum in checksums.items() if previous.get(sheet) != checksum]
+            if changed:
+                self.apply(changed)
+            return changed
+
+    def apply(self, changed):
+        try:
+            frames = pd.read_excel(self.data_file, sheet_name=changed, dtype={"Month": str})
+        except Exception as e:
+            print(f"Error reading the sheets changed outside the bot ({', '.join(changed)}): {e}")
+            return
+
+        notes = []
+        for cog in self.cogs:
+            try:
+                notes += cog.reload_sheets(frames)
+            except Exception as e:
+                print(f"Error applying the sheets changed outside the bot to {type(cog).__name__}: {e}")
+        if self.ledger.sheet_name in frames and not self.ledger.archive:
+            try:
+                added, updated, deleted = self.ledger.merge_sheet(frames[self.ledger.sheet_name])
+                if added or updated or deleted:
+                    notes.append(f"expenses: {added} added, {updated} changed, {deleted} removed")
+            except Exception as e:
+                print(f"Error applying the edited Expenses sheet: {e}")
+        print(f"{self.data_file} was changed outside the bot; " + ("; ".join(notes) or "no rows changed"))
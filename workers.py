@@ -0,0 +1,129 @@
+"""Run the bot as one polling process feeding several worker processes
+
+The front process only polls Telegram and hands every update to a worker
+chosen by its chat ID, so all updates of a chat are handled by the same
+worker, in order, and conversations that span several messages keep their
+state. Each worker runs main.load_cogs over the same data.xlsx and
+write-ahead log: every write takes the workbook's file lock, and before each
+update a worker applies what the others appended to the log and reads the
+account, category and recurring sheets again if another worker rewrote them.
+Background jobs only run in the first worker.
+"""
+import multiprocessing
+import time
+from telebot import apihelper
+
+# Updates waiting per worker before the front process blocks
+QUEUE_SIZE = 1000
+
+# Seconds to wait after a failed getUpdates, and the long polling timeout
+RETRY_DELAY = 3
+POLL_TIMEOUT = 20
+
+
+def chat_id(update):
+    """Chat an update belongs to, or 0 for updates without one"""
+    if "callback_query" in update:
+        query = update["callback_query"]
+        return query["message"]["chat"]["id"] if "message" in query else query["from"]["id"]
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    return 0
+
+
+class Coherence:
+    """Brings a worker's in-memory state up to date with what the other workers wrote"""
+
+    def __init__(self, ledger):
+        from storage.workbook import WORKBOOK_LOCK
+
+        self.ledger = ledger
+        self.workbook_lock = WORKBOOK_LOCK
+        self.generation = WORKBOOK_LOCK.generation()
+        # Cogs that can read their sheets again
+        self.reloadable = [listener for listener in ledger.listeners if hasattr(listener, "reload")]
+
+    def refresh(self):
+        with self.ledger.lock, self.workbook_lock:
+            self.generation, changed = self.workbook_lock.changed_since(self.generation)
+            if changed:
+                for cog in self.reloadable:
+                    cog.reload()
+            self.ledger.sync()
+
+    def wrap(self, func):
+        def refreshed():
+            self.refresh()
+            return func()
+        return refreshed
+
+
+def run_worker(index, queue):
+    """Handle the updates of this worker's chats until the front process sends None"""
+    import main
+    from telebot import types
+    from storage.workbook import WORKBOOK_LOCK
+
+    WORKBOOK_LOCK.share(main.DATA_FILE)
+    # Workers starting together must not recover the same log at once
+    with WORKBOOK_LOCK:
+        main.accounts_cog, main.categories_cog, main.add_cog, main.edit_cog = main.load_cogs()
+        ledger = main.add_cog.ledger
+        ledger.share()
+    coherence = Coherence(ledger)
+    if index == 0:
+        for job in main.scheduler.jobs.values():
+            job.func = coherence.wrap(job.func)
+        main.scheduler.start()
+    print(f"Worker {index} started")
+
+    while True:
+        try:
+            update = queue.get()
+        except KeyboardInterrupt:
+            continue
+        if update is None:
+            break
+        try:
+            coherence.refresh()
+            # Updates of one chat must be handled in the order they arrived
+            main.bot.handle_update(types.Update.de_json(update))
+        except Exception as e:
+            print(f"Error handling update {update.get('update_id')} in worker {index}: {e}")
+
+    if index == 0:
+        main.scheduler.stop()
+    ledger.checkpoint()
+
+
+def run_sharded(token, worker_count):
+    """Poll for updates and shard them by chat ID across worker_count worker processes"""
+    # Workers are spawned, so they start from a fresh interpreter instead of a copy of this one
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(QUEUE_SIZE) for _ in range(worker_count)]
+    workers = [context.Process(target=run_worker, args=(index, queue), name=f"worker-{index}")
+               for index, queue in enumerate(queues)]
+    for worker in workers:
+        worker.start()
+
+    offset = None
+    try:
+        while True:
+            try:
+                updates = apihelper.get_updates(token, offset=offset, timeout=POLL_TIMEOUT,
+                                                long_polling_timeout=POLL_TIMEOUT)
+            except Exception as e:
+                print(f"Error polling for updates: {e}")
+                time.sleep(RETRY_DELAY)
+                continue
+            for update in updates:
+                offset = update["update_id"] + 1
+                queues[chat_id(update) % worker_count].put(update)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join()